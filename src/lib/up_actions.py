@@ -0,0 +1,114 @@
+import time
+
+import lib.up_log as log
+
+
+class Action:
+    """
+    One step of an ActionPlan. Motor actions start a move without blocking and are done once their motors
+    stopped. Actions without motors block until they're done, while the motor actions already started keep
+    moving.
+    """
+
+    # An action whose motors never show as running (e.g. a move to where the motor already is) is done
+    # after _START_GRACE seconds
+    _START_GRACE = 0.1
+
+    def __init__(self, name, start, tacho_motors=(), after=()):
+        """
+        :param start: function starting the action. Motor actions must pass block=False.
+        :param tacho_motors: the motors the action moves
+        :param after: the actions that must be done before this one starts
+        """
+        self.name = name
+        self.start = start
+        self.tacho_motors = tacho_motors
+        self.after = after
+        self.result = None  # What start returned
+        self.started = False
+        self.done = False
+        self._start_time = None
+        self._seen_running = False
+
+    def ready(self):
+        for action in self.after:
+            if not action.done:
+                return False
+        return True
+
+    def begin(self):
+        self.started = True
+        self._start_time = time.time()
+        self.result = self.start()
+        if not self.tacho_motors:
+            self.done = True
+
+    def check(self):
+        """:return: whether the action is done"""
+        if self.done:
+            return True
+
+        for tacho_motor in self.tacho_motors:
+            if tacho_motor.is_running:
+                self._seen_running = True
+                return False
+
+        if self._seen_running or time.time() - self._start_time >= Action._START_GRACE:
+            self.done = True
+        return self.done
+
+
+class ActionPlan:
+    """
+    Runs Lift, Swivel and Mover actions as soon as the actions they depend on are done, so that
+    independent moves happen at the same time.
+    """
+
+    _POLL = 0.01
+    _DEFAULT_TIMEOUT = 10
+
+    def __init__(self):
+        self.actions = []
+
+    def add(self, name, start, tacho_motors=(), after=()):
+        """Adds an Action and returns it, to be used in the after of later actions"""
+        action = Action(name, start, tacho_motors, after)
+        self.actions.append(action)
+        return action
+
+    def run(self, until=None, timeout=_DEFAULT_TIMEOUT):
+        """
+        Starts the actions in dependency order and waits for them.
+        :param until: only wait for these actions (and what they depend on). The others keep going
+        and can be waited for with another call to run().
+        :return: False if the actions weren't done after timeout seconds
+        """
+        waited_for = self.actions if until is None else until
+        end = time.time() + timeout
+
+        while True:
+            # Start the motor actions first so they move while a blocking one runs
+            ready = [action for action in self.actions if not action.started and action.ready()]
+            for action in ready:
+                if action.tacho_motors:
+                    action.begin()
+            for action in ready:
+                if not action.tacho_motors:
+                    action.begin()
+
+            running = False
+            for action in self.actions:
+                if action.started and not action.check():
+                    running = True
+
+            if all(action.done for action in waited_for):
+                return True
+            if not running and not any(action.ready() for action in self.actions if not action.started):
+                raise ValueError("Actions %s depend on actions that can't run" % ", ".join(
+                    action.name for action in self.actions if not action.started))
+            if time.time() >= end:
+                log.warning("Actions %s not done after %s s", ", ".join(
+                    action.name for action in waited_for if not action.done), timeout)
+                return False
+
+            time.sleep(ActionPlan._POLL)
@@ -0,0 +1,150 @@
+import struct
+import time
+
+import lib.up_log as log
+import lib.up_sensors as sensors
+
+# Reflected light on black and white the thresholds in the code were tuned for
+NOMINAL_BLACK = sensors.RGBClassifier._DEFAULT_BLACK_REFLECTED
+NOMINAL_WHITE = sensors.RGBClassifier._DEFAULT_WHITE_REFLECTED
+
+# A sweep with less difference between black and white didn't cross the line
+MIN_CONTRAST = 20
+
+# Colors of the mat an RGB reference is kept for, in the order they are stored
+REFERENCE_COLORS = (sensors.BLACK, sensors.WHITE, sensors.BLUE, sensors.GREEN, sensors.YELLOW, sensors.RED)
+
+_SWEEP_SECONDS = 5
+_HOLD_SECONDS = 0.5
+_SAMPLE_PERIOD = 0.01
+
+_MAGIC = b"UPCL"
+_VERSION = 1
+_HEADER_FORMAT = "<4sBB"  # magic, version, number of sensors
+# Port, reflected light on black and white, raw RGB of every REFERENCE_COLORS (all 0 when not calibrated),
+# color of every HiTechnic code (_NOT_CALIBRATED when not seen)
+_ENTRY_FORMAT = "<16sBB%sH%sB" % (3 * len(REFERENCE_COLORS), len(sensors.HiTechnicSensor._CODE_TO_COLOR))
+_NOT_CALIBRATED = 255
+
+
+class SensorCalibration:
+    """What one sensor reads on the mat, and the thresholds derived from it"""
+
+    def __init__(self, black=NOMINAL_BLACK, white=NOMINAL_WHITE, references=None, code_colors=None):
+        """
+        :param black, white: reflected light on the black line and on the white mat
+        :param references: pairs of (color, (red, green, blue)) raw readings for an RGBClassifier, or None
+        :param code_colors: dict of the color each HiTechnic code was read on, or None
+        """
+        self.black = black
+        self.white = white
+        self.references = references
+        self.code_colors = code_colors
+        self.scale = (white - black) / (NOMINAL_WHITE - NOMINAL_BLACK)
+
+    def threshold(self, nominal):
+        """Converts a reflected light value tuned for NOMINAL_BLACK and NOMINAL_WHITE to this sensor"""
+        return self.black + (nominal - NOMINAL_BLACK) * self.scale
+
+
+def save(path, calibrations):
+    """:param calibrations: dict of SensorCalibration by port"""
+    code_count = len(sensors.HiTechnicSensor._CODE_TO_COLOR)
+    with open(path, "wb") as file:
+        file.write(struct.pack(_HEADER_FORMAT, _MAGIC, _VERSION, len(calibrations)))
+        for port, calibration in calibrations.items():
+            rgb = [0] * (3 * len(REFERENCE_COLORS))
+            if calibration.references is not None:
+                for color, reference in calibration.references:
+                    index = 3 * REFERENCE_COLORS.index(color)
+                    rgb[index:index + 3] = reference
+
+            colors = [_NOT_CALIBRATED] * code_count
+            if calibration.code_colors is not None:
+                for code, color in calibration.code_colors.items():
+                    if 0 <= code < code_count:
+                        colors[code] = color
+
+            file.write(struct.pack(_ENTRY_FORMAT, port.encode(), int(round(calibration.black)),
+                                   int(round(calibration.white)), *(rgb + colors)))
+
+
+def load(path):
+    """Returns the dict of SensorCalibration by port saved in path, empty if there isn't a valid one"""
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError:
+        log.info("No calibration at %s, using the nominal thresholds", path)
+        return {}
+
+    header_size = struct.calcsize(_HEADER_FORMAT)
+    entry_size = struct.calcsize(_ENTRY_FORMAT)
+    magic, version, count = struct.unpack(_HEADER_FORMAT, data[:header_size])
+    if magic != _MAGIC or version != _VERSION or len(data) != header_size + count * entry_size:
+        log.warning("%s isn't a calibration this version can read, using the nominal thresholds", path)
+        return {}
+
+    calibrations = {}
+    reference_values = 3 * len(REFERENCE_COLORS)
+    for number in range(count):
+        fields = struct.unpack_from(_ENTRY_FORMAT, data, header_size + number * entry_size)
+        port = fields[0].rstrip(b"\0").decode()
+        rgb = fields[3:3 + reference_values]
+        colors = fields[3 + reference_values:]
+
+        references = None
+        if any(rgb):
+            references = tuple((REFERENCE_COLORS[index], tuple(rgb[3 * index:3 * index + 3]))
+                               for index in range(len(REFERENCE_COLORS)))
+
+        code_colors = None
+        if any(color != _NOT_CALIBRATED for color in colors):
+            code_colors = {}
+            for code in range(len(colors)):
+                if colors[code] != _NOT_CALIBRATED:
+                    code_colors[code] = colors[code]
+
+        calibrations[port] = SensorCalibration(fields[1], fields[2], references, code_colors)
+    return calibrations
+
+
+def sweep_reflected(sensor, seconds=_SWEEP_SECONDS):
+    """
+    Reads the reflected light while the sensor is moved back and forth across the line.
+    :return: (black, white), the 5th and 95th percentiles of the readings so a stray reading doesn't count
+    """
+    sensor.set_mode(sensors.REFLECTED)
+    values = _read_for(sensor, seconds)
+    values.sort()
+    return values[len(values) * 5 // 100], values[len(values) * 95 // 100]
+
+
+def average_rgb(sensor, seconds=_HOLD_SECONDS):
+    """Returns the mean raw (red, green, blue) while the sensor is held over one color"""
+    sensor.set_mode(sensors.RGB)
+    values = _read_for(sensor, seconds)
+    totals = [0, 0, 0]
+    for rgb in values:
+        totals[0] += rgb >> 20
+        totals[1] += (rgb >> 10) & 0x3FF
+        totals[2] += rgb & 0x3FF
+    return tuple(int(round(total / len(values))) for total in totals)
+
+
+def most_common_code(sensor, seconds=_HOLD_SECONDS):
+    """Returns the HiTechnic code read most often while the sensor is held over one color"""
+    sensor.set_mode(sensor.MODE_COLOR)
+    counts = {}
+    for code in _read_for(sensor, seconds):
+        counts[code] = counts.get(code, 0) + 1
+    return max(counts, key=lambda code: counts[code])
+
+
+def _read_for(sensor, seconds):
+    values = []
+    end = time.time() + seconds
+    while not values or time.time() < end:
+        values.append(sensor.read_value())
+        time.sleep(_SAMPLE_PERIOD)
+    return values
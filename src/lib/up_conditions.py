@@ -0,0 +1,223 @@
+import time
+
+import lib.up_timing as timing
+
+try:
+    import select
+except ImportError:
+    select = None
+
+_DEFAULT_FREQUENCY = 200
+
+
+class TimedOut(Exception):
+    """Raised by the waits that give up after a timeout, the run can't go on from where the robot is"""
+
+
+class Condition:
+    """
+    Base of the composed conditions below, which define check() returning whether they're met.
+    Sensor Watches and OdometryTriggers are conditions as they are, anything with a check() method can be
+    composed.
+    """
+
+    name = None
+
+    def restart(self):
+        """Forgets what was seen so far, called when a Sequence gets to the condition"""
+
+    def files(self):
+        """Returns the sysfs attribute files whose driver notifies changes through poll()"""
+        return ()
+
+    def __str__(self):
+        return self.name or self.__class__.__name__
+
+
+class AnyOf(Condition):
+    """Met as soon as one of the conditions is. fired is the one that was."""
+
+    def __init__(self, *conditions, name=None):
+        self.conditions = conditions
+        self.name = name
+        self.fired = None
+
+    def restart(self):
+        self.fired = None
+        for condition in self.conditions:
+            _restart(condition)
+
+    def check(self):
+        for condition in self.conditions:
+            if condition.check():
+                self.fired = condition
+                return True
+        return False
+
+    def files(self):
+        return _all_files(self.conditions)
+
+
+class AllOf(Condition):
+    """Met once every condition has been met, not necessarily at the same time"""
+
+    def __init__(self, *conditions, name=None):
+        self.conditions = conditions
+        self.name = name
+        self._met = [False] * len(conditions)
+
+    def restart(self):
+        self._met = [False] * len(self.conditions)
+        for condition in self.conditions:
+            _restart(condition)
+
+    def check(self):
+        met = self._met
+        done = True
+        for index in range(len(met)):
+            if not met[index]:
+                met[index] = bool(self.conditions[index].check())
+                done = done and met[index]
+        return done
+
+    def files(self):
+        return _all_files(self.conditions)
+
+
+class Sequence(Condition):
+    """Met once the conditions were met one after the other. A condition is only checked after the previous one."""
+
+    def __init__(self, *conditions, name=None):
+        self.conditions = conditions
+        self.name = name
+        self._stage = 0
+
+    def restart(self):
+        self._stage = 0
+        _restart(self.conditions[0])
+
+    def check(self):
+        if not self.conditions[self._stage].check():
+            return False
+
+        self._stage += 1
+        if self._stage == len(self.conditions):
+            return True
+        _restart(self.conditions[self._stage])
+        return False
+
+    def files(self):
+        return _all_files(self.conditions)
+
+
+class Threshold(Sequence):
+    """
+    Reflected light crossing a threshold with hysteresis: when falling, met once the reading drops to low
+    after having been at or above high (and the other way around when rising), so noise around a single
+    cutoff doesn't trigger it. low and high are nominal values, converted with the sensor's calibration.
+    """
+
+    def __init__(self, sensor, low, high, falling=True, name=None):
+        low = sensor.reflected_threshold(low)
+        high = sensor.reflected_threshold(high)
+        above = sensor.watch_reflected(lambda value: value >= high)
+        below = sensor.watch_reflected(lambda value: value <= low)
+        if falling:
+            Sequence.__init__(self, above, below, name=name)
+        else:
+            Sequence.__init__(self, below, above, name=name)
+
+
+class Timeout(Condition):
+    """Met once seconds have passed since it was created or restarted"""
+
+    def __init__(self, seconds, name=None):
+        self.seconds = seconds
+        self.name = name
+        self._start = time.time()
+
+    def restart(self):
+        self._start = time.time()
+
+    def check(self):
+        return time.time() - self._start >= self.seconds
+
+
+class MotorsStopped(Condition):
+    """
+    Met once none of the motors is running. The tacho motor driver notifies changes of its state attribute,
+    so wait() sleeps in poll() on it and wakes up as soon as a motor stops.
+    """
+
+    def __init__(self, tacho_motors, name=None):
+        self.tacho_motors = tacho_motors
+        self.name = name
+        self._state_files = [tacho_motor._attribute_file_open("state") for tacho_motor in tacho_motors]
+
+    def check(self):
+        # Reading the file also acknowledges the notification poll() woke up for
+        for state_file in self._state_files:
+            state_file.seek(0)
+            if "running" in state_file.read().decode():
+                return False
+        return True
+
+    def files(self):
+        return self._state_files
+
+
+def wait(condition, frequency=_DEFAULT_FREQUENCY, hub=None, on_cycle=None):
+    """
+    Checks the condition frequency times per second until it's met, sleeping in between instead of spinning.
+    When the condition watches files that notify changes, the sleep wakes up early on a change.
+    :param hub: SensorHub ticked before every check
+    :param on_cycle: function called after every check that wasn't met (e.g. to record telemetry)
+    :return: the condition that fired, the innermost one when an AnyOf fired
+    """
+    scheduler = timing.LoopScheduler(frequency, sleep=_poll_sleep(condition))
+    while True:
+        scheduler.wait()
+        if hub is not None:
+            hub.tick()
+        if condition.check():
+            return fired(condition)
+        if on_cycle is not None:
+            on_cycle()
+
+
+def fired(condition):
+    """Returns the condition that made condition met, following AnyOfs down"""
+    while isinstance(condition, AnyOf) and condition.fired is not None:
+        condition = condition.fired
+    return condition
+
+
+def _restart(condition):
+    if hasattr(condition, "restart"):
+        condition.restart()
+
+
+def _files(condition):
+    if hasattr(condition, "files"):
+        return condition.files()
+    return ()
+
+
+def _all_files(conditions):
+    files = []
+    for condition in conditions:
+        files.extend(_files(condition))
+    return files
+
+
+def _poll_sleep(condition):
+    """Returns a function sleeping until a file of condition notifies or the time is up, None to use time.sleep"""
+    priority = getattr(select, "POLLPRI", None)
+    files = [file for file in _files(condition) if hasattr(file, "fileno")]
+    if priority is None or not files:
+        return None
+
+    poller = select.poll()
+    for file in files:
+        poller.register(file, priority)
+    return lambda seconds: poller.poll(int(seconds * 1000))
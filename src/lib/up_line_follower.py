@@ -1,5 +1,9 @@
 import time
+import lib.up_conditions as conditions
+import lib.up_log as log
 import lib.up_sensors as sensors
+import lib.up_telemetry as telemetry
+import lib.up_timing as timing
 
 
 class LineFollower:
@@ -11,54 +15,174 @@ class LineFollower:
     _DEFAULT_KD = 1
     _DEFAULT_SPEED = 65
 
-    def __init__(self, mover, front_sensor, back_sensor):
+    # Rate the control loop runs at. kd is tuned for the change in error over one cycle at this rate.
+    _DEFAULT_FREQUENCY = 100
+
+    # The follow_until_*() methods stop the robot and raise conditions.TimedOut after this many seconds, so a
+    # missed line ends the run instead of following the line forever. A quarter of the competition's two
+    # minutes, no segment of a run that can still finish takes that long. None follows until the condition
+    # is met.
+    _DEFAULT_TIMEOUT = 30
+
+    # Speed scheduling (follow() with max_speed): the speed goes from its maximum when the smoothed error is
+    # under _STEADY_ERROR to its minimum at _LARGE_ERROR, where a single reading also drops it right away.
+    # It rises by at most _SPEED_RISE per cycle.
+    _STEADY_ERROR = 5
+    _LARGE_ERROR = 15
+    _ERROR_SMOOTHING = 0.1
+    _SPEED_RISE = 0.5
+
+    # Stages of a follow() cycle, as recorded by the stage timer
+    STAGES = ("wait", "read", "math", "steer")
+    _STAGE_WAIT = 0
+    _STAGE_READ = 1
+    _STAGE_MATH = 2
+    _STAGE_STEER = 3
+
+    def __init__(self, mover, front_sensor, back_sensor, frequency=_DEFAULT_FREQUENCY, hub=None):
+        """
+        :param frequency: the number of control cycles per second. None runs the loop as fast as the sensors allow.
+        :param hub: SensorHub sampled at the start of every cycle
+        """
         self.mover = mover
         self.back_sensor = back_sensor
         self.front_sensor = front_sensor
+        self.hub = hub
+        self.scheduler = timing.LoopScheduler(frequency)
+        self.stage_timer = None
+        self.recorder = None  # TelemetryRecorder that gets a record every cycle
         self.last_error = None
         self.direction = None
+        self.scheduled_speed = None
+        self._average_error = None
+        self._nominal_dt = 1 / LineFollower._DEFAULT_FREQUENCY
+        # Cycles since the last reset() and how many of them steered at +-100, logged once by reset()
+        self.cycles = 0
+        self.saturated_cycles = 0
+
+    def profile(self,
+                on_left=True,
+                kp=_DEFAULT_KP,
+                kd=_DEFAULT_KD,
+                speed=_DEFAULT_SPEED,
+                backwards=False,
+                max_speed=None):
+        """Returns the FollowProfile for these settings, to be bound once before a loop of follow_profile()"""
+        return FollowProfile(self.back_sensor if backwards else self.front_sensor, on_left, kp, kd, speed,
+                             backwards, max_speed)
 
     def follow(self,
                on_left=True,
                kp=_DEFAULT_KP,
                kd=_DEFAULT_KD,
                speed=_DEFAULT_SPEED,
-               backwards=False):
+               backwards=False,
+               max_speed=None):
         """
         Method used to follow the line.
+        Builds a profile on every call, loops should bind one with profile() and call follow_profile().
+        :param max_speed: speed up to this while the line is straight, speed becoming the minimum used
+        ahead of large corrections. None keeps the speed constant.
         """
+        self.follow_profile(self.profile(on_left, kp, kd, speed, backwards, max_speed))
 
-        if backwards:
-            sensor_value = self.back_sensor.get_reflected()
-        else:
-            sensor_value = self.front_sensor.get_reflected()
+    def follow_profile(self, profile):
+        """
+        Runs one control cycle with the settings of profile.
+        Waits for the start of the next control cycle so that consecutive calls run at a fixed rate.
+        """
+
+        stage_timer = self.stage_timer
+        if stage_timer is not None:
+            stage_timer.start()
+
+        dt = self.scheduler.wait()
+        if stage_timer is not None:
+            stage_timer.mark(self._STAGE_WAIT)
 
-        error = self._MIDDLE_VALUE - sensor_value
+        if self.hub is not None:
+            self.hub.tick()
+
+        sensor_value = profile.sensor.get_reflected()
+
+        if stage_timer is not None:
+            stage_timer.mark(self._STAGE_READ)
+
+        # In nominal units whatever the sensor's calibration, so the gains don't depend on it
+        error = (profile.middle - sensor_value) * profile.error_scale
+        kp = profile.kp
 
         if self.last_error is None:
-            self.direction = kp * error
+            direction = kp * error
         else:
-            self.direction = kp * error + kd * (error - self.last_error)
+            if dt <= 0:
+                dt = self._nominal_dt
+            # Scale the derivative by the real elapsed time so a stalled cycle doesn't change its meaning
+            direction = kp * error + profile.kd * (error - self.last_error) * self._nominal_dt / dt
+
+        direction *= profile.sign
 
-        if on_left != backwards:
-            self.direction *= -1
+        if direction > 100:
+            direction = 100
+            self.saturated_cycles += 1
+        elif direction < -100:
+            direction = -100
+            self.saturated_cycles += 1
+        self.direction = direction
+        self.cycles += 1
 
-        if self.direction > 100:
-            self.direction = 100
-            print("Warning: Steering at +100")
-        if self.direction < -100:
-            self.direction = -100
-            print("Warning: Steering at -100")
+        speed = profile.speed
+        if profile.max_speed is not None:
+            speed = self._schedule_speed(error, speed, profile.max_speed)
 
-        self.mover.steer(self.direction, speed=(speed * (-0.8 if backwards else 1)))
+        if stage_timer is not None:
+            stage_timer.mark(self._STAGE_MATH)
+
+        self.mover.steer(direction, speed=speed * profile.speed_factor)
 
         self.last_error = error
 
+        if stage_timer is not None:
+            stage_timer.mark(self._STAGE_STEER)
+            stage_timer.next_cycle()
+
+        if self.recorder is not None:
+            self.recorder.record(sensor_value, error, direction, profile.flags, kp, profile.kd, speed)
+
+    def _schedule_speed(self, error, min_speed, max_speed):
+        """Raises the speed while the error stays small and drops it as soon as a large correction starts"""
+        error = abs(error)
+        if self._average_error is None:
+            self._average_error = error
+        else:
+            self._average_error += (error - self._average_error) * self._ERROR_SMOOTHING
+
+        if error >= self._LARGE_ERROR:
+            target = min_speed
+        else:
+            share = (self._LARGE_ERROR - self._average_error) / (self._LARGE_ERROR - self._STEADY_ERROR)
+            target = min_speed + (max_speed - min_speed) * min(1, max(0, share))
+
+        if self.scheduled_speed is None:
+            self.scheduled_speed = min_speed
+        if target < self.scheduled_speed:
+            self.scheduled_speed = target
+        elif target > self.scheduled_speed + self._SPEED_RISE:
+            self.scheduled_speed += self._SPEED_RISE
+        else:
+            self.scheduled_speed = target
+        return self.scheduled_speed
+
+    def time_stages(self, cycles=timing.StageTimer._DEFAULT_SIZE):
+        """Starts recording how long each stage of follow() takes over the last cycles"""
+        self.stage_timer = timing.StageTimer(self.STAGES, size=cycles)
+
     def follow_for_time(self, time_in_sec, stop=True, **kwargs):
+        profile = self.profile(**kwargs)
         start_time = time.time()
 
         while time.time() < start_time + time_in_sec:
-            self.follow(**kwargs)
+            self.follow_profile(profile)
 
 
         if stop:
@@ -66,62 +190,75 @@ class LineFollower:
             self.mover.stop()
 
 
-    def follow_until_color(self, color_sensor: sensors.ColorSensor, colours, stop=True, **kwargs):
-        while not color_sensor.get_color() in colours:
-            self.follow(**kwargs)
+    def follow_until_color(self, color_sensor: sensors.ColorSensor, colours, stop=True, timeout=_DEFAULT_TIMEOUT,
+                           **kwargs):
+        profile = self.profile(**kwargs)
+        until = self._until(color_sensor.watch_color(lambda color: color in colours), timeout)
+        while not until.check():
+            self.follow_profile(profile)
+        self._raise_if_timed_out(until, "colors %s" % (colours,))
 
-        print("Mark")
+        log.debug("Mark")
         if stop:
             self.mover.stop()
             self.reset()
 
-    def follow_until_line(self, color_sensor: sensors.ColorSensor, stop=True, **kwargs):
-        self.follow_until_color(color_sensor, (sensors.BLACK,), stop=stop, **kwargs)
+    def follow_until_line(self, color_sensor: sensors.ColorSensor, stop=True, timeout=_DEFAULT_TIMEOUT, **kwargs):
+        self.follow_until_color(color_sensor, (sensors.BLACK,), stop=stop, timeout=timeout, **kwargs)
 
     def follow_until_intersection_x(self, number_of_intersections, color_sensor, include_initial_delay=False, stop=True, use_reflection=False,
-                                    **kwargs):
+                                    timeout=_DEFAULT_TIMEOUT, **kwargs):
         if include_initial_delay:
             self.follow_for_time(0.1, stop=False, **kwargs)
 
-        for i in range(number_of_intersections):
-            if use_reflection:
-                self.follow_until_cutoff(color_sensor, 40, False, stop=False, **kwargs)
-            else:
-                self.follow_until_line(color_sensor, stop=False, **kwargs)
-
-            if i != number_of_intersections - 1:
-                if use_reflection:
-                    self.follow_until_cutoff(color_sensor, 50, True, stop=False, **kwargs)
-                else:
-                    self.follow_for_time(0.1, stop=False, **kwargs)
+        profile = self.profile(**kwargs)
+        counter = IntersectionCounter(color_sensor, self.mover.odometry, use_reflection=use_reflection)
+        timer = None if timeout is None else conditions.Timeout(timeout)
+        while counter.update() < number_of_intersections:
+            if timer is not None and timer.check():
+                self._time_out("Counted %s of %s intersections in %s s" % (counter.count, number_of_intersections,
+                                                                          timeout))
+            self.follow_profile(profile)
 
         if stop:
             self.mover.stop()
             self.reset()
 
-    def follow_until_cutoff(self, sensor: sensors.EV3ColorSensor, cutoff, greater_than, stop=True, **kwargs):
+    def follow_until_cutoff(self, sensor: sensors.EV3ColorSensor, cutoff, greater_than, stop=True,
+                            timeout=_DEFAULT_TIMEOUT, **kwargs):
+        threshold = sensor.reflected_threshold(cutoff)
         if greater_than:
-            while sensor.get_reflected() < cutoff:
-                self.follow(**kwargs)
+            watch = sensor.watch_reflected(lambda value: value >= threshold)
         else:
-            while sensor.get_reflected() > cutoff:
-                self.follow(**kwargs)
+            watch = sensor.watch_reflected(lambda value: value <= threshold)
+
+        profile = self.profile(**kwargs)
+        until = self._until(watch, timeout)
+        while not until.check():
+            self.follow_profile(profile)
+        self._raise_if_timed_out(until, "cutoff %s" % cutoff)
 
         if stop:
             self.mover.stop()
             self.reset()
 
-    def follow_until_constant(self, stop=True, cutoff=6, cycles=10, use_correction=True, **kwargs):
+    def follow_until_constant(self, stop=True, cutoff=6, cycles=10, use_correction=True, timeout=_DEFAULT_TIMEOUT,
+                              **kwargs):
         def get_value():
             if use_correction:
                 return self.direction
             else:
                 return self.last_error
         
+        profile = self.profile(**kwargs)
+        timer = None if timeout is None else conditions.Timeout(timeout)
         in_a_row = 0
         while True:
-            print(get_value())
-            self.follow(**kwargs)
+            if timer is not None and timer.check():
+                self._time_out("Correction not constant after %s s" % timeout)
+            if log.level <= log.DEBUG:
+                log.debug("Correction %s", get_value())
+            self.follow_profile(profile)
             if get_value() is None:
                 in_a_row = 0
                 continue
@@ -138,16 +275,22 @@ class LineFollower:
             self.reset()
             self.mover.stop()
 
-    def follow_until_change(self, stop=True, cutoff=10, cycles=10,  use_correction=True, **kwargs):
+    def follow_until_change(self, stop=True, cutoff=10, cycles=10,  use_correction=True, timeout=_DEFAULT_TIMEOUT,
+                            **kwargs):
         def get_value():
             if use_correction:
                 return self.direction
             else:
                 return self.last_error
+        profile = self.profile(**kwargs)
+        timer = None if timeout is None else conditions.Timeout(timeout)
         in_a_row = 0
         while True:
-            print(get_value())
-            self.follow(**kwargs)
+            if timer is not None and timer.check():
+                self._time_out("Correction didn't change after %s s" % timeout)
+            if log.level <= log.DEBUG:
+                log.debug("Correction %s", get_value())
+            self.follow_profile(profile)
             if get_value() is None:
                 in_a_row = 0
                 continue
@@ -164,5 +307,117 @@ class LineFollower:
             self.mover.stop()
             self.reset()
 
+    @staticmethod
+    def _until(condition, timeout):
+        """Returns condition, or a condition also met after timeout seconds unless timeout is None"""
+        if timeout is None:
+            return condition
+        return conditions.AnyOf(condition, conditions.Timeout(timeout))
+
+    def _raise_if_timed_out(self, until, what):
+        fired = conditions.fired(until)
+        if isinstance(fired, conditions.Timeout):
+            self._time_out("Followed for %s s without reaching %s" % (fired.seconds, what))
+
+    def _time_out(self, message):
+        """Stops the robot where the follow gave up and raises conditions.TimedOut"""
+        self.mover.stop()
+        self.reset()
+        raise conditions.TimedOut(message)
+
     def reset(self):
+        """Ends a stretch of line following: the next cycle starts afresh"""
+        if self.saturated_cycles:
+            log.warning("Steering saturated at +-100 for %s of %s cycles", self.saturated_cycles, self.cycles)
+        self.cycles = 0
+        self.saturated_cycles = 0
         self.last_error = None
+        self.scheduled_speed = None
+        self._average_error = None
+        self.scheduler.reset()
+
+
+class FollowProfile:
+    """
+    Settings of a stretch of line following, with the sensor, its calibrated middle value, steering sign, speed
+    factor and telemetry flags worked out once so that a control cycle only reads attributes. Not changed once built.
+    """
+
+    __slots__ = ("sensor", "on_left", "kp", "kd", "speed", "backwards", "max_speed", "sign", "middle",
+                 "error_scale", "speed_factor", "flags")
+
+    def __init__(self, sensor, on_left, kp, kd, speed, backwards, max_speed):
+        self.sensor = sensor
+        self.on_left = on_left
+        self.kp = kp
+        self.kd = kd
+        self.speed = speed
+        self.backwards = backwards
+        self.max_speed = max_speed
+        self.sign = -1 if on_left != backwards else 1
+        self.middle = sensor.reflected_threshold(LineFollower._MIDDLE_VALUE)
+        self.error_scale = 1 / sensor.reflected_scale()
+        self.speed_factor = -0.8 if backwards else 1
+
+        flags = telemetry.FLAG_FOLLOWING
+        if backwards:
+            flags |= telemetry.FLAG_BACKWARDS
+        if on_left:
+            flags |= telemetry.FLAG_ON_LEFT
+        self.flags = flags
+
+
+class IntersectionCounter:
+    """
+    Counts the lines a sensor crosses, whatever the speed.
+    A line starts on a dark reading and ends on a light one, with a gap between the two in reflection mode
+    (hysteresis). It's counted once the sensor stayed on it for _MIN_WIDTH mm (debounce), and lines starting
+    less than _MIN_SPACING mm after the last one counted are ignored. Distances come from the odometry.
+    Counting _MIN_WIDTH mm into a line, follow_until_intersection_x() stops that much further than on the first
+    dark reading, less than the robot travels between two readings at speed 50.
+    """
+
+    _DARK = 40  # Nominal reflected light at or under which a line starts
+    _LIGHT = 50  # Nominal reflected light at or over which it ends
+    _MIN_WIDTH = 3
+    _MIN_SPACING = 40
+
+    def __init__(self, sensor, odometry, use_reflection=True):
+        """:param use_reflection: use the reflected light, otherwise black in color mode is a line"""
+        self.sensor = sensor
+        self.odometry = odometry
+        self.use_reflection = use_reflection
+        self._dark = sensor.reflected_threshold(self._DARK)
+        self._light = sensor.reflected_threshold(self._LIGHT)
+        self.count = 0
+        self._line_start = None  # Distance at which the sensor got on the line it's on
+        self._counted = False  # Whether the line the sensor is on was counted
+        self._last_counted = None
+
+    def update(self):
+        """Reads the sensor and returns the number of lines counted"""
+        if self.use_reflection:
+            value = self.sensor.get_reflected()
+            dark = value <= self._dark
+            light = value >= self._light
+        else:
+            dark = self.sensor.get_color() == sensors.BLACK
+            light = not dark
+
+        if self._line_start is None:
+            if dark:
+                self.odometry.update()
+                distance = self.odometry.distance
+                if self._last_counted is None or distance - self._last_counted >= self._MIN_SPACING:
+                    self._line_start = distance
+                    self._counted = False
+        elif light:
+            self._line_start = None
+        elif not self._counted:
+            self.odometry.update()
+            if self.odometry.distance - self._line_start >= self._MIN_WIDTH:
+                self.count += 1
+                self._counted = True
+                self._last_counted = self._line_start
+
+        return self.count
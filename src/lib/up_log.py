@@ -0,0 +1,98 @@
+import array
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# Messages under this level are dropped. In a hot loop, check it before logging so that a disabled level
+# costs one comparison: if log.level <= log.DEBUG: log.debug("Correction %s", direction)
+level = INFO
+
+# Messages are kept with their arguments in a ring buffer allocated up front and only formatted and printed
+# by flush(), called while the robot is idle or after the run
+_SIZE = 512
+
+_times = array.array("d", [0] * _SIZE)
+_levels = bytearray(_SIZE)
+_messages = [None] * _SIZE
+_arguments = [None] * _SIZE
+_count = 0  # Number of messages ever logged. The next one goes in _count % _SIZE.
+_flushed = 0  # Number of messages printed or overwritten
+_start_time = time.time()
+
+
+def reset():
+    """Forgets the buffered messages and counts time from now"""
+    global _count, _flushed, _start_time
+    for index in range(_SIZE):
+        _messages[index] = None
+        _arguments[index] = None
+    _count = 0
+    _flushed = 0
+    _start_time = time.time()
+
+
+def set_level(new_level):
+    global level
+    level = new_level
+
+
+def log(message_level, message, *arguments):
+    """Buffers message, formatted with % and arguments when flushed"""
+    global _count
+    if message_level < level:
+        return
+
+    index = _count % _SIZE
+    _times[index] = time.time() - _start_time
+    _levels[index] = message_level
+    _messages[index] = message
+    _arguments[index] = arguments
+    _count += 1
+
+
+def debug(message, *arguments):
+    if DEBUG >= level:
+        log(DEBUG, message, *arguments)
+
+
+def info(message, *arguments):
+    if INFO >= level:
+        log(INFO, message, *arguments)
+
+
+def warning(message, *arguments):
+    log(WARNING, message, *arguments)
+
+
+def error(message, *arguments):
+    log(ERROR, message, *arguments)
+
+
+def flush(write=print, until=None):
+    """
+    Formats and writes the buffered messages, oldest first.
+    :param until: time.time() to stop at, the messages left are written by the next flush
+    """
+    global _flushed
+    end = _count
+    if end - _flushed > _SIZE:
+        write("WARNING: log buffer full, lost %s messages" % (end - _SIZE - _flushed))
+        _flushed = end - _SIZE
+
+    while _flushed < end:
+        if until is not None and time.time() >= until:
+            return
+        index = _flushed % _SIZE
+        message = _messages[index]
+        arguments = _arguments[index]
+        if arguments:
+            message = message % arguments
+        write("%8.3f %s: %s" % (_times[index], _NAMES.get(_levels[index], _levels[index]), message))
+        _messages[index] = None
+        _arguments[index] = None
+        _flushed += 1
@@ -1,9 +1,42 @@
+import _thread
 import math
 
 import ev3dev2.motor as motor
+import lib.up_log as log
 import lib.up_ports as ports
+import lib.up_timing as timing
 import time
 
+# A motor counts as stopped once its speed stayed under _SETTLE_SPEED (deg/s) for _SETTLE_READINGS readings
+# _SETTLE_POLL seconds apart
+_SETTLE_SPEED = 20
+_SETTLE_READINGS = 2
+_SETTLE_POLL = 0.01
+_SETTLE_TIMEOUT = 0.5
+
+
+def _wait_until_settled(tacho_motors, timeout):
+    """
+    Returns as soon as all the motors have stopped turning.
+    :return: False if they were still turning after timeout seconds
+    """
+    end = time.time() + timeout
+    readings = 0
+    while True:
+        readings += 1
+        for tacho_motor in tacho_motors:
+            if abs(tacho_motor.speed) > _SETTLE_SPEED:
+                readings = 0
+                break
+
+        if readings >= _SETTLE_READINGS:
+            return True
+        if time.time() >= end:
+            log.warning("Motors still turning after %s s", timeout)
+            return False
+        time.sleep(_SETTLE_POLL)
+
+
 class Lift:
     """Class to control arm of robot"""
 
@@ -21,20 +54,53 @@ class Lift:
     def __init__(self):
         self._position = self._POS_UP
         self._lift = motor.MediumMotor(ports.LIFT_MOTOR)
+        self.tacho_motors = (self._lift,)
 
         self._lift.ramp_up_sp = self._ACCELERATION
 
         self._lift.polarity = motor.Motor.POLARITY_NORMAL
+        # True while calibrate(block=False) runs, cleared by the background thread when it's done. A flag the moves
+        # poll rather than a lock, as a lock released by another thread than the one holding it is undefined in
+        # MicroPython's unix port.
+        self._calibrating = False
+        self._calibration_error = None  # What the background calibration raised, raised again by the moves
+
+    def calibrate(self, block=True):
+        """
+        Drives the lift up against its stop and back down a little, to where up() expects it.
+        :param block: False calibrates on a background thread, the lift's moves wait for it to be done
+        """
+        if not block:
+            self._calibrating = True
+            self._calibration_error = None
+            _thread.start_new_thread(self._calibrate_in_background, ())
+            return
 
-    def calibrate(self):
         self._lift.on(self._DEFAULT_SPEED)
         self._lift.wait_until_not_moving()
 
         self._lift.on_for_degrees(self._DEFAULT_SPEED, -50, block=True)
 
         self._position = self._POS_UP
+        self._calibration_error = None
+
+    def _calibrate_in_background(self):
+        try:
+            self.calibrate()
+        except Exception as error:
+            self._calibration_error = error
+        finally:
+            self._calibrating = False
+
+    def wait_until_calibrated(self):
+        """Raises what the background calibration raised, on every call until the lift is calibrated again"""
+        while self._calibrating:
+            time.sleep(_SETTLE_POLL)
+        if self._calibration_error is not None:
+            raise self._calibration_error
 
     def up(self, block=True):
+        self.wait_until_calibrated()
         if self._position == self._POS_FIBRE:
             self._lift.on_for_degrees(self._DEFAULT_SPEED, self._DEG_TO_FIBRE, block=block)
 
@@ -44,27 +110,29 @@ class Lift:
 
             self._position = self._POS_UP
         else:
-            print("WARNING: called Lift.up() when already up")
+            log.warning("Called Lift.up() when already up")
 
     def to_fibre(self, block=True):
         """Lowers arm the degrees to pick up the fibre"""
+        self.wait_until_calibrated()
 
         if self._position == self._POS_UP:
             self._lift.on_for_degrees(self._DEFAULT_SPEED, -self._DEG_TO_FIBRE, block=block)
 
             self._position = self._POS_FIBRE
         else:
-            print("WARNING: called Lift.to_fibre() when not in up position")
+            log.warning("Called Lift.to_fibre() when not in up position")
 
     def to_node(self, block=True):
         """Lowers arm the degrees to pick up the fibre"""
+        self.wait_until_calibrated()
 
         if self._position == self._POS_UP:
             self._lift.on_for_degrees(self._DEFAULT_SPEED, -self._DEG_TO_NODE, block=block)
 
             self._position = self._POS_NODE
         else:
-            print("WARNING: called Lift.to_fibre() when not in up position")
+            log.warning("Called Lift.to_fibre() when not in up position")
 
 
 class Swivel:
@@ -76,6 +144,7 @@ class Swivel:
 
     def __init__(self):
         self._swivel = motor.MediumMotor(ports.SWIVEL_MOTOR)
+        self.tacho_motors = (self._swivel,)
         self._swivel.ramp_up_sp = self._ACCELERATION
         self._swivel.ramp_down_sp = self._ACCELERATION
         self._swivel.position = self._START_POSITION
@@ -93,8 +162,56 @@ class Swivel:
     def back(self, block=True):
         self._swivel.on_to_position(self._DEFAULT_SPEED, 180, block=block)
 
-    def reset(self):
-        self._swivel.on_to_position(self._DEFAULT_SPEED, self._START_POSITION)
+    def reset(self, block=True):
+        self._swivel.on_to_position(self._DEFAULT_SPEED, self._START_POSITION, block=block)
+
+    def wait_until_settled(self, timeout=_SETTLE_TIMEOUT):
+        return _wait_until_settled(self.tacho_motors, timeout)
+
+
+class _MotorWriter:
+    """
+    Runs a motor forever at a speed by writing straight to its attribute files, which stay open.
+    Speeds are quantized and writes that wouldn't change anything are skipped.
+    """
+
+    _SPEED_QUANTUM = 10  # In tacho counts per second
+    _RUN_FOREVER = motor.Motor.COMMAND_RUN_FOREVER.encode()
+
+    def __init__(self, tacho_motor):
+        self._speed_sp_file = tacho_motor._attribute_file_open("speed_sp")
+        self._command_file = tacho_motor._attribute_file_open("command")
+        self._max_speed = tacho_motor.max_speed
+        self._speed_sp = None
+        self._running = False
+        self.writes = 0
+
+    def run(self, speed):
+        """:param speed: in percent of the motor's max speed"""
+        if speed < -100 or speed > 100:
+            raise ValueError("Speed must be between -100 and 100 (inclusive), got %s" % speed)
+
+        quantum = _MotorWriter._SPEED_QUANTUM
+        speed_sp = int(round(speed * self._max_speed / 100 / quantum)) * quantum
+
+        if speed_sp != self._speed_sp:
+            self._write(self._speed_sp_file, str(speed_sp).encode())
+            self._speed_sp = speed_sp
+
+        if not self._running:
+            self._write(self._command_file, self._RUN_FOREVER)
+            self._running = True
+
+    def forget(self):
+        """Call when the motor was commanded some other way. The next run() writes everything again."""
+        self._speed_sp = None
+        self._running = False
+
+    def _write(self, attribute_file, value):
+        attribute_file.seek(0)
+        attribute_file.write(value)
+        attribute_file.flush()
+        self.writes += 1
 
 
 class Mover:
@@ -108,9 +225,16 @@ class Mover:
     _RAMP_UP = 300
     _RAMP_DOWN = 300
 
+    _SEQUENCE_FREQUENCY = 200  # Encoder checks per second in move_sequence()
+    # A move_sequence() segment also ends when its lead wheel stalls, like on_for_degrees() returns, or when
+    # it took _SEQUENCE_TIME_FACTOR times as long as it should at its speed plus _SEQUENCE_TIME_SLACK seconds
+    _SEQUENCE_TIME_FACTOR = 2
+    _SEQUENCE_TIME_SLACK = 0.5
+
     def __init__(self, reverse_motors=False):
         self._mover = motor.MoveTank(ports.LEFT_MOTOR, ports.RIGHT_MOTOR,
                                              motor_class=motor.MediumMotor)
+        self.tacho_motors = (self._mover.left_motor, self._mover.right_motor)
 
         self._mover.left_motor.ramp_up_sp = 0 #self._RAMP_UP
         self._mover.right_motor.ramp_up_sp = 0 #self._RAMP_UP
@@ -123,24 +247,32 @@ class Mover:
             else:
                 my_motor.polarity = motor.Motor.POLARITY_NORMAL
 
+        # Fast path for the run-forever commands sent every control cycle
+        self._left_writer = _MotorWriter(self._mover.left_motor)
+        self._right_writer = _MotorWriter(self._mover.right_motor)
+
+        # Speeds of the last run-forever command (in percent)
+        self.left_speed = 0
+        self.right_speed = 0
+
+        self.odometry = Odometry(self)
+
     def travel(self, distance=None, speed=_DEFAULT_SPEED, block=True, backwards=False):
         """Make the robot move forward or backward a certain number of mm"""
         if distance is None:
             if block:
                 raise ValueError("Can't run forever with block=True")
             if backwards:
-                self._mover.on(-speed, -speed)
+                self._run(-speed, -speed)
             else:
-                self._mover.on(speed, speed)
+                self._run(speed, speed)
         else:
-            degrees_for_wheel = Mover._convert_rad_to_deg(Mover._convert_distance_to_rad(distance))
-            if backwards:
-                self._mover.on_for_degrees(-speed, -speed, degrees_for_wheel, block=block)
-            else:
-                self._mover.on_for_degrees(speed, speed, degrees_for_wheel, block=block)
-            
+            segment = Travel(distance, speed=speed, backwards=backwards)
+            self._forget_fast_path()
+            self._mover.on_for_degrees(segment.left_speed, segment.right_speed, segment.degrees, block=block)
+
             if block:
-                time.sleep(0.1)
+                self.wait_until_settled()
 
     def rotate(self, degrees=None, arc_radius=0, clockwise=True, speed=_DEFAULT_ROTATE_SPEED, block=True,
                backwards=False) -> None:
@@ -161,40 +293,21 @@ class Mover:
 
             if clockwise:
                 if backwards:
-                    self._mover.on(-inside_speed, -speed)
+                    self._run(-inside_speed, -speed)
                 else:
-                    self._mover.on(speed, inside_speed)
+                    self._run(speed, inside_speed)
             else:
                 if backwards:
-                    self._mover.on(-speed, -inside_speed)
+                    self._run(-speed, -inside_speed)
                 else:
-                    self._mover.on(inside_speed, speed)
+                    self._run(inside_speed, speed)
         else:
-            if degrees <= 0:
-                raise ValueError(
-                    "Can't rotate a negative number of degrees. Use clockwise=False to turn counter-clockwise")
-
-            degrees_in_rad = Mover._convert_deg_to_rad(degrees)
-            inside_distance = (arc_radius - Mover.CHASSIS_RADIUS) * degrees_in_rad
-            outside_distance = (arc_radius + Mover.CHASSIS_RADIUS) * degrees_in_rad
-
-            movement_time = outside_distance / speed
-            inside_speed = inside_distance / movement_time
-            outside_degrees = Mover._convert_rad_to_deg(Mover._convert_distance_to_rad(outside_distance))
-
-            if clockwise:
-                if backwards:
-                    self._mover.on_for_degrees(-inside_speed, -speed, outside_degrees, block=block)
-                else:
-                    self._mover.on_for_degrees(speed, inside_speed, outside_degrees, block=block)
-            else:
-                if backwards:
-                    self._mover.on_for_degrees(-speed, -inside_speed, outside_degrees, block=block)
-                else:
-                    self._mover.on_for_degrees(inside_speed, speed, outside_degrees, block=block)
+            arc = Arc(degrees, arc_radius=arc_radius, clockwise=clockwise, speed=speed, backwards=backwards)
+            self._forget_fast_path()
+            self._mover.on_for_degrees(arc.left_speed, arc.right_speed, arc.degrees, block=block)
 
             if block:
-                time.sleep(0.1)
+                self.wait_until_settled()
 
     def steer(self, steering, speed=_DEFAULT_SPEED):
         """Make the robot move in a direction. -100 is to the left. +100 is to the right. 0 is straight"""
@@ -207,15 +320,69 @@ class Mover:
         inside_speed = speed - speed * abs(steering) / 50
 
         if steering >= 0:
-            self._mover.on(speed, inside_speed)
+            self._run(speed, inside_speed)
         else:
-            self._mover.on(inside_speed, speed)
+            self._run(inside_speed, speed)
+
+    def move_sequence(self, segments, stop=True):
+        """
+        Drives Travel and Arc segments one after the other without stopping in between.
+        A segment ends once its fastest wheel turned the segment's degrees in the direction the segment drives
+        it, measured on the encoder. A wheel still turning the other way after a reversal doesn't count.
+        A segment whose wheel stalls or is far too slow ends early with a warning, so a blocked wheel can't
+        hang the run.
+        :param stop: whether to stop after the last segment. Otherwise the robot keeps going at its speeds.
+        """
+        scheduler = timing.LoopScheduler(Mover._SEQUENCE_FREQUENCY)
+        for segment in segments:
+            if abs(segment.left_speed) >= abs(segment.right_speed):
+                lead_motor, lead_writer, lead_speed = self._mover.left_motor, self._left_writer, segment.left_speed
+            else:
+                lead_motor, lead_writer, lead_speed = self._mover.right_motor, self._right_writer, segment.right_speed
+            # The position counts up at positive speeds whatever the motor's polarity
+            direction = 1 if lead_speed > 0 else -1
+            position = lead_motor.position
+            target = position + direction * segment.degrees
+            expected = segment.degrees / (abs(lead_speed) * lead_writer._max_speed / 100)
+            end = time.time() + Mover._SEQUENCE_TIME_FACTOR * expected + Mover._SEQUENCE_TIME_SLACK
+
+            self._run(segment.left_speed, segment.right_speed)
+            while (target - position) * direction > 0:
+                scheduler.wait()
+                previous, position = position, lead_motor.position
+                # Only a wheel that didn't move can have stalled, which saves reading its state every check
+                stalled = position == previous and lead_motor.is_stalled
+                if stalled or time.time() > end:
+                    log.warning("Sequence segment stopped %s degrees short, its wheel %s",
+                                abs(target - position), "stalled" if stalled else "was too slow")
+                    break
+
+        if stop:
+            self.stop()
 
     def stop(self):
         """Make robot stop"""
+        self._forget_fast_path()
         self._mover.off()
-        time.sleep(0.1)
-        
+        self.wait_until_settled()
+
+    def wait_until_settled(self, timeout=_SETTLE_TIMEOUT):
+        """Waits until the wheels have stopped turning, instead of for a fixed time"""
+        return _wait_until_settled(self.tacho_motors, timeout)
+
+    def _run(self, left_speed, right_speed):
+        """Same as MoveTank.on() but only writes what changed since the last call"""
+        self._left_writer.run(left_speed)
+        self._right_writer.run(right_speed)
+        self.left_speed = left_speed
+        self.right_speed = right_speed
+
+    def _forget_fast_path(self):
+        """Must be called before commanding the motors through self._mover"""
+        self._left_writer.forget()
+        self._right_writer.forget()
+        self.left_speed = 0
+        self.right_speed = 0
 
     @staticmethod
     def _convert_distance_to_rad(distance):
@@ -228,3 +395,110 @@ class Mover:
     @staticmethod
     def _convert_rad_to_deg(rad):
         return rad / math.pi * 180
+
+
+class Travel:
+    """Straight segment for Mover.move_sequence()"""
+
+    def __init__(self, distance, speed=Mover._DEFAULT_SPEED, backwards=False):
+        """:param distance: in mm"""
+        if backwards:
+            speed = -speed
+        self.left_speed = speed
+        self.right_speed = speed
+        self.degrees = Mover._convert_rad_to_deg(Mover._convert_distance_to_rad(distance))  # Of the wheels
+
+
+class Arc:
+    """Turn segment for Mover.move_sequence(). Same parameters as Mover.rotate()."""
+
+    def __init__(self, degrees, arc_radius=0, clockwise=True, speed=Mover._DEFAULT_ROTATE_SPEED, backwards=False):
+        if degrees <= 0:
+            raise ValueError(
+                "Can't rotate a negative number of degrees. Use clockwise=False to turn counter-clockwise")
+
+        degrees_in_rad = Mover._convert_deg_to_rad(degrees)
+        inside_distance = (arc_radius - Mover.CHASSIS_RADIUS) * degrees_in_rad
+        outside_distance = (arc_radius + Mover.CHASSIS_RADIUS) * degrees_in_rad
+
+        movement_time = outside_distance / speed
+        inside_speed = inside_distance / movement_time
+        self.degrees = Mover._convert_rad_to_deg(Mover._convert_distance_to_rad(outside_distance))  # Of the outside wheel
+
+        if clockwise:
+            if backwards:
+                self.left_speed, self.right_speed = -inside_speed, -speed
+            else:
+                self.left_speed, self.right_speed = speed, inside_speed
+        else:
+            if backwards:
+                self.left_speed, self.right_speed = -speed, -inside_speed
+            else:
+                self.left_speed, self.right_speed = inside_speed, speed
+
+
+class Odometry:
+    """
+    Estimates where the robot is from the wheel encoders. x and y are in mm from where it was created or
+    reset (x forward at the time), heading in radians counter-clockwise.
+    Call update() often: the distance and heading are exact, x and y get less precise the further apart
+    the updates are on a curved path.
+    """
+
+    def __init__(self, mover):
+        self._left_motor, self._right_motor = mover.tacho_motors
+        self._mm_per_degree = Mover._convert_deg_to_rad(1) * Mover._WHEEL_RADIUS
+        self.x = 0
+        self.y = 0
+        self.heading = 0
+        self.distance = 0  # Distance travelled by the center of the robot, forward or backward (mm)
+        self._left_position = self._left_motor.position
+        self._right_position = self._right_motor.position
+
+    def reset(self, x=0, y=0, heading=0):
+        self.update()
+        self.x = x
+        self.y = y
+        self.heading = heading
+
+    def update(self):
+        """Reads both encoders and integrates the movement since the last update"""
+        left_position = self._left_motor.position
+        right_position = self._right_motor.position
+        left = (left_position - self._left_position) * self._mm_per_degree
+        right = (right_position - self._right_position) * self._mm_per_degree
+        self._left_position = left_position
+        self._right_position = right_position
+
+        distance = (left + right) / 2
+        turn = (right - left) / (2 * Mover.CHASSIS_RADIUS)
+        middle_heading = self.heading + turn / 2
+        self.x += distance * math.cos(middle_heading)
+        self.y += distance * math.sin(middle_heading)
+        self.heading += turn
+        self.distance += abs(distance)
+
+    def distance_trigger(self, distance):
+        """Returns an OdometryTrigger met once the robot travelled distance mm from now"""
+        self.update()
+        start = self.distance
+        return OdometryTrigger(self, lambda: self.distance - start >= distance)
+
+    def heading_trigger(self, degrees):
+        """Returns an OdometryTrigger met once the robot turned degrees (either way) from now"""
+        self.update()
+        start = self.heading
+        radians = Mover._convert_deg_to_rad(degrees)
+        return OdometryTrigger(self, lambda: abs(self.heading - start) >= radians)
+
+
+class OdometryTrigger:
+    """Condition on the odometry, checked like a sensor Watch"""
+
+    def __init__(self, odometry, condition):
+        self.odometry = odometry
+        self.condition = condition
+
+    def check(self):
+        self.odometry.update()
+        return self.condition()
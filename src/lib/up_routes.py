@@ -0,0 +1,204 @@
+import lib.up_sensors as sensors
+
+# Waypoints of the field
+TOP_ROW = "top row"  # Across the top row of nodes, where the white one was found
+FIBRE_LINE = "fibre line"  # On the line to the fibre drop off
+FIBRE_DROP = "fibre drop"
+NODES = ("node 1", "node 2", "node 3")  # Lined up to pick up each node of the top row
+RED_DROP = "red drop"
+BLUE_DROP = "blue drop"
+
+# Drop off of the nodes that aren't white, from the first one of the row on
+NODE_DROPS = (sensors.RED, sensors.BLUE)
+
+
+class Leg:
+    """A way from one waypoint to another, driven by calling Main methods one after the other"""
+
+    def __init__(self, start, end, steps, cost):
+        """
+        :param steps: (Main method name, arguments) pairs
+        :param cost: seconds the leg is expected to take, only compared with other costs
+        """
+        self.start = start
+        self.end = end
+        self.steps = steps
+        self.cost = cost
+
+
+class Task(Leg):
+    """A leg that does part of the mission on the way, e.g. picks up a node and drops it off"""
+
+    def __init__(self, goal, start, end, steps, cost):
+        Leg.__init__(self, start, end, steps, cost)
+        self.goal = goal
+
+
+# Placeholder costs, guessed and not measured: no phase has been timed on the mat yet and the simulator's test
+# track can't run these methods. The graph only has the legs the fixed routes drove, so for now plan() picks
+# among those branches, by costs that say little. Once PROFILE_PHASES reports the times of these methods
+# on the mat, put them here and add any new leg worth trying; until then the plans aren't known to be the fastest.
+CONNECTIONS = (
+    Leg(TOP_ROW, NODES[0], (("go_middle_to_line_up_with_first_node", ()),), 4),
+    Leg(TOP_ROW, FIBRE_LINE, (("turn_onto_fibre_line", ()),), 2),
+    Leg(RED_DROP, FIBRE_LINE, (("go_red_to_middle", ()),), 4),
+    Leg(FIBRE_LINE, FIBRE_DROP, (("follow_to_fibre_drop", ()),), 4),
+    Leg(FIBRE_DROP, NODES[1], (("go_fibre_one_to_middle_node", ()),), 1),
+    Leg(FIBRE_DROP, NODES[2], (("go_to_third_node_from_first_fibre", ()),), 3),
+    Leg(RED_DROP, NODES[2], (("go_from_red_drop_to_line_up_third", ()),), 8),
+)
+
+FIBRE = "fibre"
+
+TASKS = (
+    Task(FIBRE, FIBRE_DROP, FIBRE_DROP, (("drop_fibre", ()),), 2),
+    Task((0, sensors.RED), NODES[0], RED_DROP,
+         (("pickup_node", ()), ("turn_around_to_node_line", ()), ("drop_off_node", (sensors.RED,))), 12),
+    Task((1, sensors.RED), NODES[1], RED_DROP,
+         (("pickup_node", ()), ("middle_to_red_drop", ()), ("drop_off_node", (sensors.RED,))), 12),
+    Task((1, sensors.BLUE), NODES[1], BLUE_DROP,
+         (("pickup_node", ()), ("go_pickup_middle_to_blue", ()), ("drop_off_node", (sensors.BLUE,))), 11),
+    Task((2, sensors.BLUE), NODES[2], BLUE_DROP,
+         (("pickup_node", ()), ("turn_around_to_node_line", ()), ("drop_off_node", (sensors.BLUE,))), 12),
+)
+
+
+class Route:
+    """The legs to drive for one scenario, in order"""
+
+    def __init__(self, legs):
+        self.legs = legs
+        self.cost = sum(leg.cost for leg in legs)
+
+    def steps(self):
+        for leg in self.legs:
+            for step in leg.steps:
+                yield step
+
+    def __str__(self):
+        return " > ".join(name for name, _ in self.steps())
+
+
+def goals(position_of_top_white):
+    """The fibre and a (node position, drop off color) for each node of the top row that isn't white"""
+    positions = [position for position in range(len(NODES)) if position != position_of_top_white]
+    return [FIBRE] + [(position, color) for position, color in zip(positions, NODE_DROPS)]
+
+
+def plan(position_of_top_white, start=TOP_ROW, end=BLUE_DROP, connections=CONNECTIONS, tasks=TASKS):
+    """
+    Returns the cheapest Route doing every goal from start to end by the costs of connections and tasks, trying every
+    order of the goals and every task reaching each of them. None if no route exists.
+    """
+    paths = _shortest_paths(connections)
+    best = None
+    for order in _permutations(goals(position_of_top_white)):
+        route = _best_route(order, start, end, paths, tasks)
+        if route is not None and (best is None or route.cost < best.cost):
+            best = route
+    return best
+
+
+def plan_all(**kwargs):
+    """Plans every position of the white node ahead of the run. :return: dict of Route by position"""
+    routes = {}
+    for position in range(len(NODES)):
+        routes[position] = plan(position, **kwargs)
+    return routes
+
+
+def block_turn(color_order, color):
+    """
+    Returns how far the swivel turns a node of color so that it goes in its slot, given the order the blocks
+    were scanned in. None if color wasn't scanned.
+    """
+    if color not in color_order:
+        return None
+    target = (0, 270, 180, 90)[min(color_order.index(color), 3)]
+    orientation = 0 if color in (sensors.RED, sensors.BLUE) else 180
+    return (target - orientation) % 360
+
+
+def block_turns():
+    """Every block_turn() for the orders of four block colors the scan can find, by (color_order, color)"""
+    colors = (sensors.RED, sensors.BLUE, sensors.YELLOW, sensors.GREEN)
+    turns = {}
+    for order in _permutations(list(colors)):
+        order = tuple(order)
+        for color in colors:
+            turns[(order, color)] = block_turn(order, color)
+    return turns
+
+
+def _best_route(order, start, end, paths, tasks):
+    """Cheapest route doing the goals in order, choosing the task for each goal (dynamic programming)"""
+    # Cheapest legs to each waypoint the goals done so far can end at
+    reached = {start: []}
+    for goal in order:
+        next_reached = {}
+        for waypoint, legs in reached.items():
+            for task in tasks:
+                if task.goal != goal:
+                    continue
+                path = _path(paths, waypoint, task.start)
+                if path is None:
+                    continue
+                candidate = legs + path + [task]
+                current = next_reached.get(task.end)
+                if current is None or _cost(candidate) < _cost(current):
+                    next_reached[task.end] = candidate
+        reached = next_reached
+
+    best = None
+    for waypoint, legs in reached.items():
+        path = _path(paths, waypoint, end)
+        if path is not None and (best is None or _cost(legs + path) < _cost(best)):
+            best = legs + path
+    return None if best is None else Route(best)
+
+
+def _path(paths, start, end):
+    if start == end:
+        return []
+    return paths.get((start, end))
+
+
+def _shortest_paths(connections):
+    """Cheapest list of connections between every pair of connected waypoints (Floyd-Warshall)"""
+    waypoints = set()
+    for leg in connections:
+        waypoints.add(leg.start)
+        waypoints.add(leg.end)
+
+    paths = {}
+    for leg in connections:
+        if (leg.start, leg.end) not in paths or leg.cost < _cost(paths[(leg.start, leg.end)]):
+            paths[(leg.start, leg.end)] = [leg]
+
+    for middle in waypoints:
+        for start in waypoints:
+            first = paths.get((start, middle))
+            if first is None:
+                continue
+            for end in waypoints:
+                second = paths.get((middle, end))
+                if second is None or start == end:
+                    continue
+                current = paths.get((start, end))
+                if current is None or _cost(first) + _cost(second) < _cost(current):
+                    paths[(start, end)] = first + second
+    return paths
+
+
+def _cost(legs):
+    return sum(leg.cost for leg in legs)
+
+
+def _permutations(items):
+    if len(items) <= 1:
+        return [items]
+    result = []
+    for index in range(len(items)):
+        for rest in _permutations(items[:index] + items[index + 1:]):
+            result.append([items[index]] + rest)
+    return result
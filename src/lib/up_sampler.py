@@ -0,0 +1,127 @@
+import _thread
+import array
+import time
+
+import lib.up_timing as timing
+
+
+class SampleBuffer:
+    """Fixed size ring buffer of timestamped sensor readings"""
+
+    _DEFAULT_SIZE = 256
+
+    def __init__(self, size=_DEFAULT_SIZE):
+        self.size = size
+        self.values = array.array("i", [0] * size)  # 32 bit so packed RGB readings fit
+        self.times = array.array("d", [0] * size)
+        self.count = 0  # Number of samples ever appended. The next sample goes in count % size.
+        self.error = None  # Why the sampler gave up, raised to readers instead of the last sample
+
+    def check(self):
+        """Raises the error that stopped the sampler, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def append(self, value, timestamp):
+        index = self.count % self.size
+        self.values[index] = value
+        self.times[index] = timestamp
+        # Only publish the sample once it is written since readers run on another thread
+        self.count += 1
+
+    def latest(self):
+        self.check()
+        return self.values[(self.count - 1) % self.size]
+
+    def latest_sample(self):
+        """Returns (value, time) of the newest sample, both from the same sample even while the sampler appends"""
+        index = (self.count - 1) % self.size
+        return self.values[index], self.times[index]
+
+    def oldest_available(self):
+        """Returns the number of the oldest sample that hasn't been overwritten yet"""
+        return max(0, self.count - self.size)
+
+    def get(self, number):
+        return self.values[number % self.size]
+
+    def get_time(self, number):
+        return self.times[number % self.size]
+
+
+class Sampler:
+    """Polls sensors at a fixed rate on a background thread and keeps a history of their readings"""
+
+    _DEFAULT_FREQUENCY = 200
+
+    # A failed read (e.g. an I2C error from the HiTechnic sensor) is retried on the next cycle. After this many
+    # failed cycles in a row the sampler gives up and the sensors' readers raise the error.
+    _MAX_FAILURES = 10
+
+    def __init__(self, frequency=_DEFAULT_FREQUENCY, buffer_size=SampleBuffer._DEFAULT_SIZE):
+        self.frequency = frequency
+        self.buffer_size = buffer_size
+        self.scheduler = None
+        self._sensors = []
+        self._running = False
+        self.failed_samples = 0
+        # False while the thread runs, set by the thread when it ends. stop() polls it, as a lock acquired by
+        # start() and released by the thread is undefined in MicroPython's unix port.
+        self._stopped = True
+
+    def add(self, sensor, mode):
+        """
+        Samples sensor in mode until the sampler is stopped.
+        While sampled, the sensor's readings come from its history and it can't change mode.
+        """
+        if self._running:
+            raise ValueError("Can't add a sensor while the sampler is running")
+
+        sensor.set_mode(mode)
+        sensor.history = SampleBuffer(self.buffer_size)
+        self._sensors.append(sensor)
+
+    def start(self):
+        # Take the first sample here so readers always have a value
+        self._sample()
+
+        self.scheduler = timing.LoopScheduler(self.frequency)
+        self._running = True
+        self._stopped = False
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        """Stops sampling and gives the sensors back to the caller"""
+        if not self._running:
+            return
+
+        self._running = False
+        while not self._stopped:  # Wait for the thread to finish its last sample
+            time.sleep(1 / self.frequency)
+
+        for sensor in self._sensors:
+            sensor.history = None
+
+    def _run(self):
+        failures = 0
+        try:
+            while self._running:
+                self.scheduler.wait()
+                try:
+                    self._sample()
+                    failures = 0
+                except OSError:
+                    self.failed_samples += 1
+                    failures += 1
+                    if failures == self._MAX_FAILURES:
+                        raise
+        except Exception as error:
+            for sensor in self._sensors:
+                sensor.history.error = error
+        finally:
+            self._stopped = True
+
+    def _sample(self):
+        now = time.time()
+        for sensor in self._sensors:
+            sensor.history.append(sensor.read_value(), now)
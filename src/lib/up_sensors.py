@@ -1,4 +1,7 @@
+import time
+
 import ev3dev2.sensor.lego as lego_sensor
+import lib.up_log as log
 
 BLACK = lego_sensor.ColorSensor.COLOR_BLACK
 WHITE = lego_sensor.ColorSensor.COLOR_WHITE
@@ -11,61 +14,373 @@ BROWN = lego_sensor.ColorSensor.COLOR_BROWN
 WHITE_SHADE = 10
 UNKNOWN = -1
 
+REFLECTED = lego_sensor.ColorSensor.MODE_COL_REFLECT
+COLOR = lego_sensor.ColorSensor.MODE_COL_COLOR
+RGB = lego_sensor.ColorSensor.MODE_RGB_RAW
+
 
 class ColorSensor:
+    # Mode the sensor is in. Tracked here so that reads don't have to ask the driver.
+    mode = None
+
+    # Set by SensorHub when the sensor is part of a hub
+    hub = None
+    hub_index = None
+
+    # Set by Sampler while the sensor is sampled on a background thread
+    history = None
+
+    # SensorCalibration of the sensor, None for the nominal thresholds
+    calibration = None
+
+    _value_file = None
+
     def get_color(self) -> int:
-        print("ERROR: Not implemented")
+        log.error("Not implemented")
         return UNKNOWN
 
+    def read_value(self):
+        """Reads the raw value of the sensor in its current mode through a file that stays open"""
+        if self._value_file is None:
+            self._value_file = self.sensor._attribute_file_open("value0")
+        self._value_file.seek(0)
+        return int(self._value_file.read().decode())
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.sensor.mode = mode
+            self.mode = mode
+
+    def set_calibration(self, calibration):
+        self.calibration = calibration
+
+    def reflected_threshold(self, value):
+        """Converts a reflected light threshold tuned for the nominal black and white to this sensor"""
+        if self.calibration is None:
+            return value
+        return self.calibration.threshold(value)
+
+    def reflected_scale(self):
+        """Returns the difference between this sensor's black and white relative to the nominal one"""
+        if self.calibration is None:
+            return 1
+        return self.calibration.scale
+
+    def watch_color(self, predicate):
+        return Watch(self, None, predicate, read=self.get_color)
+
+    def _read(self, mode):
+        """
+        Returns the value for mode from the background sampler or the hub's snapshot if they have a current
+        one, otherwise reads the sensor
+        """
+        if self.history is not None:
+            if mode != self.mode:
+                raise ValueError("Sensor is sampled in mode %s and can't be read in mode %s" % (self.mode, mode))
+            return self.history.latest()
+
+        hub = self.hub
+        if hub is not None and hub.modes[self.hub_index] == mode and hub.is_current():
+            return hub.values[self.hub_index]
+
+        self.set_mode(mode)
+        return self.read_value()
+
+
+class SensorHub:
+    """
+    Samples the color sensors once per control tick into a snapshot.
+    Between ticks, every reader sees the same values without touching sysfs.
+    """
+
+    # A snapshot is used for max_age seconds after its tick, the length of a control cycle. Older ones (e.g.
+    # taken before a blocking move, which doesn't tick) are ignored and the sensors read directly.
+    _DEFAULT_MAX_AGE = 0.01
+
+    def __init__(self, *color_sensors, max_age=_DEFAULT_MAX_AGE):
+        self.sensors = color_sensors
+        self.max_age = max_age
+        self.values = [0] * len(color_sensors)
+        self.modes = [None] * len(color_sensors)
+        self.ticks = 0
+        self.time = None
+
+        for index, sensor in enumerate(color_sensors):
+            sensor.hub = self
+            sensor.hub_index = index
+
+    def tick(self):
+        """Reads every sensor in the mode it is currently in"""
+        sensors = self.sensors
+        values = self.values
+        modes = self.modes
+
+        for index in range(len(sensors)):
+            sensor = sensors[index]
+            mode = sensor.mode
+            if sensor.history is not None:
+                # Sampled on a background thread already, the sensor reads from its history. Copy the
+                # latest sample so the telemetry still has it.
+                values[index] = sensor.history.latest()
+            elif mode is not None:
+                values[index] = sensor.read_value()
+            modes[index] = mode
+
+        self.time = time.time()
+        self.ticks += 1
+
+    def is_current(self):
+        """Returns whether the snapshot was taken for the control cycle running now"""
+        return self.time is not None and time.time() - self.time < self.max_age
+
+
+class Watch:
+    """
+    Checks a condition against a sensor's readings.
+    When the sensor is sampled in the background, every sample since the last check is tested so short
+    events (e.g. crossing a thin line) aren't missed between checks.
+    """
+
+    def __init__(self, sensor, mode, predicate, convert=None, read=None):
+        """
+        :param mode: the sensor mode the predicate expects readings in
+        :param predicate: function that takes a reading and returns whether the condition is met
+        :param convert: function applied to the raw value before the predicate
+        :param read: function to read the sensor when it isn't sampled in the background
+        """
+        self.sensor = sensor
+        self.mode = mode
+        self.predicate = predicate
+        self.convert = convert
+        self.read = read
+        self._next = None if sensor.history is None else sensor.history.count
+
+    def restart(self):
+        """Ignores the readings taken so far"""
+        history = self.sensor.history
+        self._next = None if history is None else history.count
+
+    def check(self):
+        """Returns whether any reading since the last check met the condition"""
+        history = self.sensor.history
+
+        if history is None or self.mode is None or self.mode != self.sensor.mode:
+            if self.read is not None:
+                return self.predicate(self.read())
+            return self.predicate(self._convert(self.sensor._read(self.mode)))
+
+        history.check()
+        end = history.count
+        if self._next is None:
+            # Sampling started after the watch was created
+            number = end - 1
+        else:
+            number = max(self._next, history.oldest_available())
+
+        while number < end:
+            if self.predicate(self._convert(history.get(number))):
+                self._next = number + 1
+                return True
+            number += 1
+
+        self._next = end
+        return False
+
+    def _convert(self, value):
+        if self.convert is None:
+            return value
+        return self.convert(value)
+
 
 class HiTechnicSensor(ColorSensor):
     """Represents a color sensor"""
 
+    MODE_COLOR = "COLOR"
+
     def __init__(self, port):
         self.sensor = lego_sensor.Sensor(address=port)
-        self.sensor.mode = "COLOR"
+        self._code_to_color = HiTechnicSensor._CODE_TO_COLOR
+        self.set_mode(self.MODE_COLOR)
 
     def get_raw_color_code(self):
-        return self.sensor.value()
+        return self._read(self.MODE_COLOR)
 
     def get_color(self):
         """Returns the color under the sensor"""
-        # self.sensor._ensure_mode("COLOR")
-        return HiTechnicSensor.convert_code_to_color(self.get_raw_color_code())
+        return self.convert_code_to_color(self.get_raw_color_code())
 
-    @staticmethod
-    def convert_code_to_color(code):
-        if code == 0:
-            return BLACK
-        elif code == 17:
-            return WHITE
-        elif code == 2:
-            return BLUE
-        elif code == 4:
-            return GREEN
-        elif code == 6 or code == 5:
-            return YELLOW
-        elif code == 9:
-            return RED
-        elif code >= 11:
+    def watch_color(self, predicate):
+        return Watch(self, self.MODE_COLOR, predicate, convert=self.convert_code_to_color)
+
+    def set_calibration(self, calibration):
+        """Also takes the color of the codes read on each color of the mat during calibration"""
+        ColorSensor.set_calibration(self, calibration)
+        table = list(HiTechnicSensor._CODE_TO_COLOR)
+        if calibration is not None and calibration.code_colors is not None:
+            for code, color in calibration.code_colors.items():
+                if 0 <= code < len(table):
+                    table[code] = color
+        self._code_to_color = tuple(table)
+
+    # Color of every code the sensor returns, indexed by code. Codes past the end are shades of white.
+    _CODE_TO_COLOR = (BLACK, UNKNOWN, BLUE, UNKNOWN, GREEN, YELLOW, YELLOW, UNKNOWN, UNKNOWN, RED, UNKNOWN,
+                      WHITE_SHADE, WHITE_SHADE, WHITE_SHADE, WHITE_SHADE, WHITE_SHADE, WHITE_SHADE, WHITE)
+
+    def convert_code_to_color(self, code):
+        code_to_color = self._code_to_color
+        if code >= len(code_to_color):
             return WHITE_SHADE
-        else:
-            print("ERROR: Got color code %s and don't know its color" % code)
-            return UNKNOWN
+
+        color = UNKNOWN if code < 0 else code_to_color[code]
+        if color == UNKNOWN:
+            log.error("Got color code %s and don't know its color", code)
+        return color
+
+
+class RGBClassifier:
+    """
+    Derives both the color and the reflected light intensity from a single raw RGB reading,
+    so a sensor used both ways never has to switch modes.
+    Both are looked up in tables built once from calibrated readings of the mat.
+    """
+
+    # Raw readings are clipped to _RAW_MAX and each channel is split in 2 ** _LEVEL_BITS levels
+    _RAW_MAX = 511
+    _LEVEL_BITS = 4
+    _LEVEL_SHIFT = 5  # log2((_RAW_MAX + 1) / 2 ** _LEVEL_BITS)
+
+    # Raw RGB readings of the mat's colors with the sensor at its usual height
+    _DEFAULT_REFERENCES = (
+        (BLACK, (28, 32, 22)),
+        (WHITE, (330, 350, 250)),
+        (BLUE, (40, 85, 125)),
+        (GREEN, (45, 115, 50)),
+        (YELLOW, (310, 250, 65)),
+        (RED, (270, 55, 35)),
+    )
+
+    # Reflected light intensity (percentage) the reflected mode gives on black and white
+    _DEFAULT_BLACK_REFLECTED = 5
+    _DEFAULT_WHITE_REFLECTED = 65
+
+    def __init__(self, references=_DEFAULT_REFERENCES, black_reflected=_DEFAULT_BLACK_REFLECTED,
+                 white_reflected=_DEFAULT_WHITE_REFLECTED):
+        """
+        :param references: pairs of (color, (red, green, blue)) raw readings of each color of the mat.
+        Must include BLACK and WHITE.
+        """
+        self.references = references
+        self._colors = self._build_color_table(references)
+        self._reflected = self._build_reflected_table(dict(references), black_reflected, white_reflected)
+
+    def color(self, rgb):
+        """:param rgb: reading packed by pack_rgb()"""
+        level_shift = RGBClassifier._LEVEL_SHIFT
+        level_bits = RGBClassifier._LEVEL_BITS
+        raw_max = RGBClassifier._RAW_MAX
+
+        red = min(rgb >> 20, raw_max) >> level_shift
+        green = min((rgb >> 10) & 0x3FF, raw_max) >> level_shift
+        blue = min(rgb & 0x3FF, raw_max) >> level_shift
+        return self._colors[(((red << level_bits) | green) << level_bits) | blue]
+
+    def reflected(self, rgb):
+        """:param rgb: reading packed by pack_rgb()"""
+        return self._reflected[min(rgb >> 20, RGBClassifier._RAW_MAX)]
+
+    @staticmethod
+    def pack_rgb(red, green, blue):
+        """Packs a raw reading in one int so that it fits in the hub's snapshot and the sample history"""
+        return (min(red, 0x3FF) << 20) | (min(green, 0x3FF) << 10) | min(blue, 0x3FF)
+
+    @staticmethod
+    def _build_color_table(references):
+        """Classifies the middle of every cell of the quantized RGB cube as the closest reference"""
+        levels = 1 << RGBClassifier._LEVEL_BITS
+        cell_size = 1 << RGBClassifier._LEVEL_SHIFT
+        centers = [level * cell_size + cell_size // 2 for level in range(levels)]
+
+        table = bytearray(levels ** 3)
+        index = 0
+        for red in centers:
+            for green in centers:
+                for blue in centers:
+                    best_distance = None
+                    for color, (ref_red, ref_green, ref_blue) in references:
+                        distance = (red - ref_red) ** 2 + (green - ref_green) ** 2 + (blue - ref_blue) ** 2
+                        if best_distance is None or distance < best_distance:
+                            best_distance = distance
+                            table[index] = color
+                    index += 1
+        return table
+
+    @staticmethod
+    def _build_reflected_table(references, black_reflected, white_reflected):
+        """Maps the red channel linearly so that black and white read as in the reflected mode"""
+        black_red = references[BLACK][0]
+        white_red = references[WHITE][0]
+        scale = (white_reflected - black_reflected) / (white_red - black_red)
+
+        table = bytearray(RGBClassifier._RAW_MAX + 1)
+        for red in range(len(table)):
+            table[red] = max(0, min(100, int(round(black_reflected + (red - black_red) * scale))))
+        return table
 
 
 class EV3ColorSensor(ColorSensor):
     """Represents an ev3 color sensor"""
 
-    def __init__(self, port):
+    def __init__(self, port, classifier=None):
+        """
+        :param classifier: RGBClassifier to keep the sensor in RGB mode and derive the color and reflected
+        light intensity from it. None uses the sensor's color and reflected modes.
+        """
         self.sensor = lego_sensor.ColorSensor(port)
+        self.classifier = classifier
+        self._bin_data_file = None
+        self._bin_data = bytearray(6)
+
+        if classifier is not None:
+            self.set_mode(RGB)
 
     def get_color(self):
         """Returns the color under the sensor"""
-        # self.sensor._ensure_mode(lego_sensor.ColorSensor.MODE_COL_COLOR)
-        return self.sensor.color
+        if self.classifier is not None:
+            return self.classifier.color(self._read(RGB))
+        return self._read(COLOR)
 
     def get_reflected(self):
         """Returns the amount of light reflected (percentage)"""
-        # self.sensor._ensure_mode(lego_sensor.ColorSensor.MODE_COL_REFLECT)
-        return self.sensor.reflected_light_intensity
+        if self.classifier is not None:
+            return self.classifier.reflected(self._read(RGB))
+        return self._read(REFLECTED)
+
+    def read_value(self):
+        if self.mode == RGB:
+            return self._read_rgb()
+        return ColorSensor.read_value(self)
+
+    def set_calibration(self, calibration):
+        # The classifier's reflected light is already on the nominal scale, its references being calibrated
+        if self.classifier is None:
+            ColorSensor.set_calibration(self, calibration)
+
+    def watch_color(self, predicate):
+        if self.classifier is not None:
+            return Watch(self, RGB, predicate, convert=self.classifier.color)
+        return Watch(self, COLOR, predicate)
+
+    def watch_reflected(self, predicate):
+        if self.classifier is not None:
+            return Watch(self, RGB, predicate, convert=self.classifier.reflected)
+        return Watch(self, REFLECTED, predicate)
+
+    def _read_rgb(self):
+        """Reads the three raw values at once from bin_data (little-endian signed 16 bit) and packs them"""
+        if self._bin_data_file is None:
+            self._bin_data_file = self.sensor._attribute_file_open("bin_data")
+
+        data = self._bin_data
+        self._bin_data_file.seek(0)
+        self._bin_data_file.readinto(data)
+        return RGBClassifier.pack_rgb(data[0] | (data[1] << 8), data[2] | (data[3] << 8), data[4] | (data[5] << 8))
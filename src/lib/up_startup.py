@@ -0,0 +1,42 @@
+import _thread
+import time
+
+# Seconds between checks of whether every constructor finished
+_POLL = 0.01
+
+
+def build(constructors, parallel=True):
+    """
+    Calls every constructor and returns what they returned, in the same order.
+    :param parallel: call them at the same time on threads. Opening a device mostly waits on sysfs, so the
+    devices open in about the time the slowest one takes.
+    """
+    if not parallel:
+        return [constructor() for constructor in constructors]
+
+    results = [None] * len(constructors)
+    errors = []
+    remaining = [len(constructors)]
+    # Each thread acquires and releases it around its own count down. The caller polls the count rather than
+    # waiting on a lock the last thread releases, which is undefined in MicroPython's unix port.
+    count_lock = _thread.allocate_lock()
+
+    def run(index):
+        try:
+            results[index] = constructors[index]()
+        except Exception as error:
+            errors.append(error)
+        finally:
+            count_lock.acquire()
+            remaining[0] -= 1
+            count_lock.release()
+
+    for index in range(len(constructors)):
+        _thread.start_new_thread(run, (index,))
+
+    while remaining[0]:
+        time.sleep(_POLL)
+    # A constructor that raised on its thread would otherwise leave None in its place
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,103 @@
+import struct
+import time
+
+import lib.up_sensors as sensors
+
+# One record per control cycle:
+# time since start (s), raw hub value and mode code of the 4 sensors, reflected value followed, error,
+# steering direction, left and right motor speeds (%), flags, kp, kd, speed
+RECORD_FORMAT = "<f4i4BhffffBfff"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+FIELDS = ("time", "front", "left", "right", "back", "front_mode", "left_mode", "right_mode", "back_mode",
+          "sensor_value", "error", "direction", "left_speed", "right_speed", "flags", "kp", "kd", "speed")
+
+# Records kept per second at most. The line follower runs at this rate. The wait loops check twice as often
+# and every other check is dropped, so that the buffer for a run can be sized from its length.
+RECORD_RATE = 100
+
+FLAG_FOLLOWING = 1  # The record comes from a line follower cycle, otherwise from a wait loop
+FLAG_BACKWARDS = 2
+FLAG_ON_LEFT = 4
+
+# Sensor modes by the code stored in records
+MODES = (None, sensors.REFLECTED, sensors.COLOR, sensors.RGB, sensors.HiTechnicSensor.MODE_COLOR)
+_MODE_UNKNOWN = 255
+
+_MAGIC = b"UPTL"
+_VERSION = 3
+_HEADER_FORMAT = "<4sBHI"  # magic, version, record size, number of records
+
+
+class TelemetryRecorder:
+    """
+    Records every control cycle, up to RECORD_RATE per second, as a fixed size binary record in a buffer
+    allocated up front. Nothing touches the disk until save() is called after the run.
+    """
+
+    _DEFAULT_SECONDS = 120
+
+    # A record comes at least this long after the previous one. Under the period so that the line follower's
+    # cycles are all kept despite their jitter.
+    _MIN_INTERVAL = 0.75 / RECORD_RATE
+
+    def __init__(self, hub, mover, seconds=_DEFAULT_SECONDS, capacity=None):
+        """
+        :param seconds: length of the run to make room for, RECORD_SIZE * RECORD_RATE bytes per second
+        :param capacity: number of records to make room for instead
+        """
+        if capacity is None:
+            capacity = int(seconds * RECORD_RATE)
+        self.hub = hub
+        self.mover = mover
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.count = 0
+        self.dropped = 0
+        self.start_time = time.time()
+        self._last_time = None
+        self._mode_codes = {}
+        for code in range(len(MODES)):
+            self._mode_codes[MODES[code]] = code
+
+    def record(self, sensor_value=0, error=0, direction=0, flags=0, kp=0, kd=0, speed=0):
+        now = time.time() - self.start_time
+        if self._last_time is not None and now - self._last_time < self._MIN_INTERVAL:
+            return
+        if self.count == self.capacity:
+            self.dropped += 1
+            return
+        self._last_time = now
+
+        values = self.hub.values
+        modes = self.hub.modes
+        mode_codes = self._mode_codes
+
+        struct.pack_into(RECORD_FORMAT, self.buffer, self.count * RECORD_SIZE,
+                         now,
+                         values[0], values[1], values[2], values[3],
+                         mode_codes.get(modes[0], _MODE_UNKNOWN), mode_codes.get(modes[1], _MODE_UNKNOWN),
+                         mode_codes.get(modes[2], _MODE_UNKNOWN), mode_codes.get(modes[3], _MODE_UNKNOWN),
+                         sensor_value, error, direction, self.mover.left_speed, self.mover.right_speed, flags,
+                         kp, kd, speed)
+        self.count += 1
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(struct.pack(_HEADER_FORMAT, _MAGIC, _VERSION, RECORD_SIZE, self.count))
+            file.write(memoryview(self.buffer)[:self.count * RECORD_SIZE])
+
+        if self.dropped:
+            print("WARNING: Telemetry buffer full, dropped %s records" % self.dropped)
+
+
+def load(path):
+    """Returns the records saved in path as a list of tuples in the order of RECORD_FORMAT"""
+    with open(path, "rb") as file:
+        data = file.read()
+
+    header_size = struct.calcsize(_HEADER_FORMAT)
+    magic, version, record_size, count = struct.unpack(_HEADER_FORMAT, data[:header_size])
+    if magic != _MAGIC or version != _VERSION or record_size != RECORD_SIZE:
+        raise ValueError("%s isn't a telemetry file this version can read" % path)
+
+    return [struct.unpack_from(RECORD_FORMAT, data, header_size + index * RECORD_SIZE) for index in range(count)]
@@ -0,0 +1,226 @@
+import array
+import time
+
+
+class LoopScheduler:
+    """Runs a control loop at a fixed frequency and keeps track of missed deadlines"""
+
+    def __init__(self, frequency, sleep=None):
+        """
+        :param frequency: the number of cycles per second. None means the loop runs as fast as it can.
+        :param sleep: function waiting for a number of seconds, time.sleep if None
+        """
+        self.period = None if frequency is None else 1 / frequency
+        self._sleep = sleep
+        self.cycles = 0
+        self.overruns = 0
+        self.max_lateness = 0
+        self._deadline = None
+        self._last_tick = None
+
+    def wait(self):
+        """
+        Blocks until the start of the next cycle.
+        :return: the time in seconds since the start of the previous cycle
+        """
+        now = time.time()
+
+        if self._last_tick is None:
+            self._last_tick = now
+            if self.period is not None:
+                self._deadline = now + self.period
+                return self.period
+            return 0
+
+        if self.period is not None:
+            if now < self._deadline:
+                if self._sleep is None:
+                    time.sleep(self._deadline - now)
+                else:
+                    self._sleep(self._deadline - now)
+                now = time.time()
+                self._deadline += self.period
+            else:
+                # Missed the deadline. Start counting again from now instead of running
+                # several cycles back to back to catch up.
+                self.overruns += 1
+                lateness = now - self._deadline
+                if lateness > self.max_lateness:
+                    self.max_lateness = lateness
+                self._deadline = now + self.period
+
+        dt = now - self._last_tick
+        self._last_tick = now
+        self.cycles += 1
+        return dt
+
+    def reset(self):
+        """Forget the previous cycle (e.g. when the loop was paused)"""
+        self._deadline = None
+        self._last_tick = None
+
+    def report(self):
+        return "%s cycles, %s overruns (worst %.1f ms late)" % (self.cycles, self.overruns, self.max_lateness * 1000)
+
+
+class StageTimer:
+    """
+    Records how long each stage of a loop takes.
+    Durations go into preallocated ring buffers so that timing a cycle doesn't allocate.
+    """
+
+    _DEFAULT_SIZE = 2000
+
+    def __init__(self, stages, size=_DEFAULT_SIZE):
+        """
+        :param stages: names of the stages in the order they run in a cycle
+        :param size: number of cycles kept. Older cycles get overwritten.
+        """
+        self.stages = stages
+        self.size = size
+        self.durations = [array.array("f", [0] * size) for _ in stages]
+        self.cycles = 0
+        self._last = 0
+
+    def start(self):
+        """Marks the start of the first stage"""
+        self._last = time.time()
+
+    def mark(self, stage):
+        """Marks the end of stage (its index in stages). The next stage starts now."""
+        now = time.time()
+        self.durations[stage][self.cycles % self.size] = now - self._last
+        self._last = now
+
+    def next_cycle(self):
+        self.cycles += 1
+
+    def summary(self):
+        """Returns a list of (stage, p50, p95, max) in seconds over the cycles kept"""
+        count = min(self.cycles, self.size)
+        summary = []
+        for stage in range(len(self.stages)):
+            if count == 0:
+                summary.append((self.stages[stage], 0, 0, 0))
+                continue
+            durations = sorted(self.durations[stage][:count])
+            summary.append((self.stages[stage], durations[count // 2], durations[(count - 1) * 95 // 100],
+                            durations[-1]))
+        return summary
+
+    def report(self):
+        lines = ["%-8s %8s %8s %8s  (ms over %s cycles)" % ("stage", "p50", "p95", "max", min(self.cycles, self.size))]
+        for stage, p50, p95, maximum in self.summary():
+            lines.append("%-8s %8.2f %8.2f %8.2f" % (stage, p50 * 1000, p95 * 1000, maximum * 1000))
+        return "\n".join(lines)
+
+
+class PhaseProfiler:
+    """
+    Splits the time of each phase of a run between driving, waiting on sensors, blocking motor moves and
+    sleeps. Phases and categories are set by wrapping methods with instrument(), and nest: time goes to
+    every phase being run and to the innermost category.
+    """
+
+    CATEGORIES = ("driving", "sensors", "motors", "sleep", "other")
+    DRIVING = 0
+    SENSORS = 1
+    MOTORS = 2
+    SLEEP = 3
+    _OTHER = 4
+
+    def __init__(self):
+        self.phases = []  # In the order they first ran
+        self.depths = {}
+        self.calls = {}
+        self.totals = {}  # Seconds per category for each phase
+        self._phase_stack = []
+        self._category_stack = [PhaseProfiler._OTHER]
+        self._last = time.time()
+
+    def instrument(self, obj, names, category=None):
+        """
+        Replaces the methods of obj called names with ones that time them.
+        :param category: the category of the time spent in the methods. None makes each method a phase.
+        """
+        for name in names:
+            method = getattr(obj, name)
+            if category is None:
+                setattr(obj, name, self._timed_phase(method, name))
+            else:
+                setattr(obj, name, self._timed_category(method, category))
+
+    def _timed_phase(self, method, name):
+        def timed(*args, **kwargs):
+            self.enter_phase(name)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.exit_phase()
+
+        return timed
+
+    def _timed_category(self, method, category):
+        def timed(*args, **kwargs):
+            self.enter_category(category)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.exit_category()
+
+        return timed
+
+    def _flush(self):
+        """Adds the time since the last change to the phases being run"""
+        now = time.time()
+        elapsed = now - self._last
+        self._last = now
+
+        category = self._category_stack[-1]
+        for name in self._phase_stack:
+            if name is not None:
+                self.totals[name][category] += elapsed
+
+    def enter_phase(self, name):
+        self._flush()
+        if name not in self.totals:
+            self.phases.append(name)
+            self.depths[name] = len(self._phase_stack)
+            self.calls[name] = 0
+            self.totals[name] = [0] * len(PhaseProfiler.CATEGORIES)
+        self.calls[name] += 1
+
+        # A phase running inside itself is only counted once
+        if name not in self._phase_stack:
+            self._phase_stack.append(name)
+        else:
+            self._phase_stack.append(None)
+
+    def exit_phase(self):
+        self._flush()
+        self._phase_stack.pop()
+
+    def enter_category(self, category):
+        self._flush()
+        self._category_stack.append(category)
+
+    def exit_category(self):
+        self._flush()
+        self._category_stack.pop()
+
+    def report(self, time_limit=None):
+        """
+        :param time_limit: the time a run may take, to compare the first phase (the whole run) against
+        """
+        lines = ["%-36s %7s %7s %7s %7s %7s %7s %5s  (s)" % (("phase", "total") + PhaseProfiler.CATEGORIES +
+                                                             ("calls",))]
+        for name in self.phases:
+            totals = self.totals[name]
+            lines.append("%-36s %7.2f %7.2f %7.2f %7.2f %7.2f %7.2f %5s" % (
+                ("  " * self.depths[name] + name, sum(totals)) + tuple(totals) + (self.calls[name],)))
+
+        if time_limit is not None and self.phases:
+            total = sum(self.totals[self.phases[0]])
+            lines.append("%s took %.1f s of the %s s limit (%.0f%%)" % (self.phases[0], total, time_limit,
+                                                                       total * 100 / time_limit))
+        return "\n".join(lines)
@@ -0,0 +1,53 @@
+#!/usr/bin/env micropython
+
+# Measures what every sensor reads on the mat and saves it to CALIBRATION_PATH, where Main loads it from
+
+import lib.up_calibration as calibration
+import lib.up_ports as ports
+import lib.up_sensors as sensors
+import up_main
+
+EV3_SENSORS = (("front", ports.FRONT_SENSOR), ("left", ports.LEFT_SENSOR), ("back", ports.BACK_SENSOR))
+BLOCK_COLORS = (("red", sensors.RED), ("blue", sensors.BLUE), ("green", sensors.GREEN),
+                ("yellow", sensors.YELLOW), ("white", sensors.WHITE))
+COLOR_NAMES = {sensors.BLACK: "black", sensors.WHITE: "white", sensors.BLUE: "blue", sensors.GREEN: "green",
+               sensors.YELLOW: "yellow", sensors.RED: "red"}
+
+
+def ask(message):
+    print(message + ", then press enter")
+    up_main.beep()
+    up_main.wait_for_enter()
+
+
+calibrations = {}
+
+for name, port in EV3_SENSORS:
+    sensor = sensors.EV3ColorSensor(port)
+    ask("Put the %s sensor next to a black line and be ready to slide it back and forth across it" % name)
+    black, white = calibration.sweep_reflected(sensor)
+    print("%s: black %s, white %s" % (name, black, white))
+    if white - black < calibration.MIN_CONTRAST:
+        print("The %s sensor didn't see the line, keeping its nominal thresholds" % name)
+        continue
+
+    references = None
+    if port == ports.LEFT_SENSOR:
+        references = []
+        for color in calibration.REFERENCE_COLORS:
+            ask("Hold the left sensor over %s" % COLOR_NAMES[color])
+            references.append((color, calibration.average_rgb(sensor)))
+    calibrations[port] = calibration.SensorCalibration(black, white, references)
+
+right = sensors.HiTechnicSensor(ports.RIGHT_SENSOR)
+code_colors = {}
+for name, color in BLOCK_COLORS:
+    ask("Put a %s block in front of the right sensor" % name)
+    code = calibration.most_common_code(right)
+    if code in code_colors:
+        print("The %s block reads as code %s like %s" % (name, code, COLOR_NAMES[code_colors[code]]))
+    code_colors[code] = color
+calibrations[ports.RIGHT_SENSOR] = calibration.SensorCalibration(code_colors=code_colors)
+
+calibration.save(up_main.CALIBRATION_PATH, calibrations)
+print("Saved to %s" % up_main.CALIBRATION_PATH)
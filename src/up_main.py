@@ -1,18 +1,66 @@
 #!/usr/bin/env micropython
 
+import time
+
+# Imports count in the time to READY
+_START_TIME = time.time()
+
+import lib.up_actions as actions
+import lib.up_calibration as calibration
+import lib.up_conditions as conditions
 import lib.up_ports as ports
 import lib.up_motors as motors
 import lib.up_sensors as sensors
 import lib.up_line_follower as line_follower
+import lib.up_log as log
+import lib.up_routes as routes
+import lib.up_sampler as sampler
+import lib.up_startup as startup
+import lib.up_telemetry as telemetry
+import lib.up_timing as timing
 import os
-import time
-
-import ev3dev2.button as button
 
 REQUIRE_ENTER_TO_START = True
 
+# Open the motors and sensors at the same time and calibrate the lift on a background thread while the rest
+# starts, instead of one after the other
+PARALLEL_STARTUP = True
+
+# Poll the front and back sensors on a background thread so loop conditions see every reading
+SAMPLE_IN_BACKGROUND = False
+
+# Read the HiTechnic sensor on its own thread. Its I2C reads are much slower than the other sensors', this
+# way the line follower never waits on them and the block scan still sees every sample.
+SAMPLE_HITECHNIC_IN_BACKGROUND = True
+
+# Record how long each stage of a line follower cycle takes and print it after the run
+TIME_FOLLOW_STAGES = False
+
+# Keep the left sensor in RGB mode and classify its readings instead of switching between the color and
+# reflected modes. Needs the RGBClassifier references to match the mat.
+CLASSIFY_LEFT_SENSOR_RGB = False
+
+# Record every control cycle and save the records to TELEMETRY_PATH after the run. The buffer is allocated at
+# startup for TIME_LIMIT seconds, telemetry.RECORD_SIZE * telemetry.RECORD_RATE bytes a second: 660 KB for two
+# minutes, out of the 1 MB heap MicroPython has by default on the EV3. Without the memory for it the run goes
+# on without telemetry.
+RECORD_TELEMETRY = False
+TELEMETRY_PATH = "telemetry.bin"
+
+# Time each phase of the run, split between driving, sensor waits, motor moves and sleeps, and print it
+# against the time a run may take in competition
+PROFILE_PHASES = False
+TIME_LIMIT = 120
+
+# Sensor calibration saved by up_calibrate.py. The reflected light cutoffs in this file are for a sensor
+# reading 5 on black and 65 on white, and get converted with each sensor's calibration when there is one.
+CALIBRATION_PATH = "calibration.bin"
+
 
 def wait_for_enter():
+    # Only needed once the robot is ready
+    import ev3dev2.button as button
+
     while True:
         time.sleep(0.1)
         if button.Button().enter:
@@ -24,29 +72,119 @@ def beep():
 
 
 class Main:
+    _HITECHNIC_FREQUENCY = 100  # The sensor doesn't update faster
+
     def __init__(self):
-        self.mover = motors.Mover(reverse_motors=True)
-        self.left_sensor = sensors.EV3ColorSensor(ports.LEFT_SENSOR)
-        self.right_sensor = sensors.HiTechnicSensor(ports.RIGHT_SENSOR)
-        self.front_sensor = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
-        self.back_sensor = sensors.EV3ColorSensor(ports.BACK_SENSOR)
-        self.swivel = motors.Swivel()
         self.lift = motors.Lift()
-        self.line_follower = line_follower.LineFollower(self.mover, self.front_sensor, self.back_sensor)
+        self.setup()
+
+        calibrations = calibration.load(CALIBRATION_PATH)
+        left_classifier = self._left_classifier(calibrations)
+        (self.mover, self.swivel, self.left_sensor, self.right_sensor, self.front_sensor,
+         self.back_sensor) = startup.build((
+            lambda: motors.Mover(reverse_motors=True),
+            motors.Swivel,
+            lambda: sensors.EV3ColorSensor(ports.LEFT_SENSOR, classifier=left_classifier),
+            lambda: sensors.HiTechnicSensor(ports.RIGHT_SENSOR),
+            lambda: sensors.EV3ColorSensor(ports.FRONT_SENSOR),
+            lambda: sensors.EV3ColorSensor(ports.BACK_SENSOR),
+        ), parallel=PARALLEL_STARTUP)
+        for port, sensor in ((ports.LEFT_SENSOR, self.left_sensor), (ports.RIGHT_SENSOR, self.right_sensor),
+                             (ports.FRONT_SENSOR, self.front_sensor), (ports.BACK_SENSOR, self.back_sensor)):
+            sensor.set_calibration(calibrations.get(port))
+        self.sensor_hub = sensors.SensorHub(self.front_sensor, self.left_sensor, self.right_sensor, self.back_sensor)
+        self.line_follower = line_follower.LineFollower(self.mover, self.front_sensor, self.back_sensor,
+                                                        hub=self.sensor_hub)
+        if TIME_FOLLOW_STAGES:
+            self.line_follower.time_stages()
+
+        self.recorder = None
+        if RECORD_TELEMETRY:
+            try:
+                self.recorder = telemetry.TelemetryRecorder(self.sensor_hub, self.mover, seconds=TIME_LIMIT)
+                self.line_follower.recorder = self.recorder
+            except MemoryError:
+                log.warning("No memory for %s s of telemetry, not recording", TIME_LIMIT)
 
         self.color_codes = []
         self.position_of_top_white = None
         self.position_of_bottom_white = None
 
-        self.setup()
+        # Route through the nodes for each position of the top white node (cheapest by up_routes' placeholder costs,
+        # the same branches the fixed routes drove) and how far to turn the swivel for each block order, worked out
+        # before the run so the robot only looks them up
+        self.routes = routes.plan_all()
+        self.block_turns = routes.block_turns()
+
+        self.sampler = None
+        if SAMPLE_IN_BACKGROUND:
+            self.sampler = sampler.Sampler()
+            self.sampler.add(self.front_sensor, sensors.REFLECTED)
+            self.sampler.add(self.back_sensor, sensors.REFLECTED)
+            self.sampler.start()
+
+        self.hitechnic_sampler = None
+        if SAMPLE_HITECHNIC_IN_BACKGROUND or SAMPLE_IN_BACKGROUND:
+            self.hitechnic_sampler = sampler.Sampler(frequency=self._HITECHNIC_FREQUENCY)
+            self.hitechnic_sampler.add(self.right_sensor, self.right_sensor.MODE_COLOR)
+            self.hitechnic_sampler.start()
+
+        self.profiler = None
+        if PROFILE_PHASES:
+            self.profiler = timing.PhaseProfiler()
+            self._instrument(self.profiler)
+
+    @staticmethod
+    def _left_classifier(calibrations):
+        if not CLASSIFY_LEFT_SENSOR_RGB:
+            return None
+        left_calibration = calibrations.get(ports.LEFT_SENSOR)
+        if left_calibration is None or left_calibration.references is None:
+            return sensors.RGBClassifier()
+        return sensors.RGBClassifier(left_calibration.references)
+
+    _PHASES = ("run", "test", "go_to_first_fibre", "go_to_top_row", "do_nodes", "turn_onto_fibre_line",
+               "follow_to_fibre_drop", "drop_fibre", "go_middle_to_line_up_with_first_node", "pickup_node",
+               "turn_around_to_node_line", "go_red_to_middle",
+               "go_to_third_node_from_first_fibre", "go_pickup_middle_to_blue", "middle_to_red_drop",
+               "go_from_red_drop_to_line_up_third", "drop_off_node", "go_fibre_one_to_middle_node",
+               "place_node_in_slot", "do_second_fibre", "return_to_start")
+
+    def _instrument(self, profiler):
+        profiler.instrument(self, self._PHASES)
+        profiler.instrument(self.line_follower, ("follow_profile", "follow_for_time", "follow_until_color",
+                                                 "follow_until_line", "follow_until_intersection_x",
+                                                 "follow_until_cutoff", "follow_until_constant",
+                                                 "follow_until_change"), profiler.DRIVING)
+        profiler.instrument(self, ("_wait_for",), profiler.SENSORS)
+        # Blocking moves end up waiting on a motor, Mover also waits for the wheels to settle after them
+        profiler.instrument(self.mover, ("travel", "rotate", "stop", "wait_until_settled"), profiler.MOTORS)
+        profiler.instrument(self.swivel, ("wait_until_settled",), profiler.MOTORS)
+        for tacho_motor in (self.mover._mover.left_motor, self.mover._mover.right_motor, self.lift._lift,
+                            self.swivel._swivel):
+            profiler.instrument(tacho_motor, ("wait_until", "wait_until_not_moving"), profiler.MOTORS)
+        profiler.instrument(self, ("pause",), profiler.SLEEP)
 
     def setup(self):
-        self.lift.calibrate()
+        """Calibrates the lift, in the background with PARALLEL_STARTUP. Called by __init__."""
+        self.lift.calibrate(block=not PARALLEL_STARTUP)
 
     def teardown(self):
         self.mover.stop()
-        self.swivel.reset()
-        self.lift.up()
+        self.line_follower.reset()
+        plan = actions.ActionPlan()
+        plan.add("reset swivel", lambda: self.swivel.reset(block=False), self.swivel.tacho_motors)
+        plan.add("lift up", lambda: self.lift.up(block=False), self.lift.tacho_motors)
+        plan.run()
+
+        if self.sampler is not None:
+            self.sampler.stop()
+            if self.sampler.failed_samples:
+                log.warning("Front and back sensors: %s failed samples retried", self.sampler.failed_samples)
+        if self.hitechnic_sampler is not None:
+            self.hitechnic_sampler.stop()
+            if self.hitechnic_sampler.failed_samples:
+                log.warning("HiTechnic sensor: %s failed samples retried", self.hitechnic_sampler.failed_samples)
 
     def test(self):
         self.color_codes = [0, 0, 0, sensors.RED, sensors.BLUE]
@@ -55,9 +193,7 @@ class Main:
 
         # self.position_of_top_white = 2
 
-        # self.do_other_nodes()
-
-        # self.do_other_nodes()
+        # self.do_nodes()
         # self.drop_off_node(sensors.RED)
         # self.go_from_red_drop_to_line_up_third()
         # self.line_follower.follow_until_intersection_x(6, self.left_sensor, on_left=False)
@@ -75,12 +211,8 @@ class Main:
     def run(self):
         self.go_to_first_fibre()
         self.lift.up()
-        self.go_to_fibre_drop_off()  # Also does first node
-
-        self.lift.to_fibre()
-        self.lift.up()
-
-        self.do_other_nodes()
+        self.go_to_top_row()
+        self.do_nodes()  # Also drops off the fibre
 
         self.do_second_fibre()
         self.return_to_start()
@@ -91,12 +223,11 @@ class Main:
         self.mover.travel(150)
 
         # Scan blocks
+        block_scan = self.right_sensor.watch_color(self._record_block_color)
+        profile = self.line_follower.profile(speed=35)
         while not self.left_sensor.get_color() == sensors.BLACK:
-            self.line_follower.follow(speed=35)
-
-            color = self.right_sensor.get_color()
-            if color in (sensors.RED, sensors.BLUE, sensors.YELLOW, sensors.GREEN) and color not in self.color_codes:
-                self.color_codes.append(color)
+            self.line_follower.follow_profile(profile)
+            block_scan.check()
 
         self.line_follower.reset()
         self.mover.stop()
@@ -105,54 +236,58 @@ class Main:
             beep()
             beep()
 
-        print(self.color_codes)
+        log.info("Block colors %s", self.color_codes)
 
         # Turn and go to end
         self.mover.rotate(clockwise=False, arc_radius=60, block=False, speed=20)
-        self.wait_for_white_cutoff(self.front_sensor, cutoff=50)
-        self.wait_for_black_cutoff(self.front_sensor, cutoff=30)
+        self.wait_for_line(self.front_sensor, dark=30, light=50)
         self.mover.stop()
 
         self.line_follower.follow_until_intersection_x(6, self.left_sensor, on_left=False, use_reflection=True,
-                                                       speed=60)
+                                                       speed=60, max_speed=80)
 
         # Line up
         self.mover.rotate(arc_radius=71, clockwise=False, block=False, speed=15)
         self.wait_for_colors(self.right_sensor, (sensors.BLACK,))
         self.mover.rotate(block=False, speed=30)
-        self.wait_for_white_cutoff(self.front_sensor)
-        self.wait_for_black_cutoff(self.front_sensor, 20)
-        self.wait_for_white_cutoff(self.front_sensor)
+        self.wait_for_line_crossed(self.front_sensor, dark=20)
         self.mover.stop()
 
         self.lift.to_fibre()
         self.line_follower.follow_until_color(self.left_sensor, (sensors.YELLOW,), on_left=False,
                                               speed=15, kp=1.5, kd=0)
 
-    def go_to_fibre_drop_off(self):
-        # Find line
-        self.mover.rotate(clockwise=False, degrees=30, speed=20)
-        self.mover.travel(backwards=True, distance=130, speed=20)
-        self.mover.rotate(degrees=25, speed=20)
+    def _record_block_color(self, color):
+        if color in (sensors.RED, sensors.BLUE, sensors.YELLOW, sensors.GREEN) and color not in self.color_codes:
+            self.color_codes.append(color)
+        return False  # Keep checking every sample
+
+    def go_to_top_row(self):
+        # Find line. The line follower takes over from the last turn without stopping.
+        self.mover.move_sequence((motors.Arc(30, clockwise=False, speed=20),
+                                  motors.Travel(130, backwards=True, speed=20),
+                                  motors.Arc(25, speed=20)), stop=False)
 
         # Follow line and turn
         self.line_follower.follow_for_time(1, backwards=True, speed=40, stop=True, kp=1, kd=0)
-        time.sleep(0.5)
+        self.pause(0.5)
         self.line_follower.follow_until_line(self.left_sensor, backwards=True, speed=40)
         self.mover.rotate(degrees=90, clockwise=False, arc_radius=90)
 
         # Follow across
         time_first_cross = None
         first_node_is_white = True
+        profile = self.line_follower.profile(on_left=False, speed=30)
+        node_cutoff = self.left_sensor.reflected_threshold(25)
         while True:
-            self.line_follower.follow(on_left=False, speed=30)
+            self.line_follower.follow_profile(profile)
 
             # If hasn't crossed yet
             if time_first_cross is None:
                 if self.left_sensor.get_color() == sensors.BLACK:
                     time_first_cross = time.time()
             elif time.time() > time_first_cross + 0.15:
-                if self.left_sensor.get_reflected() < 25:
+                if self.left_sensor.get_reflected() < node_cutoff:
                     self.mover.stop()
                     self.line_follower.reset()
                     break
@@ -166,7 +301,7 @@ class Main:
         if second_node_is_white and first_node_is_white:
             beep()
             beep()
-            print("Error: Detected two whites nodes in top row")
+            log.error("Detected two whites nodes in top row")
             self.position_of_top_white = 1
         elif second_node_is_white:
             self.position_of_top_white = 1
@@ -175,100 +310,96 @@ class Main:
         else:
             self.position_of_top_white = 2
 
-        print("TOP WHITE AT:")
-        print(self.position_of_top_white)
+        log.info("Top white at %s", self.position_of_top_white)
 
-        # Do first node
-        if self.position_of_top_white != 0:
-            self.go_middle_to_line_up_with_first_node()
-            self.pickup_node()
-            self.turn_around_to_node_line()
-            self.drop_off_node(sensors.RED)
-            self.go_red_to_middle()
-        else:
-            # Turn
-            self.mover.rotate(clockwise=False, arc_radius=50, block=False)
-            time.sleep(0.3)
-            self.wait_for_white_cutoff(self.front_sensor)
-            self.wait_for_black_cutoff(self.front_sensor)
-            self.mover.stop()
+    def do_nodes(self):
+        """Drives the route planned for where the top white node is, from the top row to the last drop off"""
+        route = self.routes[self.position_of_top_white]
+        log.info("Route %s", route)
+        for name, arguments in route.steps():
+            getattr(self, name)(*arguments)
 
-        # Follow to drop off
+    def turn_onto_fibre_line(self):
+        self.mover.rotate(clockwise=False, arc_radius=50, block=False)
+        self.pause(0.3)
+        self.wait_for_line(self.front_sensor)
+        self.mover.stop()
+
+    def follow_to_fibre_drop(self):
         self.line_follower.follow_until_color(self.left_sensor, (sensors.RED,), on_left=False, speed=20, kp=1.5, kd=0)
         self.mover.travel(speed=15, block=False)
-        while not self.left_sensor.get_color() == sensors.WHITE:
-            pass
+        self.wait_for_colors(self.left_sensor, (sensors.WHITE,))
         self.mover.stop()
 
         self.mover.travel(distance=10)
 
+    def drop_fibre(self):
+        self.lift.to_fibre()
+        self.lift.up()
+
     def go_middle_to_line_up_with_first_node(self):
         # Reverse into position
         self.mover.rotate(clockwise=True, arc_radius=115, degrees=90, backwards=True)
 
-        # Turn around
+        # Turn around, turning the swivel at the same time. pickup_node waits for it.
+        self.swivel.back(block=False)
         self.mover.rotate(block=False, speed=40)
-        time.sleep(0.2)
+        self.pause(0.2)
         self.wait_for_black_cutoff(self.back_sensor, cutoff=20)
         self.mover.stop()
-        self.swivel.back()
 
     def pickup_node(self):
-        # Pick up node
-        self.swivel.back()
-        self.line_follower.follow_until_line(self.right_sensor, backwards=True, speed=20, kp=2, kd=0.5)
-        self.lift.to_node()
+        # Pick up node, turning the swivel while backing up to the line
+        plan = actions.ActionPlan()
+        turn = plan.add("turn swivel", lambda: self.swivel.back(block=False), self.swivel.tacho_motors)
+        approach = plan.add("approach", lambda: self.line_follower.follow_until_line(
+            self.right_sensor, backwards=True, speed=20, kp=2, kd=0.5))
+        plan.add("lower lift", lambda: self.lift.to_node(block=False), self.lift.tacho_motors, after=(turn, approach))
+        plan.run()
+
         self.line_follower.follow_for_time(0.5, speed=20, kp=1, on_left=False)
         self.lift.up()
 
+    # A turn around is done at full speed for _FAST_TURN_AROUND degrees, then slowly until the back sensor
+    # crosses the node line. If the fast part went on until the back sensor was already on the line, the slow
+    # part would take the line for the start of its white-black-white crossing and turn a full extra circle.
+    # Where the sensors sit is assumed in tools/simulator.py, not measured on the robot, so the bound doesn't
+    # depend on it: turning on the spot, a sensor behind the axle goes round a circle that only reaches the
+    # part of the line ahead of the robot after 90 degrees, however far back it is and however far the line
+    # is beside the axle. Less _SQUARE_ERROR degrees the robot may start off square to the line, the share of
+    # the real turn the encoders miss through wheel slip (_TURN_SLIP) and the degrees the fast turn, about
+    # 260 per second, goes on for while the wait notices the heading (_TURN_OVERSHOOT).
+    # tests/test_simulator.py checks the turn lands on the line for back sensors at several distances.
+    _SQUARE_ERROR = 10
+    _TURN_SLIP = 0.1
+    _TURN_OVERSHOOT = 5
+    _FAST_TURN_AROUND = int((90 - _SQUARE_ERROR) * (1 - _TURN_SLIP)) - _TURN_OVERSHOOT
+
     def turn_around_to_node_line(self):
         # Move back
         self.line_follower.follow_for_time(0.3, on_left=False, speed=50)
 
-        # Turn around
+        # Turn around, fast until the back sensor gets near the line again
+        self.mover.rotate(clockwise=False, block=False, speed=40)
+        self.wait_for_turn(self._FAST_TURN_AROUND)
         self.mover.rotate(clockwise=False, block=False, speed=20)
-        self.wait_for_white_cutoff(self.back_sensor, cutoff=50)
-        self.wait_for_black_cutoff(self.back_sensor, cutoff=30)
-        self.wait_for_white_cutoff(self.back_sensor, cutoff=50)
+        self.wait_for_line_crossed(self.back_sensor, dark=30, light=50)
         self.mover.stop()
 
     def go_red_to_middle(self):
         # Go back to fibre
         self.line_follower.follow_until_cutoff(self.left_sensor, 20, False, on_left=False)
         self.mover.rotate(clockwise=False, block=False, arc_radius=71)
-        self.wait_for_white_cutoff(self.front_sensor)
-        self.wait_for_black_cutoff(self.front_sensor)
+        self.wait_for_line(self.front_sensor)
         self.line_follower.follow_until_line(self.left_sensor, on_left=False)
 
-    def do_other_nodes(self):
-        if self.position_of_top_white == 0:
-            self.go_fibre_one_to_middle_node()
-            self.pickup_node()
-            self.middle_to_red_drop()
-            self.drop_off_node(sensors.RED)
-            self.go_from_red_drop_to_line_up_third()
-            self.pickup_node()
-            self.turn_around_to_node_line()
-            self.drop_off_node(sensors.BLUE)
-        elif self.position_of_top_white == 1:
-            self.go_to_third_node_from_first_fibre()
-            self.pickup_node()
-            self.turn_around_to_node_line()
-            self.drop_off_node(sensors.BLUE)
-        else:
-            self.go_fibre_one_to_middle_node()
-            self.pickup_node()
-            self.go_pickup_middle_to_blue()
-            self.drop_off_node(sensors.BLUE)
-
     def go_to_third_node_from_first_fibre(self):
         self.mover.rotate(clockwise=False, degrees=90, arc_radius=270, backwards=True)
         self.mover.rotate(degrees=90, arc_radius=60)
 
     def go_pickup_middle_to_blue(self):
         self.mover.rotate(block=False, clockwise=False)
-        self.wait_for_white_cutoff(self.back_sensor)
-        self.wait_for_black_cutoff(self.back_sensor)
+        self.wait_for_line(self.back_sensor)
         self.mover.stop()
 
         self.line_follower.follow_for_time(0.5, backwards=True, stop=False, speed=30, kp=1, kd=0, on_left=False)
@@ -277,9 +408,7 @@ class Main:
 
     def middle_to_red_drop(self):
         self.mover.rotate(block=False)
-        self.wait_for_white_cutoff(self.back_sensor)
-        self.wait_for_black_cutoff(self.back_sensor)
-        self.wait_for_white_cutoff(self.back_sensor)
+        self.wait_for_line_crossed(self.back_sensor)
         self.mover.stop()
 
         self.line_follower.follow_for_time(0.5, backwards=True, on_left=False, stop=False, speed=30, kp=1, kd=0)
@@ -299,42 +428,49 @@ class Main:
 
         # Turn around
         self.mover.rotate(block=False)
-        self.wait_for_white_cutoff(self.back_sensor)
-        self.wait_for_black_cutoff(self.back_sensor, cutoff=30)
+        self.wait_for_line(self.back_sensor, dark=30)
         self.mover.stop()
 
     def drop_off_node(self, color, use_color_mode=False):
         # TODO Fix drop off
 
+        # Orient the node while backing into the drop off
+        plan = actions.ActionPlan()
+        orient = plan.add("orient node", lambda: self.orient_block(color, block=False), self.swivel.tacho_motors)
+        plan.add("back in", lambda: self._back_into_drop_off(color, use_color_mode))
+        plan.run()
+
+        # Drop off
+        self.place_node_in_slot(orient.result)
+
+    def _back_into_drop_off(self, color, use_color_mode):
         if use_color_mode:
             self.line_follower.follow_until_color(self.back_sensor, (color,), speed=20, backwards=True, kp=1.5, kd=0.5)
         else:
             self.line_follower.follow_until_constant(speed=20, kp=1.5, kd=0.5, backwards=True, cutoff=15, cycles=9,
                                                      stop=False, use_correction=False)
-            print("LOCKED")
+            log.debug("LOCKED")
             self.line_follower.follow_until_change(speed=20, kp=1.5, kd=0.5, backwards=True, cutoff=20, cycles=2,
                                                    use_correction=False)
 
         self.mover.travel(distance=20, backwards=True, speed=20)
 
-        # Drop off
-        orientation = self.orient_block(color)
-        self.place_node_in_slot(orientation)
-
     def go_fibre_one_to_middle_node(self):
         # Pick up node
         self.line_follower.follow_for_time(0.4, backwards=True, stop=True)
 
     def place_node_in_slot(self, orientation):
         if orientation == 270:
-            time.sleep(2)
+            self.swivel.wait_until_settled()
+            self.mover.wait_until_settled()
             self.lift._lift.on_for_degrees(self.lift._DEFAULT_SPEED, -240)
             self.mover.rotate(degrees=5, speed=20, clockwise=False)
             self.mover.rotate(degrees=10, clockwise=True, speed=20)
             self.mover.rotate(degrees=5, speed=20, clockwise=False)
 
         if orientation == 180 or orientation == 90:
-            time.sleep(2)
+            self.swivel.wait_until_settled()
+            self.mover.wait_until_settled()
             self.lift._lift.on_for_degrees(self.lift._DEFAULT_SPEED, -240)
             self.mover.travel(distance=15, backwards=False, speed=20)
             self.mover.travel(distance=15, speed=20, backwards=True)
@@ -371,44 +507,41 @@ class Main:
                                               speed=15, kp=1.5, kd=0)
         self.lift.up()
 
-        self.mover.rotate(clockwise=True, degrees=30, speed=20)
-        self.mover.travel(backwards=True, distance=130, speed=20)
-        self.mover.rotate(degrees=25, speed=20, clockwise=False)
+        self.mover.move_sequence((motors.Arc(30, clockwise=True, speed=20),
+                                  motors.Travel(130, backwards=True, speed=20),
+                                  motors.Arc(25, speed=20, clockwise=False)), stop=False)
 
         self.mover.rotate(clockwise=False, block=False)
-        self.wait_for_white_cutoff(self.front_sensor)
-        self.wait_for_black_cutoff(self.front_sensor)
+        self.wait_for_line(self.front_sensor)
 
-        self.line_follower.follow_until_intersection_x(5, self.left_sensor)
+        self.line_follower.follow_until_intersection_x(5, self.left_sensor, max_speed=80)
 
         self.mover.rotate(clockwise=False, degrees=90, arc_radius=50)
         self.line_follower.follow_until_intersection_x(2, self.left_sensor, on_left=False)
 
         # Turn
         self.mover.rotate(clockwise=False, arc_radius=50, block=False)
-        time.sleep(0.3)
-        self.wait_for_white_cutoff(self.front_sensor)
-        self.wait_for_black_cutoff(self.front_sensor)
+        self.pause(0.3)
+        self.wait_for_line(self.front_sensor)
         self.mover.stop()
 
         # Follow to drop off
         self.line_follower.follow_until_color(self.left_sensor, (sensors.YELLOW,), on_left=False, speed=20, kp=1.5,
                                               kd=0)
         self.mover.travel(speed=15, block=False)
-        while not self.left_sensor.get_color() == sensors.WHITE:
-            pass
+        self.wait_for_colors(self.left_sensor, (sensors.WHITE,))
         self.mover.stop()
 
         self.mover.travel(distance=10)
 
         self.lift.to_fibre()
-        time.sleep(0.5)
+        self.pause(0.5)
         self.lift.up()
 
     def return_to_start(self):
         self.mover.rotate(degrees=90, backwards=True, arc_radius=400)
         self.mover.travel(backwards=True, block=False)
-        time.sleep(5)
+        self.pause(5)
         self.mover.rotate(degrees=90, clockwise=False, arc_radius=75)
         self.mover.travel(backwards=True, block=False)
 
@@ -426,63 +559,100 @@ class Main:
     #  UTILITIES  #
     ###############
 
-    @staticmethod
-    def wait_for_black_cutoff(sensor, cutoff=40):
-        while sensor.get_reflected() > cutoff:
-            pass
-
-    @staticmethod
-    def wait_for_white_cutoff(sensor, cutoff=60):
-        while sensor.get_reflected() < cutoff:
-            pass
-
-    @staticmethod
-    def wait_for_colors(sensor, colors):
-        while not sensor.get_color() in colors:
-            pass
-
-    def orient_block(self, color):
-        try:
-            index = self.color_codes.index(color)
-        except:
-            index = 0
+    # The wait loops sample the hub themselves since the line follower isn't running
+
+    def pause(self, seconds):
+        """
+        Sleeps, printing the buffered log messages that fit in the pause when no motor runs. A pause with a
+        motor running times a move (e.g. how far a turn goes before waiting for the line), so the messages
+        wait for the next idle pause.
+        """
+        end = time.time() + seconds
+        if not self._motors_running():
+            log.flush(until=end)
+        remaining = end - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _motors_running(self):
+        for tacho_motor in self.mover.tacho_motors + self.swivel.tacho_motors + self.lift.tacho_motors:
+            if tacho_motor.is_running:
+                return True
+        return False
+
+    def wait_for_black_cutoff(self, sensor, cutoff=40):
+        cutoff = sensor.reflected_threshold(cutoff)
+        return self._wait_for(sensor.watch_reflected(lambda value: value <= cutoff), "black cutoff")
+
+    def wait_for_white_cutoff(self, sensor, cutoff=60):
+        cutoff = sensor.reflected_threshold(cutoff)
+        return self._wait_for(sensor.watch_reflected(lambda value: value >= cutoff), "white cutoff")
+
+    def wait_for_line(self, sensor, dark=40, light=60):
+        """Waits for the sensor to see white and then get onto a line"""
+        return self._wait_for(conditions.Threshold(sensor, dark, light), "line")
+
+    def wait_for_line_crossed(self, sensor, dark=40, light=60):
+        """Waits for the sensor to go over a line, from white to white"""
+        white = sensor.reflected_threshold(light)
+        return self._wait_for(conditions.Sequence(conditions.Threshold(sensor, dark, light),
+                                                  sensor.watch_reflected(lambda value: value >= white)),
+                              "line crossed")
+
+    def wait_for_colors(self, sensor, colors):
+        return self._wait_for(sensor.watch_color(lambda color: color in colors), "colors")
+
+    def wait_for_distance(self, distance):
+        return self._wait_for(self.mover.odometry.distance_trigger(distance), "distance")
+
+    def wait_for_turn(self, degrees):
+        return self._wait_for(self.mover.odometry.heading_trigger(degrees), "turn")
+
+    # A wait raises conditions.TimedOut after this many seconds, which ends the run with the robot stopped by
+    # teardown() instead of leaving it driving past a missed line. Like line_follower.LineFollower._DEFAULT_TIMEOUT.
+    _WAIT_TIMEOUT = 30
+
+    def _wait_for(self, condition, what, timeout=_WAIT_TIMEOUT):
+        """
+        Waits for a Watch, trigger or composed condition and returns the one that fired.
+        Raises conditions.TimedOut if the condition wasn't met within timeout seconds, None waits forever.
+        :param what: what is waited for, for the error
+        """
+        on_cycle = None if self.recorder is None else self.recorder.record
+        if timeout is not None:
+            condition = conditions.AnyOf(condition, conditions.Timeout(timeout, name="timeout"))
+        fired = conditions.wait(condition, hub=self.sensor_hub, on_cycle=on_cycle)
+        if isinstance(fired, conditions.Timeout):
+            raise conditions.TimedOut("Waited %s s for %s" % (timeout, what))
+        return fired
+
+    def orient_block(self, color, block=True):
+        change = self.block_turns.get((tuple(self.color_codes), color))
+        if change is None:
+            # The scan didn't find the four blocks
+            change = routes.block_turn(self.color_codes, color)
+        if change is None:
+            # Color wasn't scanned, turn as if it came first
+            change = routes.block_turn((color,), color)
             beep()
             beep()
 
-        if color in (sensors.RED, sensors.BLUE):
-            orientation = 0
-        else:
-            orientation = 180
-
-        if index == 0:
-            target = 0
-        elif index == 1:
-            target = 270
-        elif index == 2:
-            target = 180
-        else:
-            target = 90
-
-        change = target - orientation
-
-        if change < 0:
-            change += 360
-
         if change == 0:
-            self.swivel.forward()
+            self.swivel.forward(block=block)
         elif change == 90:
-            self.swivel.left()
+            self.swivel.left(block=block)
         elif change == 180:
-            self.swivel.back()
+            self.swivel.back(block=block)
         elif change == 270:
-            self.swivel.right()
+            self.swivel.right(block=block)
 
         return change
 
 
 if __name__ == '__main__':
     main = Main()
-    print("READY")
+    log.flush()
+    print("READY in %.2f s" % (time.time() - _START_TIME))
 
     # WAIT FOR ENTER
     if REQUIRE_ENTER_TO_START:
@@ -493,3 +663,11 @@ if __name__ == '__main__':
         main.run()
     finally:
         main.teardown()
+        log.flush()
+        print("Line follower: " + main.line_follower.scheduler.report())
+        if main.line_follower.stage_timer is not None:
+            print(main.line_follower.stage_timer.report())
+        if main.recorder is not None:
+            main.recorder.save(TELEMETRY_PATH)
+        if main.profiler is not None:
+            print(main.profiler.report(TIME_LIMIT))
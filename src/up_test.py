@@ -1,8 +1,9 @@
 #!/usr/bin/env micropython
 
+import lib.up_log as log
 import up_main as main
 
 main = main.Main()
-main.setup()
 main.test()
 main.teardown()
+log.flush()
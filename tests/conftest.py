@@ -0,0 +1,25 @@
+"""Runs the robot code against the fake ev3dev2 backend in tools/fake, see tools/fake_robot.py."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+
+import pytest  # noqa: E402
+
+import fake_robot  # noqa: E402
+from fake_robot import fake  # noqa: E402
+
+import lib.up_log as log  # noqa: E402
+
+
+@pytest.fixture
+def clock():
+    """Fresh fake devices reading as if on the edge of a line, and a virtual clock"""
+    fake.reset()
+    fake_robot.script_on_line()
+    virtual_clock = fake.VirtualClock(read_cost=0.001)
+    virtual_clock.install()
+    log.reset()
+    yield virtual_clock
+    fake.reset()
@@ -0,0 +1,86 @@
+from fake_robot import fake
+
+import lib.up_actions as actions
+import lib.up_motors as motors
+
+
+def test_actions_start_once_what_they_depend_on_is_done(clock):
+    mover = motors.Mover(reverse_motors=True)
+    lift = motors.Lift()
+    started = {}
+
+    def start(name, move=None):
+        def begin():
+            started[name] = (clock.time(), mover.tacho_motors[0].is_running)
+            if move is not None:
+                move()
+        return begin
+
+    plan = actions.ActionPlan()
+    drive = plan.add("drive", start("drive", lambda: mover.travel(100, block=False)), mover.tacho_motors)
+    plan.add("check", start("check"), after=(drive,))
+    plan.add("lower lift", start("lower lift", lambda: lift.to_fibre(block=False)), lift.tacho_motors)
+
+    assert plan.run()
+
+    assert started["drive"][0] == started["lower lift"][0] == 0
+    # The blocking action only runs once the wheels stopped
+    drive_time, wheels_running = started["check"]
+    assert drive_time > 0.1 and not wheels_running
+    assert not lift._lift.is_running
+
+
+def test_motor_actions_start_before_blocking_ones(clock):
+    mover = motors.Mover(reverse_motors=True)
+    order = []
+
+    plan = actions.ActionPlan()
+    plan.add("wait", lambda: (order.append("wait"), clock.advance(0.2)))
+    plan.add("drive", lambda: (order.append("drive"), mover.travel(100, block=False)), mover.tacho_motors)
+    plan.run()
+
+    # The wheels turned while the blocking action ran
+    assert order == ["drive", "wait"]
+    assert abs(mover.tacho_motors[0].position) > 0
+
+
+def test_motor_action_that_never_moves_is_done_after_the_grace(clock):
+    mover = motors.Mover(reverse_motors=True)
+    plan = actions.ActionPlan()
+    plan.add("already there", lambda: None, mover.tacho_motors)
+
+    assert plan.run()
+    assert actions.Action._START_GRACE <= clock.time() < actions.Action._START_GRACE + 2 * actions.ActionPlan._POLL
+
+
+def test_run_gives_up_after_the_timeout(clock):
+    mover = motors.Mover(reverse_motors=True)
+    plan = actions.ActionPlan()
+    plan.add("drive forever", lambda: mover.travel(block=False), mover.tacho_motors)
+
+    assert not plan.run(timeout=0.5)
+    assert 0.5 <= clock.time() < 0.5 + 2 * actions.ActionPlan._POLL
+
+
+def test_run_until_leaves_the_other_actions_going(clock):
+    mover = motors.Mover(reverse_motors=True)
+    lift = motors.Lift()
+    plan = actions.ActionPlan()
+    lower = plan.add("lower lift", lambda: lift.to_fibre(block=False), lift.tacho_motors)
+    plan.add("drive forever", lambda: mover.travel(block=False), mover.tacho_motors)
+
+    assert plan.run(until=(lower,))
+    assert mover.tacho_motors[0].is_running
+    assert fake.motor_log[-1][2] != "stop"
+
+
+def test_unrunnable_dependencies_raise(clock):
+    plan = actions.ActionPlan()
+    missing = actions.Action("not in the plan", lambda: None)
+    plan.add("orphan", lambda: None, after=(missing,))
+
+    try:
+        plan.run()
+    except ValueError:
+        return
+    raise AssertionError("Ran a plan with an action that can never start")
@@ -0,0 +1,126 @@
+import pytest
+
+from fake_robot import fake, ports, sensors
+
+import lib.up_conditions as conditions
+import lib.up_line_follower as line_follower
+import lib.up_motors as motors
+
+
+class _Flag:
+    def __init__(self):
+        self.value = False
+
+    def check(self):
+        return self.value
+
+
+def test_any_of_reports_the_condition_that_fired(clock):
+    line = _Flag()
+    timeout = conditions.Timeout(0.5)
+    condition = conditions.AnyOf(line, timeout)
+
+    assert conditions.wait(condition) is timeout
+    assert abs(clock.time() - 0.5) < 0.01
+
+    condition.restart()
+    line.value = True
+    assert conditions.wait(condition) is line
+
+
+def test_sequence_checks_one_condition_after_the_other(clock):
+    first, second = _Flag(), _Flag()
+    sequence = conditions.Sequence(first, second)
+
+    second.value = True
+    assert not sequence.check()
+    first.value = True
+    assert not sequence.check()  # Moves on to the second condition
+    assert sequence.check()
+
+
+def test_all_of_remembers_conditions_already_met(clock):
+    first, second = _Flag(), _Flag()
+    condition = conditions.AllOf(first, second)
+
+    first.value = True
+    assert not condition.check()
+    first.value = False
+    second.value = True
+    assert condition.check()
+
+    condition.restart()
+    assert not condition.check()
+
+
+def test_motors_stopped_waits_for_the_move(clock):
+    lift = motors.Lift()
+    lift._lift.on_for_degrees(motors.Lift._DEFAULT_SPEED, 360, block=False)
+    stopped = conditions.MotorsStopped(lift.tacho_motors)
+
+    assert not stopped.check()
+    assert conditions.wait(stopped) is stopped
+    assert not lift._lift.is_running
+    assert abs(lift._lift.position - 360) <= 1
+
+
+def test_wait_polls_files_that_notify(clock, tmp_path):
+    path = tmp_path / "state"
+    path.write_bytes(b"running\n")
+
+    class _Notifying(_Flag):
+        def __init__(self, file):
+            _Flag.__init__(self)
+            self.file = file
+
+        def files(self):
+            return (self.file,)
+
+    with open(str(path), "rb") as file:
+        sleep = conditions._poll_sleep(conditions.AnyOf(_Notifying(file), conditions.Timeout(1)))
+        assert sleep is not None
+        sleep(0.001)
+
+    # The fake motors' attribute files have no file descriptor
+    lift = motors.Lift()
+    assert conditions._poll_sleep(conditions.MotorsStopped(lift.tacho_motors)) is None
+
+
+def test_threshold_needs_light_before_dark(clock):
+    sensor = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    fake.script_sensor(ports.FRONT_SENSOR, [30, 45, 30, 65, 45, 30], mode=sensors.REFLECTED)
+    threshold = conditions.Threshold(sensor, 40, 60)
+
+    checks = 0
+    while not threshold.check():
+        checks += 1
+
+    assert checks == 5
+
+
+def test_follow_until_line_stops_after_the_timeout(clock):
+    mover = motors.Mover(reverse_motors=True)
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    left = sensors.EV3ColorSensor(ports.LEFT_SENSOR)
+    follower = line_follower.LineFollower(mover, front, front)
+    fake.script_sensor(ports.LEFT_SENSOR, [sensors.WHITE], mode=sensors.COLOR)
+
+    with pytest.raises(conditions.TimedOut, match="Followed for 2 s without reaching colors"):
+        follower.follow_until_line(left, timeout=2)
+
+    assert 2 <= clock.time() < 2.1
+    assert not mover.tacho_motors[0].is_running
+
+
+def test_follow_until_intersection_x_stops_after_the_timeout(clock):
+    mover = motors.Mover(reverse_motors=True)
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    left = sensors.EV3ColorSensor(ports.LEFT_SENSOR)
+    follower = line_follower.LineFollower(mover, front, front)
+    fake.script_sensor(ports.LEFT_SENSOR, [sensors.WHITE], mode=sensors.COLOR)
+
+    with pytest.raises(conditions.TimedOut, match="Counted 0 of 3 intersections"):
+        follower.follow_until_intersection_x(3, left, timeout=1)
+
+    assert 1 <= clock.time() < 1.1
+    assert not mover.tacho_motors[0].is_running
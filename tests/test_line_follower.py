@@ -0,0 +1,205 @@
+from fake_robot import fake, ports, sensors
+
+import lib.up_line_follower as line_follower
+import lib.up_log as log
+import lib.up_motors as motors
+
+Counter = line_follower.IntersectionCounter
+
+
+class _Track:
+    """Sensor and odometry reading a synthetic trace of (distance in mm, reading) pairs, one pair per update"""
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.index = 0
+
+    # Sensor
+
+    def reflected_threshold(self, value):
+        return value
+
+    def get_reflected(self):
+        return self.readings[self.index][1]
+
+    def get_color(self):
+        return self.readings[self.index][1]
+
+    # Odometry
+
+    @property
+    def distance(self):
+        return self.readings[self.index][0]
+
+    def update(self):
+        pass
+
+
+def _run(readings, use_reflection=True):
+    """Returns the distances at which each line was counted"""
+    track = _Track(readings)
+    counter = Counter(track, track, use_reflection=use_reflection)
+    counted = []
+    for index in range(len(readings)):
+        track.index = index
+        if counter.update() > len(counted):
+            counted.append(track.distance)
+    return counted
+
+
+def _lines(edges, step=1.0, length=300, dark=10, light=60):
+    """Readings every step mm of a track with dark lines between the (start, end) edges in mm"""
+    readings = []
+    distance = 0.0
+    while distance <= length:
+        on_line = any(start <= distance < end for start, end in edges)
+        readings.append((distance, dark if on_line else light))
+        distance += step
+    return readings
+
+
+def test_counts_each_line_once():
+    assert len(_run(_lines([(50, 70), (150, 170), (250, 270)]))) == 3
+
+
+def test_counts_min_width_into_the_line():
+    counted = _run(_lines([(50, 70), (150, 170)], step=0.5))
+
+    assert counted == [50 + Counter._MIN_WIDTH, 150 + Counter._MIN_WIDTH]
+
+
+def test_count_is_within_a_reading_of_min_width_into_the_line():
+    step = 3.8  # Travelled between two readings at speed 50
+    for start in (50, 51.3, 52.9):
+        counted = _run(_lines([(start, start + 20)], step=step))
+
+        first_dark = (int(start / step) + (start % step > 0)) * step
+        assert len(counted) == 1
+        assert first_dark + Counter._MIN_WIDTH <= counted[0] < first_dark + Counter._MIN_WIDTH + step
+
+
+def test_count_doesnt_depend_on_the_reading_spacing():
+    edges = [(40, 60), (120, 140), (200, 220), (280, 295)]
+    for step in (0.5, 1, 2.5, 4, 6):
+        assert len(_run(_lines(edges, step=step))) == len(edges)
+
+
+def test_hysteresis_keeps_a_noisy_line_as_one():
+    readings = []
+    for distance in range(0, 200):
+        if 50 <= distance < 80:
+            # Noise around a single cutoff in the middle of the line, never back over _LIGHT
+            value = Counter._DARK - 2 if distance % 2 else Counter._LIGHT - 2
+        else:
+            value = 60
+        readings.append((distance, value))
+
+    assert len(_run(readings)) == 1
+
+
+def test_noise_between_the_thresholds_doesnt_start_a_line():
+    readings = [(distance, Counter._DARK + 1 if distance % 2 else Counter._LIGHT - 1) for distance in range(200)]
+
+    assert _run(readings) == []
+
+
+def test_line_ends_only_on_a_light_reading():
+    # The sensor comes back up past _DARK but not to _LIGHT, then goes dark again 50 mm later
+    readings = []
+    for distance in range(0, 200):
+        if 50 <= distance < 60 or 110 <= distance < 120:
+            value = 10
+        elif 60 <= distance < 110:
+            value = Counter._LIGHT - 1
+        else:
+            value = 60
+        readings.append((distance, value))
+
+    assert len(_run(readings)) == 1
+
+
+def test_debounce_ignores_specks():
+    specks = [(50, 51), (100, 102), (150, 152.5)]
+
+    assert _run(_lines(specks, step=0.5)) == []
+
+
+def test_spacing_ignores_lines_too_close_to_the_last_one():
+    too_close = 50 + Counter._MIN_SPACING - 10
+    far_enough = 50 + Counter._MIN_SPACING + 10
+    assert len(_run(_lines([(50, 55), (too_close, too_close + 5)], step=0.5))) == 1
+    assert len(_run(_lines([(50, 55), (far_enough, far_enough + 5)], step=0.5))) == 2
+
+
+def test_spacing_is_measured_from_the_start_of_the_last_line():
+    # A wide line: the next one starts _MIN_SPACING after the last start but only 5 mm after its end
+    second = 50 + Counter._MIN_SPACING
+    assert len(_run(_lines([(50, second - 5), (second, second + 10)], step=0.5))) == 2
+
+
+def test_color_mode_counts_black():
+    readings = _lines([(50, 60), (150, 160)], dark=sensors.BLACK, light=sensors.WHITE)
+
+    assert len(_run(readings, use_reflection=False)) == 2
+
+
+def test_saturated_steering_is_logged_once_per_segment(clock):
+    mover = motors.Mover(reverse_motors=True)
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    follower = line_follower.LineFollower(mover, front, front)
+    log.info("Top white at %s", 1)
+
+    # Far off the line for longer than the log holds messages
+    fake.script_sensor(ports.FRONT_SENSOR, [100], mode=sensors.REFLECTED)
+    follower.follow_for_time(2 * log._SIZE / line_follower.LineFollower._DEFAULT_FREQUENCY, kp=10)
+
+    lines = []
+    log.flush(lines.append)
+    assert len(lines) == 2
+    assert lines[0].endswith("INFO: Top white at 1")
+    assert "WARNING: Steering saturated at +-100 for" in lines[1]
+    assert follower.saturated_cycles == 0
+
+
+def _scheduled_speeds(readings, speed=30, max_speed=60):
+    """Speed scheduled on each cycle of follow() with max_speed over the front sensor readings"""
+    mover = motors.Mover(reverse_motors=True)
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    follower = line_follower.LineFollower(mover, front, front)
+    fake.script_sensor(ports.FRONT_SENSOR, readings, mode=sensors.REFLECTED)
+    speeds = []
+    for _ in readings:
+        follower.follow(speed=speed, max_speed=max_speed)
+        speeds.append(follower.scheduled_speed)
+    return speeds, mover
+
+
+def test_speed_rises_gradually_on_a_straight_line(clock):
+    middle = line_follower.LineFollower._MIDDLE_VALUE
+    speeds, mover = _scheduled_speeds([middle] * 100)
+
+    assert speeds[0] == 30 + line_follower.LineFollower._SPEED_RISE
+    rises = [after - before for before, after in zip(speeds, speeds[1:])]
+    assert all(0 <= rise <= line_follower.LineFollower._SPEED_RISE for rise in rises)
+    assert speeds[-1] == 60
+    assert (mover.left_speed, mover.right_speed) == (60, 60)
+
+
+def test_large_error_drops_to_the_minimum_at_once(clock):
+    middle = line_follower.LineFollower._MIDDLE_VALUE
+    large = middle + line_follower.LineFollower._LARGE_ERROR
+    speeds, _ = _scheduled_speeds([middle] * 80 + [large] + [middle] * 5)
+
+    assert speeds[79] == 60
+    assert speeds[80] == 30
+    # Back on the line, the speed only rises at its usual pace
+    assert speeds[85] <= 30 + 5 * line_follower.LineFollower._SPEED_RISE
+
+
+def test_steady_error_settles_between_the_speeds(clock):
+    follower = line_follower.LineFollower
+    error = (follower._STEADY_ERROR + follower._LARGE_ERROR) // 2
+    speeds, _ = _scheduled_speeds([follower._MIDDLE_VALUE + error] * 100)
+
+    assert speeds[-1] == 45
+    assert max(speeds) == 45
@@ -0,0 +1,65 @@
+import lib.up_log as log
+
+
+def _flush():
+    lines = []
+    log.flush(lines.append)
+    return lines
+
+
+def test_flush_formats_messages_oldest_first(clock):
+    log.info("Top white at %s", 2)
+    clock.advance(1.5)
+    log.warning("Steering at +100")
+
+    lines = _flush()
+
+    assert lines == ["   0.000 INFO: Top white at 2", "   1.500 WARNING: Steering at +100"]
+    assert _flush() == []
+
+
+def test_messages_under_the_level_are_dropped(clock):
+    log.debug("Correction %s", 3)
+    log.set_level(log.DEBUG)
+    try:
+        log.debug("Correction %s", 4)
+    finally:
+        log.set_level(log.INFO)
+
+    assert _flush() == ["   0.000 DEBUG: Correction 4"]
+
+
+def test_overflow_keeps_the_newest_messages(clock):
+    for number in range(log._SIZE + 88):
+        log.info("Message %s", number)
+
+    lines = _flush()
+
+    assert lines[0] == "WARNING: log buffer full, lost 88 messages"
+    assert len(lines) == 1 + log._SIZE
+    assert lines[1].endswith("Message 88")
+    assert lines[-1].endswith("Message %s" % (log._SIZE + 87))
+
+
+def test_flush_between_messages_loses_nothing(clock):
+    for number in range(3 * log._SIZE):
+        log.info("Message %s", number)
+        if number % 100 == 99:
+            assert len(_flush()) == 100
+
+    assert len(_flush()) == 3 * log._SIZE % 100
+
+
+def test_flush_stops_at_the_time_given(clock):
+    for number in range(5):
+        log.info("Message %s", number)
+    lines = []
+
+    def slow_write(line):
+        lines.append(line)
+        clock.advance(0.1)
+
+    log.flush(slow_write, until=clock.time() + 0.25)
+
+    assert len(lines) == 3
+    assert [line[-9:] for line in _flush()] == ["Message 3", "Message 4"]
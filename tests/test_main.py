@@ -0,0 +1,28 @@
+import lib.up_log as log
+import up_main
+
+
+def _main(monkeypatch):
+    # The virtual clock only works with one thread
+    monkeypatch.setattr(up_main, "SAMPLE_HITECHNIC_IN_BACKGROUND", False)
+    monkeypatch.setattr(up_main, "PARALLEL_STARTUP", False)
+    main = up_main.Main()
+    log.flush(lambda line: None)
+    return main
+
+
+def test_pause_keeps_the_log_while_the_robot_turns(clock, monkeypatch, capsys):
+    main = _main(monkeypatch)
+    log.info("Turning")
+    main.mover.rotate(block=False)
+
+    start = clock.time()
+    main.pause(0.3)
+
+    assert abs(clock.time() - start - 0.3) < 1e-9
+    assert capsys.readouterr().out == ""
+
+    main.mover.stop()
+    main.pause(0.1)
+
+    assert "INFO: Turning" in capsys.readouterr().out
@@ -0,0 +1,164 @@
+import time
+
+from fake_robot import fake
+
+import lib.up_motors as motors
+
+# Degrees a wheel turns in one check of move_sequence() at the speeds below
+_TOLERANCE = 0.4 * motors.motor.MediumMotor.MAX_SPEED / motors.Mover._SEQUENCE_FREQUENCY + 1
+
+
+def _degrees(distance):
+    return motors.Mover._convert_rad_to_deg(motors.Mover._convert_distance_to_rad(distance))
+
+
+def _writes(mover):
+    return mover._left_writer.writes + mover._right_writer.writes
+
+
+def test_steering_only_writes_what_changed(clock):
+    mover = motors.Mover(reverse_motors=True)
+
+    mover.steer(0, speed=40)
+    assert _writes(mover) == 4  # Speed and command of each motor
+
+    mover.steer(0, speed=40)
+    mover.steer(0, speed=40.03)  # Same speed once quantized
+    assert _writes(mover) == 4
+
+    mover.steer(20, speed=40)
+    assert _writes(mover) == 5  # Only the inside wheel's speed
+    assert fake.stats["writes"] >= 5
+
+
+def test_fast_path_runs_again_after_a_move_tank_command(clock):
+    mover = motors.Mover(reverse_motors=True)
+    left_motor, right_motor = mover.tacho_motors
+    mover.steer(0, speed=40)
+
+    mover.travel(50)
+    assert not left_motor.is_running
+    assert (mover.left_speed, mover.right_speed) == (0, 0)
+
+    writes = _writes(mover)
+    mover.steer(0, speed=40)
+    assert _writes(mover) == writes + 4
+    assert left_motor.is_running and right_motor.is_running
+    assert fake.motor_log[-1][2] == "run-forever"
+
+    mover.stop()
+    mover.steer(0, speed=40)
+    assert left_motor.is_running and right_motor.is_running
+
+
+def test_sequence_drives_each_segment_its_degrees(clock):
+    mover = motors.Mover(reverse_motors=True)
+    left_motor, right_motor = mover.tacho_motors
+
+    mover.move_sequence((motors.Travel(100), motors.Travel(60, backwards=True)))
+
+    assert abs(left_motor.position - (_degrees(100) - _degrees(60))) <= 2 * _TOLERANCE
+    assert abs(right_motor.position - left_motor.position) <= 1
+    assert not left_motor.is_running
+
+
+def test_sequence_turns_the_arc_before_the_next_segment(clock):
+    mover = motors.Mover(reverse_motors=True)
+    arc = motors.Arc(30, clockwise=False, speed=20)
+    travel = motors.Travel(130, backwards=True, speed=20)
+    left_motor, right_motor = mover.tacho_motors
+    handoff = []
+
+    run = mover._run
+
+    def record_handoff(left_speed, right_speed):
+        if not handoff and right_speed == travel.right_speed:
+            handoff.append(right_motor.position)
+        run(left_speed, right_speed)
+
+    mover._run = record_handoff
+    mover.move_sequence((arc, travel))
+
+    # The right wheel leads the counter-clockwise turn
+    assert arc.degrees <= handoff[0] <= arc.degrees + _TOLERANCE
+
+
+def test_wheel_turning_back_doesnt_count_as_progress(clock, monkeypatch):
+    mover = motors.Mover(reverse_motors=True)
+    left_motor = mover.tacho_motors[0]
+    travel = motors.Travel(100, backwards=True)
+    jolts = []
+
+    def sleep_and_jolt(seconds):
+        # The wheel rolls forward well past the segment's degrees before driving backwards
+        if not jolts:
+            left_motor._start_position += 2 * travel.degrees
+            jolts.append(seconds)
+        clock.sleep(seconds)
+
+    monkeypatch.setattr(time, "sleep", sleep_and_jolt)
+    mover.move_sequence((travel,))
+
+    assert jolts
+    assert left_motor.position <= -travel.degrees + _TOLERANCE
+
+
+def _block(tacho_motor, stalled):
+    """Holds the wheel where it is, reporting a stall like the tacho motor driver does or not"""
+    def held():
+        tacho_motor._since = fake.clock.time()
+        tacho_motor._stalled = stalled
+    tacho_motor._update = held
+
+
+def test_stalled_wheel_ends_the_segment(clock):
+    mover = motors.Mover(reverse_motors=True)
+    travel = motors.Travel(100)
+    _block(mover.tacho_motors[0], stalled=True)
+
+    mover.move_sequence((travel, motors.Travel(50)))
+
+    assert clock.time() < 0.1
+    assert len([command for command in fake.motor_log if command[2] == "run-forever"]) == 2
+
+
+def test_blocked_wheel_times_out(clock):
+    mover = motors.Mover(reverse_motors=True)
+    travel = motors.Travel(100)
+    speed = travel.left_speed * motors.motor.MediumMotor.MAX_SPEED / 100
+    _block(mover.tacho_motors[0], stalled=False)
+
+    mover.move_sequence((travel,))
+
+    limit = motors.Mover._SEQUENCE_TIME_FACTOR * travel.degrees / speed + motors.Mover._SEQUENCE_TIME_SLACK
+    assert limit <= clock.time() < limit + 0.1
+
+
+def test_sequence_keeps_going_without_stop(clock):
+    mover = motors.Mover(reverse_motors=True)
+
+    mover.move_sequence((motors.Arc(25, speed=20),), stop=False)
+
+    assert mover.tacho_motors[0].is_running
+    assert fake.motor_log[-1][2] == "run-forever"
+
+
+def test_background_calibration_failure_raises_on_the_moves(clock):
+    lift = motors.Lift()
+
+    def unplugged(*args, **kwargs):
+        raise OSError("lift motor unplugged")
+
+    lift._lift.on = unplugged
+    lift.calibrate(block=False)
+
+    for move in (lift.to_fibre, lift.to_fibre):
+        try:
+            move()
+        except OSError:
+            continue
+        raise AssertionError("Moved the lift after its calibration failed")
+
+    lift._lift.on = lambda *args, **kwargs: None
+    lift.calibrate(block=False)
+    lift.to_fibre()
@@ -0,0 +1,94 @@
+import random
+
+import lib.up_routes as routes
+import lib.up_sensors as sensors
+
+
+def _brute_force(position, start, end, connections, tasks, max_legs=10):
+    """Cheapest cost over every walk from start to end doing each goal once, None if there is none"""
+    goals = routes.goals(position)
+    best = [None]
+
+    def walk(waypoint, cost, done, legs):
+        if waypoint == end and len(done) == len(goals) and (best[0] is None or cost < best[0]):
+            best[0] = cost
+        if legs == max_legs:
+            return
+        for leg in connections:
+            if leg.start == waypoint:
+                walk(leg.end, cost + leg.cost, done, legs + 1)
+        for task in tasks:
+            if task.start == waypoint and task.goal in goals and task.goal not in done:
+                walk(task.end, cost + task.cost, done + [task.goal], legs + 1)
+
+    walk(start, 0, [], 0)
+    return best[0]
+
+
+def _goals_done(route):
+    return [leg.goal for leg in route.legs if isinstance(leg, routes.Task)]
+
+
+def _is_connected(route, start, end):
+    waypoint = start
+    for leg in route.legs:
+        if leg.start != waypoint:
+            return False
+        waypoint = leg.end
+    return waypoint == end
+
+
+def test_plans_are_the_cheapest_routes():
+    for position in range(len(routes.NODES)):
+        route = routes.plan(position)
+
+        assert route.cost == _brute_force(position, routes.TOP_ROW, routes.BLUE_DROP, routes.CONNECTIONS,
+                                          routes.TASKS)
+        assert _is_connected(route, routes.TOP_ROW, routes.BLUE_DROP)
+        assert sorted(_goals_done(route), key=str) == sorted(routes.goals(position), key=str)
+
+
+def test_plans_are_the_cheapest_routes_with_other_costs():
+    generator = random.Random(2019)
+    for _ in range(50):
+        connections = tuple(routes.Leg(leg.start, leg.end, leg.steps, generator.randint(1, 20))
+                            for leg in routes.CONNECTIONS)
+        tasks = tuple(routes.Task(task.goal, task.start, task.end, task.steps, generator.randint(1, 20))
+                      for task in routes.TASKS)
+        for position in range(len(routes.NODES)):
+            route = routes.plan(position, connections=connections, tasks=tasks)
+
+            assert route.cost == _brute_force(position, routes.TOP_ROW, routes.BLUE_DROP, connections, tasks)
+            assert _is_connected(route, routes.TOP_ROW, routes.BLUE_DROP)
+
+
+def test_plan_without_a_route_is_none():
+    connections = tuple(leg for leg in routes.CONNECTIONS if leg.end != routes.FIBRE_DROP)
+
+    assert routes.plan(0, connections=connections) is None
+
+
+def test_plans_match_the_fixed_routes():
+    steps = dict((position, [name for name, _ in route.steps()]) for position, route in routes.plan_all().items())
+
+    assert steps[0] == ["turn_onto_fibre_line", "follow_to_fibre_drop", "drop_fibre", "go_fibre_one_to_middle_node",
+                        "pickup_node", "middle_to_red_drop", "drop_off_node", "go_from_red_drop_to_line_up_third",
+                        "pickup_node", "turn_around_to_node_line", "drop_off_node"]
+    assert steps[1][:4] == ["go_middle_to_line_up_with_first_node", "pickup_node", "turn_around_to_node_line",
+                            "drop_off_node"]
+    assert steps[1][-4:] == ["go_to_third_node_from_first_fibre", "pickup_node", "turn_around_to_node_line",
+                             "drop_off_node"]
+    assert steps[2][-4:] == ["go_fibre_one_to_middle_node", "pickup_node", "go_pickup_middle_to_blue",
+                             "drop_off_node"]
+
+
+def test_block_turns_match_the_swivel_slots():
+    order = (sensors.GREEN, sensors.RED, sensors.YELLOW, sensors.BLUE)
+    turns = routes.block_turns()
+
+    assert turns[(order, sensors.GREEN)] == 180
+    assert turns[(order, sensors.RED)] == 270
+    assert turns[(order, sensors.YELLOW)] == 0
+    assert turns[(order, sensors.BLUE)] == 90
+    assert len(turns) == 24 * 4
+    assert routes.block_turn((sensors.RED,), sensors.BLUE) is None
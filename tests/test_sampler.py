@@ -0,0 +1,119 @@
+import time
+
+from fake_robot import fake, ports, sensors
+
+import lib.up_sampler as sampler
+
+
+def _sample(readings):
+    """Samples the HiTechnic sensor on its thread at 1 kHz, in real time"""
+    fake.reset()
+    fake.script_sensor(ports.RIGHT_SENSOR, readings)
+    sensor = sensors.HiTechnicSensor(ports.RIGHT_SENSOR)
+    background = sampler.Sampler(frequency=1000)
+    background.add(sensor, sensor.MODE_COLOR)
+    background.start()
+    return sensor, background
+
+
+def _wait_until(predicate, seconds=2):
+    end = time.time() + seconds
+    while not predicate():
+        assert time.time() < end
+        time.sleep(0.001)
+
+
+def test_failed_reads_are_retried():
+    reads = [0]
+
+    def flaky(_):
+        reads[0] += 1
+        if reads[0] % 3 == 0:
+            raise OSError(5, "I2C error")
+        return 2
+
+    sensor, background = _sample(flaky)
+    try:
+        _wait_until(lambda: sensor.history.count >= 20)
+        assert background.failed_samples > 0
+        assert sensor.get_color() == sensors.BLUE
+    finally:
+        background.stop()
+        fake.reset()
+
+
+def test_readers_raise_once_the_sampler_gives_up():
+    reads = [0]
+
+    def unplugged(_):
+        reads[0] += 1
+        if reads[0] > 1:
+            raise OSError(5, "I2C error")
+        return 2
+
+    sensor, background = _sample(unplugged)
+    watch = sensor.watch_color(lambda color: color == sensors.RED)
+    try:
+        _wait_until(lambda: sensor.history.error is not None)
+        assert background.failed_samples == sampler.Sampler._MAX_FAILURES
+        for read in (sensor.get_color, watch.check):
+            try:
+                read()
+            except OSError:
+                continue
+            raise AssertionError("Read the last sample of a sampler that gave up")
+    finally:
+        background.stop()
+        fake.reset()
+    assert sensor.history is None
+
+
+def _sampled_sensor(size):
+    """Front sensor whose history is filled by hand instead of by a sampler thread"""
+    sensor = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    sensor.set_mode(sensors.REFLECTED)
+    sensor.history = sampler.SampleBuffer(size)
+    return sensor
+
+
+def _append(sensor, values):
+    for value in values:
+        sensor.history.append(value, time.time())
+
+
+def test_watch_sees_every_sample_since_the_last_check(clock):
+    sensor = _sampled_sensor(8)
+    watch = sensor.watch_reflected(lambda value: value <= 20)
+
+    _append(sensor, [60, 60, 10, 60])
+    assert watch.check()  # The dark sample isn't the latest any more
+    assert not watch.check()  # and only counts once
+
+    _append(sensor, [60, 15])
+    assert watch.check()
+
+
+def test_watch_skips_samples_overwritten_in_the_ring(clock):
+    sensor = _sampled_sensor(8)
+    watch = sensor.watch_reflected(lambda value: value <= 20)
+
+    # Dark at sample 3, overwritten by the 16 samples since
+    _append(sensor, [60, 60, 60, 10] + [60] * 16)
+    assert sensor.history.oldest_available() == 12
+    assert not watch.check()
+
+    # Dark again after more samples than the ring holds: found once, not again from its reused slots
+    _append(sensor, [60] * 12 + [12] + [60])
+    assert watch.check()
+    assert not watch.check()
+    assert sensor.history.latest() == 60
+
+
+def test_watch_restart_ignores_earlier_samples(clock):
+    sensor = _sampled_sensor(8)
+    watch = sensor.watch_reflected(lambda value: value <= 20)
+
+    _append(sensor, [10, 60])
+    watch.restart()
+    _append(sensor, [60, 60])
+    assert not watch.check()
@@ -0,0 +1,102 @@
+import random
+
+from fake_robot import fake, ports, sensors
+
+import lib.up_line_follower as line_follower
+import lib.up_motors as motors
+
+
+def _make_robot():
+    mover = motors.Mover(reverse_motors=True)
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    left = sensors.EV3ColorSensor(ports.LEFT_SENSOR)
+    back = sensors.EV3ColorSensor(ports.BACK_SENSOR)
+    hub = sensors.SensorHub(front, left, back)
+    follower = line_follower.LineFollower(mover, front, back, hub=hub)
+    return mover, follower, left, hub
+
+
+def test_hub_snapshot_is_used_within_the_cycle(clock):
+    _, _, left, hub = _make_robot()
+    left.get_color()
+    fake.script_sensor(ports.LEFT_SENSOR, [sensors.BLACK, sensors.WHITE], mode=sensors.COLOR)
+    hub.tick()
+
+    assert left.get_color() == sensors.BLACK
+
+
+def test_hub_snapshot_is_ignored_once_stale(clock):
+    _, _, left, hub = _make_robot()
+    left.get_color()
+    fake.script_sensor(ports.LEFT_SENSOR, [sensors.BLACK, sensors.WHITE], mode=sensors.COLOR)
+    hub.tick()
+    clock.advance(hub.max_age)
+
+    assert left.get_color() == sensors.WHITE
+
+
+def test_follow_until_line_after_blocking_move_reads_fresh(clock):
+    mover, follower, left, hub = _make_robot()
+
+    # On the line when the last cycle before the move ticked the hub
+    left.get_color()
+    fake.script_sensor(ports.LEFT_SENSOR, [sensors.BLACK], mode=sensors.COLOR)
+    hub.tick()
+
+    mover.rotate(90)  # Blocking, doesn't tick the hub
+
+    fake.script_sensor(ports.LEFT_SENSOR, lambda elapsed: sensors.WHITE if elapsed < 0.2 else sensors.BLACK,
+                       mode=sensors.COLOR)
+    ticks = hub.ticks
+    start = clock.time()
+    follower.follow_until_line(left, speed=40)
+
+    assert hub.ticks - ticks >= 10
+    assert clock.time() - start >= 0.2
+
+
+def _unpack(rgb):
+    return (rgb >> 20) & 0x3FF, (rgb >> 10) & 0x3FF, rgb & 0x3FF
+
+
+def test_packed_rgb_round_trips():
+    for reading in ((0, 0, 0), (330, 350, 250), (1023, 1, 512), (5, 1023, 0)):
+        assert _unpack(sensors.RGBClassifier.pack_rgb(*reading)) == reading
+    # Readings past 10 bits saturate instead of spilling into the next channel
+    assert _unpack(sensors.RGBClassifier.pack_rgb(2000, 0, 1500)) == (1023, 0, 1023)
+
+
+def test_color_table_agrees_with_the_closest_reference():
+    classifier = sensors.RGBClassifier()
+    references = sensors.RGBClassifier._DEFAULT_REFERENCES
+    # A reading is at most this far from the middle of its cell of the table
+    cell_error = (1 << sensors.RGBClassifier._LEVEL_SHIFT) * 3 ** 0.5 / 2
+    generator = random.Random(7)
+    compared = 0
+
+    for color, reading in references:
+        assert classifier.color(sensors.RGBClassifier.pack_rgb(*reading)) == color
+
+    for _ in range(2000):
+        reading = [generator.randrange(sensors.RGBClassifier._RAW_MAX + 1) for _ in range(3)]
+        distances = sorted((sum((channel - ref) ** 2 for channel, ref in zip(reading, reference)) ** 0.5, color)
+                           for color, reference in references)
+        # Closer to the boundary between two colors than the quantization the table may go either way
+        if distances[1][0] - distances[0][0] <= 2 * cell_error:
+            continue
+        assert classifier.color(sensors.RGBClassifier.pack_rgb(*reading)) == distances[0][1]
+        compared += 1
+
+    assert compared > 1000
+
+
+def test_classified_sensor_reads_color_and_reflected_from_one_rgb_reading(clock):
+    references = dict(sensors.RGBClassifier._DEFAULT_REFERENCES)
+    sensor = sensors.EV3ColorSensor(ports.LEFT_SENSOR, classifier=sensors.RGBClassifier())
+    fake.script_sensor(ports.LEFT_SENSOR, [references[sensors.BLACK], references[sensors.WHITE],
+                                           references[sensors.RED]], mode=sensors.RGB)
+
+    assert sensor.get_reflected() == sensors.RGBClassifier._DEFAULT_BLACK_REFLECTED
+    assert sensor.get_reflected() == sensors.RGBClassifier._DEFAULT_WHITE_REFLECTED
+    assert sensor.get_color() == sensors.RED
+    assert sensor.mode == sensors.RGB
@@ -0,0 +1,61 @@
+import math
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import simulator  # noqa: E402
+from fake_robot import ports  # noqa: E402
+
+import up_main  # noqa: E402
+
+_LINE_X = 500
+_LINE_WIDTH = 20
+
+
+def _node_line():
+    """One straight line going up the middle of the field, like the line from a node"""
+    field = simulator.Field.blank(1000, 1000)
+    field.draw_line((_LINE_X, 100), (_LINE_X, 900), _LINE_WIDTH)
+    return field
+
+
+def _back_sensor(result):
+    forward, left = simulator.Simulator.SENSOR_POSITIONS[ports.BACK_SENSOR]
+    cos, sin = math.cos(result.heading), math.sin(result.heading)
+    return result.x + forward * cos - left * sin, result.y + forward * sin + left * cos
+
+
+# How far behind the axle the back sensor is isn't measured, so the turn has to work wherever it sits. Closer
+# than about 60 mm its circle only meets the line once, which no turn around on the back sensor handles.
+@pytest.mark.parametrize("back_sensor", [-60, -100, -160])
+@pytest.mark.parametrize("turn_slip", [0, up_main.Main._TURN_SLIP, -up_main.Main._TURN_SLIP])
+@pytest.mark.parametrize("misalignment", [-up_main.Main._SQUARE_ERROR, 0, up_main.Main._SQUARE_ERROR])
+def test_turn_around_lands_on_the_node_line(monkeypatch, back_sensor, turn_slip, misalignment):
+    positions = dict(simulator.Simulator.SENSOR_POSITIONS)
+    positions[ports.BACK_SENSOR] = (back_sensor, 0)
+    monkeypatch.setattr(simulator.Simulator, "SENSOR_POSITIONS", positions)
+    # Facing up the line after pickup_node, the front sensor on its right edge
+    pose = (_LINE_X - _LINE_WIDTH / 2, 300, 90 + misalignment)
+
+    duration, _, stuck_in, result = simulator.simulate(_node_line(), pose, "turn_around_to_node_line", time_limit=30,
+                                                       turn_slip=turn_slip)
+
+    assert stuck_in is None
+    turned = math.degrees(result.heading) - pose[2]
+    # On the line ahead of where the turn started, not a full circle further
+    assert 90 < turned < 210
+    x, _ = _back_sensor(result)
+    # Just past the line, the way the turn goes
+    assert abs(x - _LINE_X) < _LINE_WIDTH + 2 * simulator.Simulator.SENSOR_RADIUS
+
+
+def test_test_track_follows_its_line_by_default(capsys):
+    assert simulator.main([]) == 0
+
+    assert "follow_test_track took" in capsys.readouterr().out
+
+
+def test_run_needs_the_mat():
+    with pytest.raises(SystemExit):
+        simulator.main(["--routine", "run"])
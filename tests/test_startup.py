@@ -0,0 +1,32 @@
+import time
+
+import lib.up_startup as startup
+
+
+def _slow(value, seconds):
+    def construct():
+        time.sleep(seconds)
+        return value
+    return construct
+
+
+def test_parallel_build_keeps_the_order():
+    assert startup.build((_slow("a", 0.03), _slow("b", 0.01), _slow("c", 0.02))) == ["a", "b", "c"]
+
+
+def test_failing_constructor_raises_after_the_others_finish():
+    finished = []
+
+    def slow():
+        time.sleep(0.03)
+        finished.append(True)
+
+    def failing():
+        raise OSError("sensor unplugged")
+
+    try:
+        startup.build((slow, failing))
+    except OSError:
+        assert finished == [True]
+        return
+    raise AssertionError("Built the devices although a constructor failed")
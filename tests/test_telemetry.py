@@ -0,0 +1,124 @@
+from fake_robot import fake, ports, sensors
+
+import lib.up_calibration as calibration
+import lib.up_line_follower as line_follower
+import lib.up_motors as motors
+import lib.up_telemetry as telemetry
+import replay
+
+
+def _make_recorder(capacity=10):
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    left = sensors.EV3ColorSensor(ports.LEFT_SENSOR)
+    right = sensors.HiTechnicSensor(ports.RIGHT_SENSOR)
+    back = sensors.EV3ColorSensor(ports.BACK_SENSOR)
+    front.get_reflected()
+    left.get_color()
+    hub = sensors.SensorHub(front, left, right, back)
+    mover = motors.Mover(reverse_motors=True)
+    return telemetry.TelemetryRecorder(hub, mover, capacity=capacity), hub, mover
+
+
+def test_records_round_trip(clock, tmp_path):
+    recorder, hub, mover = _make_recorder()
+    hub.tick()
+    mover.steer(20, speed=40)
+    clock.advance(0.25)
+    elapsed = clock.time() - recorder.start_time
+    recorder.record(31, -1, -0.3, telemetry.FLAG_FOLLOWING | telemetry.FLAG_ON_LEFT, 0.5, 1.5, 40)
+    clock.advance(0.01)
+    recorder.record()
+
+    path = str(tmp_path / "telemetry.bin")
+    recorder.save(path)
+    records = [dict(zip(telemetry.FIELDS, fields)) for fields in telemetry.load(path)]
+
+    assert len(records) == 2
+    record = records[0]
+    assert abs(record["time"] - elapsed) < 1e-5
+    assert (record["front"], record["left"], record["right"], record["back"]) == tuple(hub.values)
+    assert telemetry.MODES[record["front_mode"]] == sensors.REFLECTED
+    assert telemetry.MODES[record["left_mode"]] == sensors.COLOR
+    assert telemetry.MODES[record["right_mode"]] == sensors.HiTechnicSensor.MODE_COLOR
+    assert telemetry.MODES[record["back_mode"]] is None
+    assert (record["sensor_value"], record["error"]) == (31, -1)
+    assert abs(record["direction"] + 0.3) < 1e-6
+    assert (record["left_speed"], record["right_speed"]) == (mover.left_speed, mover.right_speed)
+    assert record["flags"] == telemetry.FLAG_FOLLOWING | telemetry.FLAG_ON_LEFT
+    assert (record["kp"], record["kd"], record["speed"]) == (0.5, 1.5, 40)
+    assert records[1]["flags"] == 0
+
+
+def test_calibrated_cycles_round_trip(clock, tmp_path):
+    # A calibrated sensor scales the error by a fraction, which has to survive the file
+    front_calibration = calibration.SensorCalibration(9, 47)
+    recorder, hub, mover = _make_recorder()
+    front, back = hub.sensors[0], hub.sensors[3]
+    front.set_calibration(front_calibration)
+    follower = line_follower.LineFollower(mover, front, back, hub=hub)
+    follower.recorder = recorder
+    fake.script_sensor(ports.FRONT_SENSOR, [12, 19, 25, 33, 38, 27, 24])
+
+    errors = []
+    for _ in range(7):
+        follower.follow(kp=0.4, kd=0.2, speed=30)
+        errors.append(follower.last_error)
+
+    path = str(tmp_path / "telemetry.bin")
+    recorder.save(path)
+    records = [dict(zip(telemetry.FIELDS, fields)) for fields in telemetry.load(path)]
+
+    assert [record["sensor_value"] for record in records] == [12, 19, 25, 33, 38, 27, 24]
+    assert any(error != int(error) for error in errors)
+    for record, error in zip(records, errors):
+        assert abs(record["error"] - error) < 1e-4
+
+    comparison, _ = replay.replay_follower(replay.Recording(path),
+                                           calibrations={ports.FRONT_SENSOR: front_calibration})
+    assert comparison.cycles == 7
+    assert comparison.max_error_difference < 1e-4
+    assert comparison.max_difference < 1e-3
+
+
+def test_full_buffer_drops_records(clock, tmp_path):
+    recorder, hub, _ = _make_recorder(capacity=3)
+    hub.tick()
+    for _ in range(5):
+        recorder.record()
+        clock.advance(0.01)
+
+    path = str(tmp_path / "telemetry.bin")
+    recorder.save(path)
+
+    assert recorder.dropped == 2
+    assert len(telemetry.load(path)) == 3
+
+
+def test_records_at_most_the_record_rate(clock):
+    recorder, hub, _ = _make_recorder(capacity=1000)
+    hub.tick()
+    # A wait loop checking at 200 Hz
+    for _ in range(200):
+        recorder.record()
+        clock.advance(0.005)
+
+    assert recorder.count == telemetry.RECORD_RATE
+    assert recorder.dropped == 0
+
+
+def test_buffer_is_sized_for_the_run(clock):
+    recorder = telemetry.TelemetryRecorder(None, None, seconds=120)
+
+    assert recorder.capacity == 120 * telemetry.RECORD_RATE
+    assert len(recorder.buffer) == 120 * telemetry.RECORD_RATE * telemetry.RECORD_SIZE
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "telemetry.bin"
+    path.write_bytes(b"UPCL" + bytes(20))
+
+    try:
+        telemetry.load(str(path))
+    except ValueError:
+        return
+    raise AssertionError("Loaded a file that isn't telemetry")
@@ -0,0 +1,64 @@
+import lib.up_timing as timing
+
+
+def test_first_cycle_returns_the_period(clock):
+    scheduler = timing.LoopScheduler(100)
+
+    assert scheduler.wait() == 0.01
+
+
+def test_cycles_run_at_the_frequency(clock):
+    scheduler = timing.LoopScheduler(100)
+    scheduler.wait()
+    start = clock.time()
+
+    for _ in range(10):
+        clock.advance(0.003)  # Work done in the cycle
+        assert abs(scheduler.wait() - 0.01) < 1e-9
+
+    assert abs(clock.time() - start - 0.1) < 1e-9
+    assert scheduler.cycles == 10
+    assert scheduler.overruns == 0
+
+
+def test_stalled_cycle_returns_the_real_time(clock):
+    scheduler = timing.LoopScheduler(100)
+    scheduler.wait()
+
+    clock.advance(0.035)
+    dt = scheduler.wait()
+
+    assert abs(dt - 0.035) < 1e-9
+    assert scheduler.overruns == 1
+    assert abs(scheduler.max_lateness - 0.025) < 1e-9
+    # Counts again from the late cycle instead of catching up
+    assert abs(scheduler.wait() - 0.01) < 1e-9
+
+
+def test_reset_forgets_the_previous_cycle(clock):
+    scheduler = timing.LoopScheduler(100)
+    scheduler.wait()
+    clock.advance(2)
+    scheduler.reset()
+
+    assert scheduler.wait() == 0.01
+    assert scheduler.overruns == 0
+
+
+def test_unlimited_frequency_never_sleeps(clock):
+    scheduler = timing.LoopScheduler(None)
+
+    assert scheduler.wait() == 0
+    clock.advance(0.004)
+    assert abs(scheduler.wait() - 0.004) < 1e-9
+    assert scheduler.overruns == 0
+
+
+def test_custom_sleep_is_used(clock):
+    slept = []
+    scheduler = timing.LoopScheduler(100, sleep=lambda seconds: (slept.append(seconds), clock.advance(seconds)))
+    scheduler.wait()
+    clock.advance(0.004)
+    scheduler.wait()
+
+    assert len(slept) == 1 and abs(slept[0] - 0.006) < 1e-9
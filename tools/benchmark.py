@@ -0,0 +1,183 @@
+"""
+Microbenchmarks of the robot's hot paths, run against the fake ev3dev2 backend.
+
+    python tools/benchmark.py [--number N] [--repeat R] [--history FILE] [--tolerance 0.1]
+
+Every benchmark reports the time per call (best of R runs of N calls) and the loop rate it allows.
+Results are appended to the history file and compared with the previous run so that a change which
+slows down a hot path shows up as a regression.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import fake_robot
+from fake_robot import fake, ports, sensors
+
+import lib.up_line_follower as line_follower
+import lib.up_motors as motors
+
+_DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.jsonl")
+
+_BENCHMARKS = []
+
+
+def benchmark(function):
+    """Registers a benchmark. It gets the number of calls to make and returns how many it made."""
+    _BENCHMARKS.append(function)
+    return function
+
+
+def _make_follower(hub=True):
+    mover = motors.Mover(reverse_motors=True)
+    front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    left = sensors.EV3ColorSensor(ports.LEFT_SENSOR)
+    right = sensors.HiTechnicSensor(ports.RIGHT_SENSOR)
+    back = sensors.EV3ColorSensor(ports.BACK_SENSOR)
+    sensor_hub = sensors.SensorHub(front, left, right, back) if hub else None
+    follower = line_follower.LineFollower(mover, front, back, frequency=None, hub=sensor_hub)
+    return follower, left
+
+
+@benchmark
+def ev3_get_reflected(number):
+    sensor = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+    for _ in range(number):
+        sensor.get_reflected()
+    return number
+
+
+@benchmark
+def hitechnic_get_color(number):
+    sensor = sensors.HiTechnicSensor(ports.RIGHT_SENSOR)
+    for _ in range(number):
+        sensor.get_color()
+    return number
+
+
+@benchmark
+def sensor_hub_tick(number):
+    follower, _ = _make_follower()
+    follower.front_sensor.get_reflected()  # Puts the sensor in reflected mode so the hub samples it
+    for _ in range(number):
+        follower.hub.tick()
+    return number
+
+
+@benchmark
+def mover_steer(number):
+    mover = motors.Mover(reverse_motors=True)
+    for i in range(number):
+        mover.steer(i % 20 - 10, speed=40)
+    return number
+
+
+@benchmark
+def line_follower_follow(number):
+    follower, _ = _make_follower()
+    for _ in range(number):
+        follower.follow()
+    return number
+
+
+@benchmark
+def follow_profile(number):
+    follower, _ = _make_follower()
+    profile = follower.profile()
+    for _ in range(number):
+        follower.follow_profile(profile)
+    return number
+
+
+@benchmark
+def follow_until_color(number):
+    follower, left = _make_follower()
+    fake.script_sensor(ports.LEFT_SENSOR, [sensors.WHITE] * number + [sensors.BLACK])
+    follower.follow_until_color(left, (sensors.BLACK,), stop=False)
+    return follower.scheduler.cycles + 1
+
+
+@benchmark
+def follow_until_cutoff(number):
+    follower, left = _make_follower()
+    fake.script_sensor(ports.LEFT_SENSOR, [60] * number + [10])
+    follower.follow_until_cutoff(left, 20, False, stop=False)
+    return follower.scheduler.cycles + 1
+
+
+def run(number, repeat):
+    results = {}
+    for function in _BENCHMARKS:
+        best = None
+        for _ in range(repeat):
+            fake.reset()
+            fake_robot.script_on_line()
+            start = time.perf_counter()
+            calls = function(number)
+            per_call = (time.perf_counter() - start) / calls
+            if best is None or per_call < best:
+                best = per_call
+        results[function.__name__] = best * 1e6
+    return results
+
+
+def _load_previous(history_path):
+    if not os.path.exists(history_path):
+        return None
+    previous = None
+    with open(history_path) as history:
+        for line in history:
+            if line.strip():
+                previous = json.loads(line)
+    return previous
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="calls per run")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, the best one is kept")
+    parser.add_argument("--history", default=_DEFAULT_HISTORY, help="file the results are appended to")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown compared to the previous run that counts as a regression")
+    parser.add_argument("--no-save", action="store_true", help="don't append the results to the history")
+    args = parser.parse_args(argv)
+
+    previous = _load_previous(args.history)
+    results = run(args.number, args.repeat)
+
+    regressions = []
+    print("%-24s %12s %12s %10s" % ("benchmark", "us/call", "loop Hz", "change"))
+    for name, per_call in results.items():
+        change = ""
+        if previous is not None and name in previous["results"]:
+            ratio = per_call / previous["results"][name] - 1
+            change = "%+.1f%%" % (ratio * 100)
+            if ratio > args.tolerance:
+                regressions.append(name)
+                change += " !"
+        print("%-24s %12.1f %12.0f %10s" % (name, per_call, 1e6 / per_call, change))
+
+    if not args.no_save:
+        with open(args.history, "a") as history:
+            history.write(json.dumps({"time": time.time(), "commit": _commit(), "results": results}) + "\n")
+
+    if regressions:
+        print("Regressions (more than %d%% slower): %s" % (args.tolerance * 100, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
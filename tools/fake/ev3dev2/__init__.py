@@ -0,0 +1,67 @@
+"""
+Fake ev3dev2 package to run the robot code off the brick.
+
+Put tools/fake ahead of src on sys.path. Sensor readings come from traces scripted with
+ev3dev2.fake and every motor command is recorded in ev3dev2.fake.motor_log.
+"""
+
+import ev3dev2.fake as fake
+
+
+class DeviceNotFound(Exception):
+    pass
+
+
+class AttributeFile:
+    """Stands in for an open sysfs attribute file"""
+
+    def __init__(self, device, name):
+        self._device = device
+        self._name = name
+
+    def seek(self, offset):
+        pass
+
+    def read(self):
+        fake.stats["reads"] += 1
+        return ("%s\n" % self._device._read_attribute(self._name)).encode()
+
+    def write(self, data):
+        fake.stats["writes"] += 1
+        if isinstance(data, bytes):
+            data = data.decode()
+        self._device._write_attribute(self._name, data.strip())
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Device:
+    """Base class of the fake motors and sensors"""
+
+    DEVICE_ROOT_PATH = "/sys/class"
+    SYSTEM_CLASS_NAME = None
+
+    def __init__(self, address):
+        self.address = address
+        self.kwargs = {"address": address}
+        self._path = "%s/%s/%s" % (self.DEVICE_ROOT_PATH, self.SYSTEM_CLASS_NAME, address)
+
+    def _attribute_file_open(self, name):
+        return AttributeFile(self, name)
+
+    def _read_attribute(self, name):
+        return getattr(self, name)
+
+    def _write_attribute(self, name, value):
+        current = getattr(self, name)
+        if isinstance(current, int):
+            value = int(value)
+        setattr(self, name, value)
+
+    def __str__(self):
+        return "%s(%s)" % (type(self).__name__, self.address)
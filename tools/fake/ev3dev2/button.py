@@ -0,0 +1,13 @@
+"""Fake ev3dev2.button. Buttons report the state set in ev3dev2.fake.buttons."""
+
+import ev3dev2.fake as fake
+
+
+class Button:
+    @property
+    def enter(self):
+        return fake.buttons["enter"]
+
+    @property
+    def any(self):
+        return any(fake.buttons.values())
@@ -0,0 +1,135 @@
+"""
+Controls the fake ev3dev2 backend: scripted sensor traces, recorded motor commands and the clock.
+
+Sensor traces are keyed by port and optionally by mode. A trace is either a list of readings returned one
+per read (the last reading repeats once the list runs out) or a function of the time since the trace was
+scripted. RGB traces return tuples.
+"""
+
+import time
+
+
+class Clock:
+    """Clock used by the fake devices. Goes through the time module so that a patched clock is honoured."""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def on_read(self):
+        """Called on every sensor read"""
+        pass
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only moves when something sleeps, or by read_cost seconds on every sensor read so that
+    loops which poll sensors without sleeping still make progress. Lets code run faster than real time.
+    """
+
+    def __init__(self, start=0.0, read_cost=0.0):
+        self.now = start
+        self.read_cost = read_cost
+        self._real_time = None
+        self._real_sleep = None
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def advance(self, seconds):
+        self.sleep(seconds)
+
+    def on_read(self):
+        self.now += self.read_cost
+
+    def install(self):
+        """Replaces time.time and time.sleep for everything until uninstall() is called"""
+        global clock
+        self._real_time = time.time
+        self._real_sleep = time.sleep
+        time.time = self.time
+        time.sleep = self.sleep
+        clock = self
+
+    def uninstall(self):
+        global clock
+        time.time = self._real_time
+        time.sleep = self._real_sleep
+        clock = Clock()
+
+
+class Trace:
+    """Sequence of scripted readings for one sensor port"""
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.reads = 0
+        self.start_time = clock.time()
+
+    def next(self):
+        if callable(self.readings):
+            value = self.readings(clock.time() - self.start_time)
+        elif self.reads < len(self.readings):
+            value = self.readings[self.reads]
+        else:
+            value = self.readings[-1]
+        self.reads += 1
+        return value
+
+
+clock = Clock()
+
+# (time, address, command, speed_sp, position_sp) for every command sent to a motor
+motor_log = []
+
+# Number of attribute file reads and writes, a proxy for sysfs syscalls
+stats = {"reads": 0, "writes": 0}
+
+# Pressed state of the brick buttons
+buttons = {"enter": True}
+
+_traces = {}
+_defaults = {}
+
+
+def script_sensor(port, readings, mode=None):
+    """
+    Scripts the readings of the sensor on port.
+    :param mode: only use the readings when the sensor is in this mode. None means any mode.
+    """
+    _traces[(port, mode)] = Trace(readings)
+
+
+def set_default_reading(mode, value):
+    """Reading returned by sensors in mode that have no trace"""
+    _defaults[mode] = value
+
+
+def read_sensor(port, mode):
+    clock.on_read()
+    trace = _traces.get((port, mode))
+    if trace is None:
+        trace = _traces.get((port, None))
+    if trace is None:
+        return _defaults.get(mode, 0)
+    return trace.next()
+
+
+def reset():
+    """Forgets all traces, recorded commands and statistics"""
+    global clock
+    _traces.clear()
+    _defaults.clear()
+    del motor_log[:]
+    stats["reads"] = 0
+    stats["writes"] = 0
+    buttons["enter"] = True
+    if isinstance(clock, VirtualClock):
+        clock.uninstall()
@@ -0,0 +1,365 @@
+"""Fake ev3dev2.motor. Motors move at their set speed on the fake clock and log every command."""
+
+from collections import OrderedDict
+
+import ev3dev2.fake as fake
+from ev3dev2 import Device
+
+OUTPUT_A = "ev3-ports:outA"
+OUTPUT_B = "ev3-ports:outB"
+OUTPUT_C = "ev3-ports:outC"
+OUTPUT_D = "ev3-ports:outD"
+
+
+class SpeedValue:
+    def to_native_units(self, motor):
+        raise NotImplementedError
+
+
+class SpeedPercent(SpeedValue):
+    def __init__(self, percent):
+        assert -100 <= percent <= 100, "%s is an invalid percentage, must be between -100 and 100 (inclusive)" % percent
+        self.percent = percent
+
+    def to_native_units(self, motor):
+        return self.percent / 100 * motor.max_speed
+
+
+class SpeedNativeUnits(SpeedValue):
+    def __init__(self, native_counts):
+        self.native_counts = native_counts
+
+    def to_native_units(self, motor=None):
+        return self.native_counts
+
+
+class SpeedRPM(SpeedValue):
+    def __init__(self, rotations_per_minute):
+        self.rotations_per_minute = rotations_per_minute
+
+    def to_native_units(self, motor):
+        return self.rotations_per_minute / 60 * motor.count_per_rot
+
+
+class SpeedDPS(SpeedValue):
+    def __init__(self, degrees_per_second):
+        self.degrees_per_second = degrees_per_second
+
+    def to_native_units(self, motor):
+        return self.degrees_per_second / 360 * motor.count_per_rot
+
+
+def speed_to_speedvalue(speed):
+    if isinstance(speed, SpeedValue):
+        return speed
+    return SpeedPercent(speed)
+
+
+class Motor(Device):
+    SYSTEM_CLASS_NAME = "tacho-motor"
+
+    COMMAND_RUN_FOREVER = "run-forever"
+    COMMAND_RUN_TO_ABS_POS = "run-to-abs-pos"
+    COMMAND_RUN_TO_REL_POS = "run-to-rel-pos"
+    COMMAND_RUN_TIMED = "run-timed"
+    COMMAND_STOP = "stop"
+    COMMAND_RESET = "reset"
+
+    POLARITY_NORMAL = "normal"
+    POLARITY_INVERSED = "inversed"
+
+    STATE_RUNNING = "running"
+    STATE_RAMPING = "ramping"
+    STATE_HOLDING = "holding"
+    STATE_OVERLOADED = "overloaded"
+    STATE_STALLED = "stalled"
+
+    STOP_ACTION_COAST = "coast"
+    STOP_ACTION_BRAKE = "brake"
+    STOP_ACTION_HOLD = "hold"
+
+    MAX_SPEED = 1050
+
+    def __init__(self, address=None, **kwargs):
+        super().__init__(address)
+        self.max_speed = self.MAX_SPEED
+        self.count_per_rot = 360
+        self.polarity = self.POLARITY_NORMAL
+        self.ramp_up_sp = 0
+        self.ramp_down_sp = 0
+        self._speed_sp = 0
+        self.position_sp = 0
+        self.time_sp = 0
+        self.stop_action = self.STOP_ACTION_COAST
+
+        # Motion on the fake clock: position = start + velocity * (now - since), until target
+        self._start_position = 0
+        self._velocity = 0
+        self._since = fake.clock.time()
+        self._target = None
+        self._stalled = False
+        self._running_forever = False
+
+    # Attributes that depend on the fake clock
+
+    @property
+    def position(self):
+        self._update()
+        return int(round(self._start_position))
+
+    @position.setter
+    def position(self, value):
+        self._update()
+        self._start_position = value
+        if self._target is not None:
+            self._target = None
+            self._velocity = 0
+
+    @property
+    def speed_sp(self):
+        return self._speed_sp
+
+    @speed_sp.setter
+    def speed_sp(self, value):
+        # Like the tacho-motor driver, a new speed applies right away to a motor running forever
+        self._update()
+        self._speed_sp = value
+        if self._running_forever:
+            self._velocity = value
+
+    @property
+    def speed(self):
+        self._update()
+        return int(round(self._velocity))
+
+    @property
+    def state(self):
+        self._update()
+        state = []
+        if self._velocity != 0 or self._stalled:
+            state.append(self.STATE_RUNNING)
+        if self._stalled:
+            state.append(self.STATE_STALLED)
+        elif self._velocity == 0 and self.stop_action == self.STOP_ACTION_HOLD:
+            state.append(self.STATE_HOLDING)
+        return state
+
+    @property
+    def is_running(self):
+        return self.STATE_RUNNING in self.state
+
+    @property
+    def is_stalled(self):
+        return self.STATE_STALLED in self.state
+
+    @property
+    def command(self):
+        raise AttributeError("command is write only")
+
+    @command.setter
+    def command(self, command):
+        self._update()
+        fake.motor_log.append((fake.clock.time(), self.address, command, self.speed_sp, self.position_sp))
+        self._stalled = False
+        self._running_forever = command == self.COMMAND_RUN_FOREVER
+
+        if command == self.COMMAND_RUN_FOREVER:
+            self._target = None
+            self._velocity = self.speed_sp
+        elif command == self.COMMAND_RUN_TO_REL_POS:
+            self._move_to(self._start_position + self.position_sp)
+        elif command == self.COMMAND_RUN_TO_ABS_POS:
+            self._move_to(self.position_sp)
+        elif command in (self.COMMAND_STOP, self.COMMAND_RESET):
+            self._target = None
+            self._velocity = 0
+            if command == self.COMMAND_RESET:
+                self._start_position = 0
+        else:
+            raise ValueError("Unsupported command %s" % command)
+
+    def _read_attribute(self, name):
+        if name == "state":
+            return " ".join(self.state)
+        return super()._read_attribute(name)
+
+    def _write_attribute(self, name, value):
+        if name == "command":
+            self.command = value
+        else:
+            super()._write_attribute(name, value)
+
+    def _move_to(self, target):
+        self._target = target
+        speed = abs(self.speed_sp)
+        self._velocity = speed if target >= self._start_position else -speed
+
+    def _update(self):
+        now = fake.clock.time()
+        if self._velocity != 0:
+            position = self._start_position + self._velocity * (now - self._since)
+            if self._target is not None and (position - self._target) * self._velocity >= 0:
+                position = self._target
+                self._target = None
+                self._velocity = 0
+            self._start_position = position
+        self._since = now
+
+    def _time_to_target(self):
+        self._update()
+        if self._target is None or self._velocity == 0:
+            return 0
+        return abs(self._target - self._start_position) / abs(self._velocity)
+
+    # Commands
+
+    def run_forever(self, **kwargs):
+        self.command = self.COMMAND_RUN_FOREVER
+
+    def run_to_abs_pos(self, **kwargs):
+        self.command = self.COMMAND_RUN_TO_ABS_POS
+
+    def run_to_rel_pos(self, **kwargs):
+        self.command = self.COMMAND_RUN_TO_REL_POS
+
+    def stop(self, **kwargs):
+        self.command = self.COMMAND_STOP
+
+    def reset(self):
+        self.command = self.COMMAND_RESET
+
+    def _speed_native_units(self, speed, label=None):
+        return speed_to_speedvalue(speed).to_native_units(self)
+
+    def _set_rel_position_degrees_and_speed_sp(self, degrees, speed):
+        degrees = degrees if speed >= 0 else -degrees
+        self.position_sp = int(round(degrees * self.count_per_rot / 360))
+        self.speed_sp = int(round(abs(speed)))
+
+    def _set_brake(self, brake):
+        self.stop_action = self.STOP_ACTION_HOLD if brake else self.STOP_ACTION_COAST
+
+    def on(self, speed, brake=True, block=False):
+        self.speed_sp = int(round(self._speed_native_units(speed)))
+        self._set_brake(brake)
+        self.run_forever()
+        if block:
+            self.wait_until_not_moving()
+
+    def off(self, brake=True):
+        self._set_brake(brake)
+        self.stop()
+
+    def on_for_degrees(self, speed, degrees, brake=True, block=True):
+        self._set_rel_position_degrees_and_speed_sp(degrees, self._speed_native_units(speed))
+        self._set_brake(brake)
+        self.run_to_rel_pos()
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_rotations(self, speed, rotations, brake=True, block=True):
+        self.on_for_degrees(speed, rotations * 360, brake=brake, block=block)
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self.speed_sp = int(round(abs(self._speed_native_units(speed))))
+        self.position_sp = position
+        self._set_brake(brake)
+        self.run_to_abs_pos()
+        if block:
+            self.wait_until_not_moving()
+
+    # Waits
+
+    def wait_until_not_moving(self, timeout=None):
+        """
+        Sleeps on the fake clock until the motor reaches its target.
+        A motor running forever is assumed to be pushing against an end stop, so it stalls right away.
+        """
+        if self._target is None:
+            if self._velocity != 0:
+                self._stalled = True
+                self._velocity = 0
+            return True
+
+        remaining = self._time_to_target()
+        if timeout is not None and remaining > timeout / 1000:
+            fake.clock.sleep(timeout / 1000)
+            return False
+
+        fake.clock.sleep(remaining)
+        self._update()
+        return True
+
+    def wait_while(self, s, timeout=None):
+        if s == self.STATE_RUNNING:
+            return self.wait_until_not_moving(timeout)
+        return True
+
+    def wait_until(self, s, timeout=None):
+        return True
+
+
+class LargeMotor(Motor):
+    MAX_SPEED = 1050
+
+
+class MediumMotor(Motor):
+    MAX_SPEED = 1560
+
+
+class MotorSet:
+    def __init__(self, motor_specs):
+        self.motors = OrderedDict()
+        for address in sorted(motor_specs.keys()):
+            self.motors[address] = motor_specs[address](address)
+
+    def off(self, motors=None, brake=True):
+        for motor in (motors or self.motors.values()):
+            motor.off(brake=brake)
+
+    def wait_until_not_moving(self, motors=None, timeout=None):
+        for motor in (motors or self.motors.values()):
+            motor.wait_until_not_moving(timeout)
+
+
+class MoveTank(MotorSet):
+    def __init__(self, left_motor_port, right_motor_port, desc=None, motor_class=LargeMotor):
+        super().__init__({left_motor_port: motor_class, right_motor_port: motor_class})
+        self.left_motor = self.motors[left_motor_port]
+        self.right_motor = self.motors[right_motor_port]
+
+    def on(self, left_speed, right_speed):
+        left_speed = self.left_motor._speed_native_units(left_speed)
+        right_speed = self.right_motor._speed_native_units(right_speed)
+        self.left_motor.speed_sp = int(round(left_speed))
+        self.right_motor.speed_sp = int(round(right_speed))
+        self.left_motor.run_forever()
+        self.right_motor.run_forever()
+
+    def on_for_degrees(self, left_speed, right_speed, degrees, brake=True, block=True):
+        left_speed_native = self.left_motor._speed_native_units(left_speed)
+        right_speed_native = self.right_motor._speed_native_units(right_speed)
+
+        # The faster motor travels the given degrees, the slower one proportionally less
+        if abs(left_speed_native) > abs(right_speed_native):
+            left_degrees = degrees
+            right_degrees = abs(right_speed_native / left_speed_native) * degrees
+        elif right_speed_native != 0:
+            left_degrees = abs(left_speed_native / right_speed_native) * degrees
+            right_degrees = degrees
+        else:
+            left_degrees = 0
+            right_degrees = 0
+
+        self.left_motor._set_rel_position_degrees_and_speed_sp(left_degrees, left_speed_native)
+        self.right_motor._set_rel_position_degrees_and_speed_sp(right_degrees, right_speed_native)
+        self.left_motor._set_brake(brake)
+        self.right_motor._set_brake(brake)
+        self.left_motor.run_to_rel_pos()
+        self.right_motor.run_to_rel_pos()
+
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_rotations(self, left_speed, right_speed, rotations, brake=True, block=True):
+        self.on_for_degrees(left_speed, right_speed, rotations * 360, brake=brake, block=block)
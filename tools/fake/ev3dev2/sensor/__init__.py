@@ -0,0 +1,98 @@
+"""Fake ev3dev2.sensor. Readings come from the traces scripted with ev3dev2.fake."""
+
+import struct
+
+import ev3dev2.fake as fake
+from ev3dev2 import Device
+
+INPUT_1 = "ev3-ports:in1"
+INPUT_2 = "ev3-ports:in2"
+INPUT_3 = "ev3-ports:in3"
+INPUT_4 = "ev3-ports:in4"
+
+
+class Sensor(Device):
+    SYSTEM_CLASS_NAME = "lego-sensor"
+
+    # Number of values each mode returns, modes not listed return one
+    MODE_VALUES = {}
+
+    # Struct format of one value in bin_data
+    BIN_DATA_FORMAT = "b"
+
+    def __init__(self, address=None, **kwargs):
+        super().__init__(address)
+        self._mode = None
+        self.mode_switches = 0
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        if mode != self._mode:
+            self.mode_switches += 1
+        self._mode = mode
+
+    @property
+    def num_values(self):
+        return self.MODE_VALUES.get(self._mode, 1)
+
+    def _ensure_mode(self, mode):
+        if self.mode != mode:
+            self.mode = mode
+
+    def _reading(self):
+        reading = fake.read_sensor(self.address, self._mode)
+        if isinstance(reading, (tuple, list)):
+            return tuple(reading)
+        return (reading,)
+
+    def value(self, n=0):
+        return self._reading()[n]
+
+    def bin_data(self, fmt=None):
+        reading = self._reading()
+        if fmt is None:
+            fmt = "<" + self.BIN_DATA_FORMAT * len(reading)
+        return struct.unpack(fmt, struct.pack("<" + self.BIN_DATA_FORMAT * len(reading), *reading))
+
+    def _read_attribute(self, name):
+        if name.startswith("value"):
+            return self.value(int(name[len("value"):]))
+        return super()._read_attribute(name)
+
+    def _write_attribute(self, name, value):
+        if name == "mode":
+            self.mode = value
+        else:
+            super()._write_attribute(name, value)
+
+    def _attribute_file_open(self, name):
+        if name == "bin_data":
+            return BinDataFile(self)
+        return super()._attribute_file_open(name)
+
+
+class BinDataFile:
+    """Stands in for the sensor's bin_data file"""
+
+    def __init__(self, sensor):
+        self._sensor = sensor
+
+    def seek(self, offset):
+        pass
+
+    def read(self, size=-1):
+        fake.stats["reads"] += 1
+        reading = self._sensor._reading()
+        return struct.pack("<" + self._sensor.BIN_DATA_FORMAT * len(reading), *reading)
+
+    def readinto(self, buffer):
+        data = self.read()
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        pass
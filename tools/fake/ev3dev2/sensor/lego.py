@@ -0,0 +1,51 @@
+"""Fake ev3dev2.sensor.lego"""
+
+from ev3dev2.sensor import Sensor
+
+
+class ColorSensor(Sensor):
+    MODE_COL_REFLECT = "COL-REFLECT"
+    MODE_COL_AMBIENT = "COL-AMBIENT"
+    MODE_COL_COLOR = "COL-COLOR"
+    MODE_REF_RAW = "REF-RAW"
+    MODE_RGB_RAW = "RGB-RAW"
+
+    COLOR_NOCOLOR = 0
+    COLOR_BLACK = 1
+    COLOR_BLUE = 2
+    COLOR_GREEN = 3
+    COLOR_YELLOW = 4
+    COLOR_RED = 5
+    COLOR_WHITE = 6
+    COLOR_BROWN = 7
+
+    MODE_VALUES = {MODE_REF_RAW: 2, MODE_RGB_RAW: 3}
+    BIN_DATA_FORMAT = "h"
+
+    def __init__(self, address=None, **kwargs):
+        super().__init__(address, **kwargs)
+        self.mode = self.MODE_COL_REFLECT
+
+    @property
+    def reflected_light_intensity(self):
+        self._ensure_mode(self.MODE_COL_REFLECT)
+        return self.value(0)
+
+    @property
+    def ambient_light_intensity(self):
+        self._ensure_mode(self.MODE_COL_AMBIENT)
+        return self.value(0)
+
+    @property
+    def color(self):
+        self._ensure_mode(self.MODE_COL_COLOR)
+        return self.value(0)
+
+    @property
+    def raw(self):
+        self._ensure_mode(self.MODE_RGB_RAW)
+        return self.value(0), self.value(1), self.value(2)
+
+    @property
+    def rgb(self):
+        return self.raw
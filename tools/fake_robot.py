@@ -0,0 +1,30 @@
+"""Helpers to run the robot code off the brick against the fake ev3dev2 package in tools/fake."""
+
+import os
+import sys
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+_SRC_DIR = os.path.join(os.path.dirname(_TOOLS_DIR), "src")
+
+
+def use_fake_ev3dev2():
+    """Makes `import ev3dev2` load the fake package and `import lib.up_*` load the robot code"""
+    for path in (_SRC_DIR, os.path.join(_TOOLS_DIR, "fake")):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+
+
+use_fake_ev3dev2()
+
+import ev3dev2.fake as fake  # noqa: E402
+import ev3dev2.sensor.lego as lego_sensor  # noqa: E402
+import lib.up_ports as ports  # noqa: E402
+import lib.up_sensors as sensors  # noqa: E402
+
+
+def script_on_line(reflected=30, color=sensors.WHITE, hitechnic_code=17):
+    """Scripts every sensor to read as if the robot sits on the edge of a line on a white mat"""
+    fake.set_default_reading(sensors.REFLECTED, reflected)
+    fake.set_default_reading(lego_sensor.ColorSensor.MODE_COL_COLOR, color)
+    fake.set_default_reading(sensors.HiTechnicSensor.MODE_COLOR, hitechnic_code)
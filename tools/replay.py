@@ -0,0 +1,229 @@
+"""
+Replays telemetry recorded on the robot (see RECORD_TELEMETRY in up_main.py) through the robot code,
+faster than real time, and compares the motor outputs with the recorded ones.
+
+    python tools/replay.py telemetry.bin [more.bin ...] [--kp KP] [--kd KD] [--speed SPEED]
+    python tools/replay.py telemetry.bin --routine go_to_first_fibre
+
+The default mode feeds the reading of every recorded line follower cycle to LineFollower.follow() with
+the recorded gains, or the ones given on the command line. --routine runs a Main method with every
+sensor playing back its recorded readings against the fake clock.
+
+Replays are open loop: the readings don't react to the new motor outputs, so they show how a change
+alters the controller's response to real runs, not the path the robot would take.
+"""
+
+import argparse
+import bisect
+import collections
+import math
+import sys
+
+import fake_robot
+from fake_robot import fake, ports, sensors
+
+import lib.up_calibration as calibration
+import lib.up_conditions as conditions
+import lib.up_line_follower as line_follower
+import lib.up_log as log
+import lib.up_motors as motors
+import lib.up_telemetry as telemetry
+
+Record = collections.namedtuple("Record", telemetry.FIELDS)
+
+_SENSOR_FIELDS = (("front", ports.FRONT_SENSOR), ("left", ports.LEFT_SENSOR), ("right", ports.RIGHT_SENSOR),
+                  ("back", ports.BACK_SENSOR))
+
+
+class ReplayFinished(Exception):
+    """Raised when the code reads past the end of the recording"""
+
+
+class Recording:
+    """Telemetry of one run, indexed to look up what each sensor read at any time"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = [Record(*fields) for fields in telemetry.load(path)]
+        self.duration = self.records[-1].time if self.records else 0
+
+    def following_cycles(self):
+        return [record for record in self.records if record.flags & telemetry.FLAG_FOLLOWING]
+
+    def trace(self, sensor_field, mode, margin):
+        """
+        Returns a function of time giving the last value sensor_field read in mode at that time.
+        Raises ReplayFinished once the time is margin seconds past the end of the recording.
+        """
+        mode_field = sensor_field + "_mode"
+        times = []
+        values = []
+        for record in self.records:
+            code = getattr(record, mode_field)
+            if code < len(telemetry.MODES) and telemetry.MODES[code] == mode:
+                times.append(record.time)
+                values.append(getattr(record, sensor_field))
+
+        if mode == sensors.RGB:
+            values = [((value >> 20) & 0x3FF, (value >> 10) & 0x3FF, value & 0x3FF) for value in values]
+
+        end = self.duration + margin
+
+        def reading(now):
+            if now > end:
+                raise ReplayFinished()
+            if not values:
+                return 0
+            return values[max(0, bisect.bisect_right(times, now) - 1)]
+
+        return reading
+
+
+class Comparison:
+    """Differences between the replayed and the recorded motor speeds"""
+
+    def __init__(self):
+        self.cycles = 0
+        self.squared_difference = 0
+        self.max_difference = 0
+        self.max_error_difference = 0
+        self.saturated = 0
+
+    def add(self, replayed, recorded, replayed_error, recorded_error):
+        # The error only depends on the reading and the calibration, so it differs when the replay runs with
+        # another calibration than the robot did
+        self.max_error_difference = max(self.max_error_difference, abs(replayed_error - recorded_error))
+        for replayed_speed, recorded_speed in zip(replayed, recorded):
+            difference = abs(replayed_speed - recorded_speed)
+            self.squared_difference += difference ** 2
+            self.max_difference = max(self.max_difference, difference)
+        self.cycles += 1
+
+    @property
+    def rms_difference(self):
+        if self.cycles == 0:
+            return 0
+        return math.sqrt(self.squared_difference / (2 * self.cycles))
+
+    def __str__(self):
+        return "%s cycles, motor speed difference rms %.2f max %.2f, error difference max %.2f, %s saturated" % (
+            self.cycles, self.rms_difference, self.max_difference, self.max_error_difference, self.saturated)
+
+
+def _start(read_cost=0.0):
+    fake.reset()
+    fake_robot.script_on_line()
+    clock = fake.VirtualClock(read_cost=read_cost)
+    clock.install()
+    return clock
+
+
+def replay_follower(recording, kp=None, kd=None, speed=None, calibrations=None):
+    """
+    Runs every recorded line follower cycle through LineFollower.follow().
+    :param calibrations: sensor calibrations the robot ran with, see calibration.load()
+    :return: (Comparison, [(time, left speed, right speed)] replayed)
+    """
+    clock = _start()
+    try:
+        mover = motors.Mover(reverse_motors=True)
+        front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+        back = sensors.EV3ColorSensor(ports.BACK_SENSOR)
+        if calibrations is not None:
+            front.set_calibration(calibrations.get(ports.FRONT_SENSOR))
+            back.set_calibration(calibrations.get(ports.BACK_SENSOR))
+        follower = line_follower.LineFollower(mover, front, back, frequency=None)
+
+        comparison = Comparison()
+        outputs = []
+        previous = None
+        for record in recording.following_cycles():
+            # A gap means the follower stopped in between
+            if previous is None or record.time - previous.time > 3 / line_follower.LineFollower._DEFAULT_FREQUENCY:
+                follower.reset()
+
+            clock.now = record.time
+            fake.script_sensor(ports.BACK_SENSOR if record.flags & telemetry.FLAG_BACKWARDS else ports.FRONT_SENSOR,
+                               [record.sensor_value])
+            follower.follow(on_left=bool(record.flags & telemetry.FLAG_ON_LEFT),
+                            kp=record.kp if kp is None else kp,
+                            kd=record.kd if kd is None else kd,
+                            speed=record.speed if speed is None else speed,
+                            backwards=bool(record.flags & telemetry.FLAG_BACKWARDS))
+
+            if abs(follower.direction) >= 100:
+                comparison.saturated += 1
+            comparison.add((mover.left_speed, mover.right_speed), (record.left_speed, record.right_speed),
+                           follower.last_error, record.error)
+            outputs.append((record.time, mover.left_speed, mover.right_speed))
+            previous = record
+
+        return comparison, outputs
+    finally:
+        clock.uninstall()
+
+
+def replay_routine(recording, routine, read_cost=0.002, margin=1.0):
+    """
+    Runs a Main method with the sensors playing back the recording.
+    :param read_cost: virtual seconds each sensor read takes, so polling loops move the clock forward
+    :return: (virtual seconds the routine took or None if it ran past the recording or a wait timed out,
+    motor commands sent)
+    """
+    clock = _start(read_cost=read_cost)
+    log.reset()
+    try:
+        for sensor_field, port in _SENSOR_FIELDS:
+            for mode in telemetry.MODES[1:]:
+                fake.script_sensor(port, recording.trace(sensor_field, mode, margin), mode=mode)
+
+        import up_main
+        # The virtual clock only works with one thread
+        up_main.SAMPLE_HITECHNIC_IN_BACKGROUND = False
+        up_main.PARALLEL_STARTUP = False
+        main = up_main.Main()
+        start = clock.time()
+        try:
+            getattr(main, routine)()
+            duration = clock.time() - start
+        except ReplayFinished:
+            duration = None
+        except conditions.TimedOut as error:
+            log.error("%s", error)
+            duration = None
+        return duration, list(fake.motor_log)
+    finally:
+        log.flush()
+        clock.uninstall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="telemetry files saved by the robot")
+    parser.add_argument("--kp", type=float, help="replace the recorded kp")
+    parser.add_argument("--kd", type=float, help="replace the recorded kd")
+    parser.add_argument("--speed", type=float, help="replace the recorded speed")
+    parser.add_argument("--routine", help="Main method to replay instead of the line follower cycles")
+    parser.add_argument("--calibration", help="sensor calibration the robot ran with (calibration.bin)")
+    args = parser.parse_args(argv)
+    calibrations = None if args.calibration is None else calibration.load(args.calibration)
+
+    for path in args.recordings:
+        recording = Recording(path)
+        if args.routine is None:
+            comparison, _ = replay_follower(recording, kp=args.kp, kd=args.kd, speed=args.speed,
+                                            calibrations=calibrations)
+            print("%s: %s" % (path, comparison))
+        else:
+            duration, commands = replay_routine(recording, args.routine)
+            if duration is None:
+                print("%s: %s ran past the recording or timed out (%s motor commands)" % (
+                    path, args.routine, len(commands)))
+            else:
+                print("%s: %s took %.2f s (recording %.2f s, %s motor commands)" % (
+                    path, args.routine, duration, recording.duration, len(commands)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""
+Runs Main (or one of its methods) on a simulated field, many times faster than real time.
+
+    python tools/simulator.py --field mat.png --mm-per-pixel 1 --start 150,300,90 [--routine run]
+    python tools/simulator.py [--routine follow_test_track]
+
+The field is an RGB image of the mat (a photo or the printable file, loaded with Pillow) or a .npy array.
+Without --field a small test track is drawn: one straight line with six intersections and four blocks. The
+mission's routines need the mat, so on the test track the default routine is follow_test_track, from
+TEST_TRACK_START: the run the line follower's speed schedule and intersection counter were measured on.
+The robot is a differential drive using Mover's wheel and chassis sizes, moved by the encoder positions
+of the fake motors. The reflected, color and RGB readings of the four sensors are synthesized from the
+pixels under each sensor.
+
+The run stops at --time-limit virtual seconds or when a wait of the robot code times out, in which case the
+Main method it was in is reported.
+Needs NumPy.
+"""
+
+import argparse
+import math
+import sys
+import time
+import traceback
+
+import numpy
+
+import fake_robot
+from fake_robot import fake, ports, sensors
+
+import lib.up_conditions as conditions
+import lib.up_log as log
+import lib.up_motors as motors
+
+# Colors of the mat (RGB 0-255) and what the EV3 color mode calls them
+PALETTE = (
+    (sensors.BLACK, (0, 0, 0)),
+    (sensors.WHITE, (255, 255, 255)),
+    (sensors.BLUE, (0, 90, 200)),
+    (sensors.GREEN, (0, 160, 80)),
+    (sensors.YELLOW, (255, 220, 0)),
+    (sensors.RED, (220, 30, 40)),
+    (sensors.BROWN, (140, 90, 40)),
+)
+
+# HiTechnic color number for each color, mixed colors read as a pale shade
+_HITECHNIC_CODES = {sensors.BLACK: 0, sensors.BLUE: 2, sensors.GREEN: 4, sensors.YELLOW: 6, sensors.RED: 9,
+                    sensors.WHITE: 17, sensors.BROWN: 13, sensors.NO_COLOR: 13}
+
+
+class SimulationTimeout(Exception):
+    """Raised when the run goes past the time limit"""
+
+
+class Field:
+    """The mat as an RGB image, x to the right and y up in mm from the bottom left corner"""
+
+    def __init__(self, image, mm_per_pixel=1.0):
+        self.image = image
+        self.mm_per_pixel = mm_per_pixel
+        self.height, self.width = image.shape[:2]
+
+    @staticmethod
+    def blank(width_mm, height_mm, mm_per_pixel=1.0):
+        shape = (int(height_mm / mm_per_pixel), int(width_mm / mm_per_pixel), 3)
+        return Field(numpy.full(shape, 255, dtype=numpy.uint8), mm_per_pixel)
+
+    @staticmethod
+    def load(path, mm_per_pixel=1.0):
+        if path.endswith(".npy"):
+            return Field(numpy.load(path), mm_per_pixel)
+
+        try:
+            from PIL import Image
+        except ImportError:
+            raise SystemExit("Loading %s needs Pillow (pip install pillow), or pass the mat as a .npy array" % path)
+        return Field(numpy.asarray(Image.open(path).convert("RGB")), mm_per_pixel)
+
+    def to_pixel(self, x, y):
+        return self.height - 1 - int(y / self.mm_per_pixel), int(x / self.mm_per_pixel)
+
+    def fill_rect(self, x0, y0, x1, y1, color):
+        top, left = self.to_pixel(x0, max(y0, y1))
+        bottom, right = self.to_pixel(x1, min(y0, y1))
+        self.image[max(top, 0):bottom + 1, max(left, 0):right + 1] = color
+
+    def draw_line(self, start, end, width, color=(0, 0, 0)):
+        """Draws a straight line of width mm between two points in mm"""
+        (x0, y0), (x1, y1) = start, end
+        margin = width / 2
+        top, left = self.to_pixel(min(x0, x1) - margin, max(y0, y1) + margin)
+        bottom, right = self.to_pixel(max(x0, x1) + margin, min(y0, y1) - margin)
+        top, left = max(top, 0), max(left, 0)
+        bottom, right = min(bottom, self.height - 1), min(right, self.width - 1)
+
+        rows, columns = numpy.mgrid[top:bottom + 1, left:right + 1]
+        xs = (columns + 0.5) * self.mm_per_pixel
+        ys = (self.height - rows - 0.5) * self.mm_per_pixel
+
+        dx, dy = x1 - x0, y1 - y0
+        length_squared = dx * dx + dy * dy or 1
+        along = numpy.clip(((xs - x0) * dx + (ys - y0) * dy) / length_squared, 0, 1)
+        distance = numpy.hypot(xs - (x0 + along * dx), ys - (y0 + along * dy))
+        self.image[top:bottom + 1, left:right + 1][distance <= margin] = color
+
+    def average_color(self, x, y, radius):
+        """Mean RGB (0-255) of the disc of radius mm around x, y. White off the mat."""
+        row, column = self.to_pixel(x, y)
+        span = max(1, int(radius / self.mm_per_pixel))
+        top, bottom = max(row - span, 0), min(row + span + 1, self.height)
+        left, right = max(column - span, 0), min(column + span + 1, self.width)
+        if top >= bottom or left >= right:
+            return numpy.array((255.0, 255.0, 255.0))
+        return self.image[top:bottom, left:right].reshape(-1, 3).mean(axis=0)
+
+
+# Robot on the test track's line facing along it, its left sensor on the line's upper edge
+TEST_TRACK_START = (150, 410, 0)
+
+
+def follow_test_track(main):
+    """Follows the test track's line from TEST_TRACK_START past its six intersections, as go_to_first_fibre does"""
+    main.line_follower.follow_until_intersection_x(6, main.left_sensor, on_left=True, use_reflection=True, speed=60,
+                                                   max_speed=80)
+
+
+# Routines to run besides the Main methods, called with Main
+ROUTINES = {"follow_test_track": follow_test_track}
+
+
+def test_track():
+    """Straight line with six intersections and a block of each color beside it"""
+    field = Field.blank(2000, 800)
+    field.draw_line((100, 400), (1900, 400), 20)
+    for index in range(6):
+        x = 700 + index * 200
+        field.draw_line((x, 300), (x, 500), 20)
+    for index, color in enumerate(((220, 30, 40), (0, 90, 200), (255, 220, 0), (0, 160, 80))):
+        x = 250 + index * 100
+        field.fill_rect(x, 310, x + 40, 350, color)
+    return field
+
+
+class Simulator:
+    """Moves the robot on the field from its motors' encoders and answers its sensor reads"""
+
+    # Where the sensors look, in mm from the center of the wheel axle (forward, left)
+    SENSOR_POSITIONS = {
+        ports.FRONT_SENSOR: (90, 0),
+        ports.LEFT_SENSOR: (40, 60),
+        ports.RIGHT_SENSOR: (40, -60),
+        ports.BACK_SENSOR: (-100, 0),
+    }
+    SENSOR_RADIUS = 5  # Radius of the spot a sensor sees (mm)
+
+    # Reflected light intensity (%) on black and white, raw RGB reading on white
+    BLACK_REFLECTED = 5
+    WHITE_REFLECTED = 65
+    WHITE_RAW = 330
+
+    def __init__(self, field, pose, read_cost=0.001, time_limit=600, turn_slip=0):
+        """
+        :param pose: (x mm, y mm, heading degrees counter-clockwise from the x axis) of the wheel axle
+        :param read_cost: virtual seconds each sensor read takes
+        :param turn_slip: share of the robot's real turns the encoders miss, as when the wheels slip
+        """
+        self.field = field
+        self.turn_slip = turn_slip
+        self.x, self.y = pose[0], pose[1]
+        self.heading = math.radians(pose[2])
+        self.time_limit = time_limit
+        self.clock = fake.VirtualClock(read_cost=read_cost)
+        self.path = []
+        self.main = None
+        self._left_motor = None
+        self._right_motor = None
+        self._left_position = 0
+        self._right_position = 0
+
+    def start(self):
+        """Installs the virtual clock and scripts the sensors. Call before building Main."""
+        fake.reset()
+        self.clock.install()
+        for port in self.SENSOR_POSITIONS:
+            for mode in (sensors.REFLECTED, sensors.COLOR, sensors.RGB, sensors.HiTechnicSensor.MODE_COLOR):
+                fake.script_sensor(port, self._reader(port, mode), mode=mode)
+
+    def stop(self):
+        self.clock.uninstall()
+
+    def attach(self, mover):
+        self._left_motor = mover._mover.left_motor
+        self._right_motor = mover._mover.right_motor
+        self._left_position = self._left_motor.position
+        self._right_position = self._right_motor.position
+
+    def _reader(self, port, mode):
+        return lambda _: self.read(port, mode)
+
+    def read(self, port, mode):
+        if self.clock.time() > self.time_limit:
+            raise SimulationTimeout()
+        self.update_pose()
+
+        forward, left = self.SENSOR_POSITIONS[port]
+        cos, sin = math.cos(self.heading), math.sin(self.heading)
+        rgb = self.field.average_color(self.x + forward * cos - left * sin, self.y + forward * sin + left * cos,
+                                       self.SENSOR_RADIUS)
+
+        if mode == sensors.REFLECTED:
+            return int(round(self.BLACK_REFLECTED + (self.WHITE_REFLECTED - self.BLACK_REFLECTED) * rgb[0] / 255))
+        if mode == sensors.RGB:
+            return tuple(int(channel * self.WHITE_RAW / 255) for channel in rgb)
+
+        color = self.classify(rgb)
+        if mode == sensors.HiTechnicSensor.MODE_COLOR:
+            return _HITECHNIC_CODES[color]
+        return color
+
+    @staticmethod
+    def classify(rgb):
+        best_color, best_distance = sensors.NO_COLOR, 80 ** 2
+        for color, reference in PALETTE:
+            distance = sum((channel - ref) ** 2 for channel, ref in zip(rgb, reference))
+            if distance < best_distance:
+                best_color, best_distance = color, distance
+        return best_color
+
+    def update_pose(self):
+        """Moves the robot by what the wheels turned since the last update"""
+        if self._left_motor is None:
+            return
+
+        left_position = self._left_motor.position
+        right_position = self._right_motor.position
+        wheel_mm_per_degree = math.pi / 180 * motors.Mover._WHEEL_RADIUS
+        left = (left_position - self._left_position) * wheel_mm_per_degree
+        right = (right_position - self._right_position) * wheel_mm_per_degree
+        self._left_position, self._right_position = left_position, right_position
+        if left == 0 and right == 0:
+            return
+
+        distance = (left + right) / 2
+        turn = (right - left) / (2 * motors.Mover.CHASSIS_RADIUS) / (1 - self.turn_slip)
+        self.x += distance * math.cos(self.heading + turn / 2)
+        self.y += distance * math.sin(self.heading + turn / 2)
+        self.heading += turn
+        self.path.append((self.clock.time(), self.x, self.y, self.heading))
+
+
+def simulate(field, pose, routine="run", read_cost=0.001, time_limit=600, profile=False, turn_slip=0):
+    """
+    Builds Main on the simulated field and runs one of its methods or ROUTINES.
+    :param profile: time the phases of the run with PROFILE_PHASES, see main.profiler
+    :return: (virtual seconds the routine took, wall seconds, Main method it was stuck in or None, simulator)
+    The routine is stuck when it runs past time_limit or one of its waits raises conditions.TimedOut.
+    """
+    simulator = Simulator(field, pose, read_cost=read_cost, time_limit=time_limit, turn_slip=turn_slip)
+    simulator.start()
+    log.reset()
+    try:
+        import up_main
+        up_main.PROFILE_PHASES = profile
+        # The virtual clock only works with one thread
+        up_main.SAMPLE_HITECHNIC_IN_BACKGROUND = False
+        up_main.PARALLEL_STARTUP = False
+        main = up_main.Main()
+        simulator.attach(main.mover)
+        simulator.main = main
+
+        stuck_in = None
+        start, wall_start = simulator.clock.time(), time.perf_counter()
+        try:
+            if routine in ROUTINES:
+                ROUTINES[routine](main)
+            else:
+                getattr(main, routine)()
+        except (SimulationTimeout, conditions.TimedOut) as error:
+            if isinstance(error, conditions.TimedOut):
+                log.error("%s", error)
+            frames = [frame for frame in traceback.extract_tb(sys.exc_info()[2]) if frame.filename.endswith("up_main.py")]
+            stuck_in = frames[-1].name if frames else routine
+        return simulator.clock.time() - start, time.perf_counter() - wall_start, stuck_in, simulator
+    finally:
+        log.flush()
+        simulator.stop()
+
+
+def _parse_pose(text):
+    x, y, heading = (float(part) for part in text.split(","))
+    return x, y, heading
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--field", help="image or .npy array of the mat, the test track if not given")
+    parser.add_argument("--mm-per-pixel", type=float, default=1.0)
+    parser.add_argument("--start", type=_parse_pose,
+                        help="x,y,heading of the robot at the start (mm, mm, degrees), TEST_TRACK_START on the test "
+                             "track")
+    parser.add_argument("--routine", help="Main method or follow_test_track to run, run on the mat and "
+                                          "follow_test_track on the test track")
+    parser.add_argument("--read-cost", type=float, default=0.001, help="virtual seconds per sensor read")
+    parser.add_argument("--time-limit", type=float, default=600, help="virtual seconds before giving up")
+    parser.add_argument("--profile", action="store_true", help="print the time taken by each phase")
+    parser.add_argument("--turn-slip", type=float, default=0,
+                        help="share of the real turns the encoders miss, e.g. 0.1 for wheels slipping 10%%")
+    args = parser.parse_args(argv)
+
+    if args.field is None:
+        if args.routine == "run":
+            parser.error("the test track only has a line, give the mat with --field to run the mission")
+        field = test_track()
+        routine = args.routine or "follow_test_track"
+        start = args.start or TEST_TRACK_START
+    else:
+        if args.start is None:
+            parser.error("--start is needed with --field")
+        field = Field.load(args.field, args.mm_per_pixel)
+        routine = args.routine or "run"
+        start = args.start
+    duration, wall, stuck_in, simulator = simulate(field, start, routine, args.read_cost, args.time_limit,
+                                                   args.profile, args.turn_slip)
+
+    if stuck_in is not None:
+        print("%s didn't finish, stuck in %s" % (routine, stuck_in))
+    else:
+        print("%s took %.2f s" % (routine, duration))
+    print("Simulated in %.2f s (%.0fx real time), ended at x=%.0f y=%.0f heading=%.0f" % (
+        wall, duration / wall if wall else 0, simulator.x, simulator.y, math.degrees(simulator.heading)))
+    if args.profile:
+        import up_main
+        print(simulator.main.profiler.report(up_main.TIME_LIMIT))
+    return 0 if stuck_in is None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Searches line follower gains and speeds for each follow_* call site in up_main.py.
+
+    python tools/tune.py [--site NAME ...] [--processes N] [--max-error MM] [--quick]
+
+Every candidate (kp, kd, speed) runs the real LineFollower on the fake backend against LinePlant, a
+model of the robot following the edge of a line, on a virtual clock. Candidates are spread over a
+process pool. For each call site the fastest speed whose gains keep the sensor within --max-error mm of
+the edge without losing the line is reported, together with the gains used today.
+
+Check a suggestion against real runs with tools/replay.py before putting it in up_main.py.
+"""
+
+import argparse
+import itertools
+import math
+import multiprocessing
+import random
+import sys
+
+import fake_robot
+from fake_robot import fake, ports, sensors
+
+import lib.up_line_follower as line_follower
+import lib.up_motors as motors
+
+
+class CallSite:
+    """A follow_* call in up_main.py and the stretch of line it follows"""
+
+    def __init__(self, name, on_left, backwards, distance, kp, kd, speed, offset=5, heading=5, curvature=0):
+        """
+        :param distance: length of line followed (mm)
+        :param kp, kd, speed: the values up_main.py uses today
+        :param offset: lateral offset of the sensor from the edge at the start (mm)
+        :param heading: angle between the robot and the line at the start (degrees)
+        :param curvature: 1 / radius of the line (1/mm), positive when it bends left
+        """
+        self.name = name
+        self.on_left = on_left
+        self.backwards = backwards
+        self.distance = distance
+        self.kp = kp
+        self.kd = kd
+        self.speed = speed
+        self.offset = offset
+        self.heading = heading
+        self.curvature = curvature
+
+
+_DEFAULT_KP = line_follower.LineFollower._DEFAULT_KP
+_DEFAULT_KD = line_follower.LineFollower._DEFAULT_KD
+_DEFAULT_SPEED = line_follower.LineFollower._DEFAULT_SPEED
+
+CALL_SITES = (
+    CallSite("go_to_first_fibre.scan_blocks", True, False, 1000, _DEFAULT_KP, _DEFAULT_KD, 35),
+    CallSite("go_to_first_fibre.intersections", False, False, 1500, _DEFAULT_KP, _DEFAULT_KD, 60),
+    CallSite("go_to_first_fibre.to_yellow", False, False, 200, 1.5, 0, 15),
+    CallSite("go_to_top_row.reverse", True, True, 400, 1, 0, 40),
+    CallSite("go_to_top_row.reverse_to_line", True, True, 300, _DEFAULT_KP, _DEFAULT_KD, 40),
+    CallSite("go_to_top_row.cross", False, False, 300, _DEFAULT_KP, _DEFAULT_KD, 30),
+    CallSite("follow_to_fibre_drop", False, False, 500, 1.5, 0, 20),
+    CallSite("pickup_node.reverse", True, True, 200, 2, 0.5, 20),
+    CallSite("drop_off_node.reverse", True, True, 300, 1.5, 0.5, 20),
+    CallSite("go_red_to_middle", False, False, 400, _DEFAULT_KP, _DEFAULT_KD, _DEFAULT_SPEED),
+    CallSite("go_from_red_drop_to_line_up_third.intersections", True, False, 800, _DEFAULT_KP, _DEFAULT_KD, 50),
+    CallSite("do_second_fibre.to_first_line", False, False, 400, _DEFAULT_KP, _DEFAULT_KD, _DEFAULT_SPEED),
+    CallSite("do_second_fibre.to_second_line", True, False, 600, _DEFAULT_KP, _DEFAULT_KD, 40),
+    CallSite("do_second_fibre.to_third_line", True, False, 400, _DEFAULT_KP, _DEFAULT_KD, 30),
+    CallSite("do_second_fibre.intersections", True, False, 1500, _DEFAULT_KP, _DEFAULT_KD, _DEFAULT_SPEED),
+)
+
+
+class LinePlant:
+    """
+    Robot following the edge of a straight or curved line, in the frame of the line:
+    y is the lateral offset of the wheel axle's center from the edge (mm, positive away from the line)
+    and heading the angle between the robot and the line (rad, positive towards y).
+    """
+
+    # Approximate geometry of the robot (mm)
+    FRONT_SENSOR_OFFSET = 80  # Ahead of the wheel axle
+    BACK_SENSOR_OFFSET = 100  # Behind the wheel axle
+    LINE_WIDTH = 20
+
+    # Reflected light intensity (%) on black and white, the width of the blurred edge (mm) and the
+    # standard deviation of the noise on readings (%)
+    BLACK = 5
+    WHITE = 55
+    EDGE_WIDTH = 20
+    NOISE = 1.5
+
+    # Motor speed in % to wheel speed in mm/s
+    _MM_PER_S_PER_PERCENT = 1560 / 100 * math.pi / 180 * motors.Mover._WHEEL_RADIUS
+    _MOTOR_TIME_CONSTANT = 0.04  # First order lag of the wheel speed (s)
+
+    def __init__(self, mover, site):
+        self.mover = mover
+        self.site = site
+        # The line follower keeps the line on the side opposite to on_left when going forward
+        self._side = 1 if site.on_left != site.backwards else -1
+        sensor_offset = -self.BACK_SENSOR_OFFSET if site.backwards else self.FRONT_SENSOR_OFFSET
+        self._sensor_offset = sensor_offset
+        self.heading = math.radians(site.heading)
+        self.y = site.offset - sensor_offset * math.sin(self.heading)
+        self.travelled = 0
+        self.time = 0
+        self.left_speed = 0
+        self.right_speed = 0
+        self.lost = False
+        self._random = random.Random(site.name)  # Same noise for every candidate of a site
+
+    @property
+    def sensor_y(self):
+        return self.y + self._sensor_offset * math.sin(self.heading)
+
+    def reflected(self, now):
+        """Integrates the motion up to now and returns what the line follower's sensor reads"""
+        self.advance_to(now)
+        y = self.sensor_y
+        if y < -self.LINE_WIDTH - self.EDGE_WIDTH / 2:
+            self.lost = True  # Crossed the whole line
+        if y < -self.LINE_WIDTH / 2:
+            y = -self.LINE_WIDTH - y  # Coming out the other side of the line
+        value = (self.BLACK + self.WHITE) / 2 + (self.WHITE - self.BLACK) * y / self.EDGE_WIDTH
+        value += self._random.gauss(0, self.NOISE)
+        return int(max(self.BLACK, min(self.WHITE, value)))
+
+    def advance_to(self, now, step=0.002):
+        while self.time < now:
+            dt = min(step, now - self.time)
+            lag = dt / (self._MOTOR_TIME_CONSTANT + dt)
+            self.left_speed += (self.mover.left_speed * self._MM_PER_S_PER_PERCENT - self.left_speed) * lag
+            self.right_speed += (self.mover.right_speed * self._MM_PER_S_PER_PERCENT - self.right_speed) * lag
+
+            speed = (self.left_speed + self.right_speed) / 2
+            turn_rate = (self.right_speed - self.left_speed) / (2 * motors.Mover.CHASSIS_RADIUS)
+
+            # The line is on the side of negative y in the plant's frame, mirror for the other side
+            self.y += speed * math.sin(self.heading) * dt
+            self.heading += (turn_rate * self._side - self.site.curvature * speed) * dt
+            self.travelled += abs(speed) * dt
+            self.time += dt
+
+
+class Result:
+    def __init__(self, site, kp, kd, speed, duration, rms_error, max_error, lost):
+        self.site = site
+        self.kp = kp
+        self.kd = kd
+        self.speed = speed
+        self.duration = duration
+        self.rms_error = rms_error
+        self.max_error = max_error
+        self.lost = lost
+
+    def acceptable(self, max_error):
+        return not self.lost and self.max_error <= max_error
+
+
+def evaluate(task):
+    """Follows the call site's line with the given gains. Runs in a worker process."""
+    site_name, kp, kd, speed = task
+    site = _SITES_BY_NAME[site_name]
+
+    fake.reset()
+    fake_robot.script_on_line()
+    clock = fake.VirtualClock()
+    clock.install()
+    try:
+        mover = motors.Mover(reverse_motors=True)
+        front = sensors.EV3ColorSensor(ports.FRONT_SENSOR)
+        back = sensors.EV3ColorSensor(ports.BACK_SENSOR)
+        follower = line_follower.LineFollower(mover, front, back)
+        plant = LinePlant(mover, site)
+        fake.script_sensor(ports.BACK_SENSOR if site.backwards else ports.FRONT_SENSOR,
+                           lambda _: plant.reflected(clock.time()))
+
+        settle_distance = site.distance / 4
+        squared_error = 0
+        max_error = 0
+        cycles = 0
+        timeout = 3 * site.distance / (0.8 * speed * LinePlant._MM_PER_S_PER_PERCENT) + 1
+        profile = follower.profile(on_left=site.on_left, kp=kp, kd=kd, speed=speed, backwards=site.backwards)
+        while plant.travelled < site.distance and not plant.lost and clock.time() < timeout:
+            follower.follow_profile(profile)
+            if plant.travelled > settle_distance:
+                error = abs(plant.sensor_y)
+                squared_error += error ** 2
+                max_error = max(max_error, error)
+                cycles += 1
+
+        lost = plant.lost or plant.travelled < site.distance
+        rms_error = math.sqrt(squared_error / cycles) if cycles else float("inf")
+        return Result(site_name, kp, kd, speed, clock.time(), rms_error, max_error, lost)
+    finally:
+        clock.uninstall()
+
+
+_SITES_BY_NAME = {site.name: site for site in CALL_SITES}
+
+
+def _frange(start, stop, step):
+    count = int(round((stop - start) / step))
+    return [round(start + step * index, 3) for index in range(count + 1)]
+
+
+def candidates(site, max_speed, quick=False):
+    if quick:
+        kps = _frange(0.25, 2, 0.25)
+        kds = _frange(0, 2, 0.5)
+        speeds = range(15, max_speed + 1, 10)
+    else:
+        kps = _frange(0.1, 2.5, 0.1)
+        kds = _frange(0, 3, 0.25)
+        speeds = range(15, max_speed + 1, 5)
+    return [(site.name, kp, kd, speed) for kp, kd, speed in itertools.product(kps, kds, speeds)]
+
+
+def best(results, max_error):
+    """Fastest acceptable result, the smallest rms error breaking ties"""
+    acceptable = [result for result in results if result.acceptable(max_error)]
+    if not acceptable:
+        return None
+    return min(acceptable, key=lambda result: (result.duration, result.rms_error))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--site", action="append", choices=sorted(_SITES_BY_NAME),
+                        help="only tune this call site (can be repeated)")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--max-error", type=float, default=8,
+                        help="largest distance of the sensor from the edge once settled (mm)")
+    parser.add_argument("--max-speed", type=int, default=80,
+                        help="fastest speed to try (%%), the model doesn't know about grip or motor load")
+    parser.add_argument("--quick", action="store_true", help="search a coarser grid")
+    args = parser.parse_args(argv)
+
+    sites = [site for site in CALL_SITES if args.site is None or site.name in args.site]
+    tasks = [task for site in sites for task in candidates(site, args.max_speed, args.quick)]
+    print("Evaluating %s candidates on %s processes" % (len(tasks), args.processes))
+
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(evaluate, tasks, chunksize=64)
+    # The gains up_main.py uses today, for comparison
+    current = [evaluate((site.name, site.kp, site.kd, site.speed)) for site in sites]
+
+    print("%-48s %22s %22s" % ("call site", "current kp/kd/speed s", "best kp/kd/speed s"))
+    for site, today in zip(sites, current):
+        found = best([result for result in results if result.site == site.name], args.max_error)
+        today_text = "%.2g/%.2g/%d %s" % (site.kp, site.kd, site.speed,
+                                          "lost" if not today.acceptable(args.max_error) else "%.2f" % today.duration)
+        if found is None:
+            found_text = "none within %g mm" % args.max_error
+        else:
+            found_text = "%.2g/%.2g/%d %.2f" % (found.kp, found.kd, found.speed, found.duration)
+        print("%-48s %22s %22s" % (site.name, today_text, found_text))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())